@@ -9,8 +9,17 @@ class ActionType:
     name: str
 
 
+@dataclass
+class DateRange:
+    start: Optional[str]
+    end: Optional[str]
+
+
 @dataclass
 class Build(ActionType):
+    osm_source: str
+    osm_pbf_path: Optional[str]
+    max_workers_osm_pbf: Optional[int]
     overpass_url: str
     network_type: str
     unconnected_components: bool
@@ -20,11 +29,28 @@ class Build(ActionType):
     distance_between_points: int
     max_chunk_size_osm: int
     max_chunk_size_find: int
+    find_min_spacing: Optional[float]
+    find_refine_gaps: bool
+    pano_registry: bool
+    find_concurrency: int
+    find_max_attempts: int
+    find_chunk_size: int
+    find_poll_interval: float
+    max_workers_sv: int
+    sv_timeout: int
+    driver_recycle_after: int
     resume_sv_find_from: int
     max_chunk_retrieve_location: int
+    location_rate_limit: float
+    location_retry_attempts: int
+    location_backoff_initial: float
+    location_timeout: float
     max_chunk_size_osm_to_graph: int
     big_edges_thresh: int
     max_workers_merge: int
+    delta: bool
+    delta_probe_spacing: float
+    date_range: Optional[DateRange]
     viz: bool
 
 
@@ -43,7 +69,22 @@ class Retrieve(ActionType):
     fov: int
     pitch: int
     max_chunk_size: int
+    metadata_workers: int
+    upload_workers: int
+    queue_size: int
+    max_attempts: int
+    pano_heading_tolerance: float
+    quota_cooldown: float
+    metrics_interval: float
     public: bool
+    shards: Optional[int]
+    shard_index: Optional[int]
+    shard_tile_size: List[float]
+    manifest_source_area: Optional[str]
+    dry_run: bool
+    cost_per_1000_images: float
+    image_size_kb: float
+    request_seconds: float
 
 
 @dataclass
@@ -106,6 +147,8 @@ class SetupConfig:
     polygons_database_path: str
     models_database_path: str
     training_database_path: str
+    metadata_cache_path: str
+    image_store_path: str
 
     # Settings
     sv_name: str
@@ -115,6 +158,13 @@ class SetupConfig:
     force_compute_graph: bool
     window_split_area: List[float]
     window_overlap: int
+    window_split: str
+    window_density_source: str
+    window_target_points: int
+    window_min_area: List[float]
+    metadata_cache: bool
+    metadata_cache_ttl_days: int
+    image_store: bool
     cloud_logger: bool
     viz: bool
 
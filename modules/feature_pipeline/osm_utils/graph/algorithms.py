@@ -1,49 +1,26 @@
-from collections import deque
-from typing import Set
+import numpy as np
+from scipy.sparse import csgraph
 
-from . import graphfactory
 from .graph import Graph
 
 
-def BFS(graph: Graph, s: int) -> Set[int]:
-    seen_nodes = {s}
-    unvisited_nodes = deque([s])
-
-    while len(unvisited_nodes) > 0:
-        node_id = unvisited_nodes.popleft()
-        unseen_nodes = list(
-            filter(lambda n: n not in seen_nodes, graph.all_neighbors(node_id))
-        )
-        seen_nodes.update(unseen_nodes)
-        unvisited_nodes.extend(unseen_nodes)
-
-    return seen_nodes
-
-
 # @timer.timer
-def computeLCC(graph):
-    # repeatedly run BFS searches until all vertices have been reached
-    total_nodes = set(range(len(graph.vertices)))
-    found_nodes = []
-    while len(total_nodes) > 0:
-        f_nodes = BFS(graph, total_nodes.pop())
-        found_nodes.append(f_nodes)
-        total_nodes = total_nodes - f_nodes
-
-    if len(found_nodes) == 0:
-        return []
+def computeLCC(graph: Graph) -> np.ndarray:
+    """Returns the sorted IDs of the vertices of the largest (weakly) connected component"""
+    if graph.number_of_vertices() == 0:
+        return np.array([], dtype=np.int64)
 
-    # determine largest connected components
-    lcc = max(found_nodes, key=len)
+    _, labels = csgraph.connected_components(graph.adjacency, directed=False)
+    lcc = np.flatnonzero(labels == np.bincount(labels).argmax())
 
     print(
-        f"\t LCC contains {len(lcc)} nodes (removed { len(graph.vertices) - len(lcc)} nodes)"
+        f"\t LCC contains {len(lcc)} nodes (removed { graph.number_of_vertices() - len(lcc)} nodes)"
     )
 
     return lcc
 
 
 def computeLCCGraph(graph: Graph) -> Graph:
-    lcc = computeLCC(graph)
-    new_nodes = [graph.vertices[id] for id in lcc]
-    return graphfactory.build_graph_from_vertices_edges(new_nodes, graph.edges)
+    lcc_mask = np.zeros(graph.number_of_vertices(), dtype=bool)
+    lcc_mask[computeLCC(graph)] = True
+    return graph.subgraph(lcc_mask)
@@ -1,10 +1,9 @@
-from collections import defaultdict, deque
-from dataclasses import replace
-from typing import DefaultDict, List, Set, Tuple
+from collections import deque
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
 
-from . import graphfactory
 from .graph import Graph
-from .graph_types import Edge, Vertex
 
 
 class ContractGraph:
@@ -13,18 +12,34 @@ class ContractGraph:
 
     # @timer.timer
     def contract(self):
-        self.out_edges_per_node = self._get_out_edges()
+        g = self.graph
+
+        # Plain lists are used for the (scalar) walks, which is faster than indexing arrays
+        self.edge_s = g.edge_s.tolist()
+        self.edge_t = g.edge_t.tolist()
+        self.backward = g.backward.tolist()
+        self.length = g.length.tolist()
+        self.osm_id = g.osm_id.tolist()
+        self.edge_key = list(
+            zip(g.highway.tolist(), g.max_v.tolist(), g.name.tolist(), self.backward)
+        )
+        self.intersections = (g.degree() != 2).tolist()
+        indptr, out_edges = g.out_edges()
+        indptr, out_edges = indptr.tolist(), out_edges.tolist()
+        self.out_edges_per_node = [
+            out_edges[indptr[i] : indptr[i + 1]] for i in range(g.number_of_vertices())
+        ]
+
         all_new_edges = self._find_new_edges()
         node_ids = self._gather_node_ids(all_new_edges)
-        nodes = self._get_nodes(node_ids)
 
         print(
-            f"finished contracting: {len(all_new_edges)}/{len(self.graph.edges)} edges and {len(nodes)}/{len(self.graph.vertices)} vertices."
+            f"finished contracting: {len(all_new_edges)}/{g.number_of_edges()} edges and {len(node_ids)}/{g.number_of_vertices()} vertices."
         )
 
-        return graphfactory.build_graph_from_vertices_edges(nodes, all_new_edges)
+        return self._build_contracted_graph(all_new_edges, node_ids)
 
-    def _find_new_edges(self) -> Set[Edge]:
+    def _find_new_edges(self) -> List[Tuple[int, int, int, float]]:
         #  maintain a list L of nodes from which we want to start searches to find new contracted edges
         #  initialize L with all intersection nodes (i.e., all nodes with degree != 2)
         #   for each node n in L
@@ -32,16 +47,16 @@ class ContractGraph:
         #       search until:
         #           - an intersection node is found or edge is found
         #           - the next edge is different in it's structure (e.g., different highway type, different max speed, ...)
+        # new edges are (source, target, first merged edge ID, total length)
         self.start_nodes = self._find_all_intersections()
         self.seen_start_nodes = set(self.start_nodes)
-        new_edges = set()
+        new_edges: Dict[Tuple, Tuple[int, int, int, float]] = {}
         bidirectional_edges: Set[Tuple[int, int]] = set()
 
-        out_edges_per_node = self._get_out_edges()
         while len(self.start_nodes) > 0:
             node_id = self.start_nodes.popleft()
 
-            out_edges = out_edges_per_node[node_id]
+            out_edges = self.out_edges_per_node[node_id]
             for first_out_edge in out_edges:
                 start_node_id = node_id
 
@@ -52,47 +67,47 @@ class ContractGraph:
                 if len(edges_to_merge) == 0:
                     continue
 
-                sum_edge_lengths = sum(e.data.length for e in edges_to_merge)
-                data = replace(edges_to_merge[0].data, length=sum_edge_lengths)
+                sum_edge_lengths = sum(self.length[e] for e in edges_to_merge)
+                first_edge = edges_to_merge[0]
 
-                if edges_to_merge[0].backward:
+                if self.backward[first_edge]:
                     #  deduplication measure; if not for this for bidirectional edges, that are
                     #  removed between intersections, 2 new edges would be created
-                    smaller_node_id = (
-                        start_node_id
-                        if start_node_id < final_node_id
-                        else final_node_id
-                    )
-                    bigger_node_id = (
-                        start_node_id
-                        if start_node_id > final_node_id
-                        else final_node_id
-                    )
+                    smaller_node_id = min(start_node_id, final_node_id)
+                    bigger_node_id = max(start_node_id, final_node_id)
                     if (smaller_node_id, bigger_node_id) in bidirectional_edges:
                         # already added this edge skip it
                         continue
                     bidirectional_edges.add((smaller_node_id, bigger_node_id))
-                    merged_edge = Edge(
+                    merged_edge = (
                         smaller_node_id,
                         bigger_node_id,
-                        True,
-                        edges_to_merge[0].backward,
-                        data,
+                        first_edge,
+                        sum_edge_lengths,
                     )
                 else:
-                    merged_edge = Edge(
+                    merged_edge = (
                         start_node_id,
                         final_node_id,
-                        True,
-                        edges_to_merge[0].backward,
-                        data,
+                        first_edge,
+                        sum_edge_lengths,
                     )
-                new_edges.add(merged_edge)
-        return new_edges
+
+                # identical merged edges are kept once
+                key = (
+                    merged_edge[0],
+                    merged_edge[1],
+                    self.edge_key[first_edge],
+                    self.osm_id[first_edge],
+                    sum_edge_lengths,
+                )
+                new_edges.setdefault(key, merged_edge)
+
+        return list(new_edges.values())
 
     def _find_edges_to_merge(
-        self, start_node_id: int, first_out_edge: Edge
-    ) -> Tuple[List[Edge], int]:
+        self, start_node_id: int, first_out_edge: int
+    ) -> Tuple[List[int], int]:
         # walk from start_node along first_out_edge until:
         #  i) another intersection node is found
         #  ii) an edge is encountered on the way that is different (different name, max_speed, ...)
@@ -102,22 +117,22 @@ class ContractGraph:
         current_node_id = start_node_id
         while True:
             used_edges.append(out_edge)
-            next_node_id = out_edge.t if out_edge.s == current_node_id else out_edge.s
+            s, t = self.edge_s[out_edge], self.edge_t[out_edge]
+            next_node_id = t if s == current_node_id else s
 
             if next_node_id == start_node_id:
                 # detected a loop => remove it
                 used_edges = []
                 break
 
-            if self._is_intersection(next_node_id):
+            if self.intersections[next_node_id]:
                 break
 
-            next_out_edges = list(
-                filter(
-                    lambda e: current_node_id not in (e.s, e.t),
-                    self.out_edges_per_node[next_node_id],
-                )
-            )
+            next_out_edges = [
+                e
+                for e in self.out_edges_per_node[next_node_id]
+                if current_node_id not in (self.edge_s[e], self.edge_t[e])
+            ]
 
             if len(next_out_edges) == 0:
                 # detected a dead end => stop
@@ -128,7 +143,7 @@ class ContractGraph:
                 assert False
 
             next_out_edge = next_out_edges[0]
-            if self._is_not_same_edge(out_edge, next_out_edge):
+            if self.edge_key[out_edge] != self.edge_key[next_out_edge]:
                 if next_node_id not in self.seen_start_nodes:
                     # found a new possible start node
                     self.seen_start_nodes.add(next_node_id)
@@ -142,37 +157,42 @@ class ContractGraph:
         final_node_id = next_node_id
         return used_edges, final_node_id
 
-    def _is_not_same_edge(self, e1: Edge, e2: Edge) -> bool:
-        return (
-            e1.data.highway != e2.data.highway
-            or e1.data.max_v != e2.data.max_v
-            or e1.data.name != e2.data.name
-            or e1.backward != e2.backward
-        )
-
-    def _get_out_edges(self) -> DefaultDict[int, List[Edge]]:
-        result: DefaultDict[int, List[Edge]] = defaultdict(list)
-        for e in self.graph.edges:
-            if e.forward:
-                result[e.s].append(e)
-            if e.backward:
-                result[e.t].append(e)
-        return result
-
     def _find_all_intersections(self) -> deque:
-        node_ids = range(0, len(self.graph.vertices))
-        return deque(filter(self._is_intersection, node_ids))
-
-    def _get_nodes(self, node_ids: Set[int]) -> List[Vertex]:
-        return list(map(self.graph.get_node, node_ids))
+        return deque(
+            node_id
+            for node_id, intersection in enumerate(self.intersections)
+            if intersection
+        )
 
-    def _gather_node_ids(self, edges: List[Edge]) -> Set[int]:
+    def _gather_node_ids(self, edges: List[Tuple[int, int, int, float]]) -> np.ndarray:
         print("\t gathering nodes...")
         node_ids = set()
-        for e in edges:
-            node_ids.add(e.s)
-            node_ids.add(e.t)
-        return node_ids
-
-    def _is_intersection(self, node_id: int) -> bool:
-        return len(self.graph.all_neighbors(node_id)) != 2
+        for s, t, _, _ in edges:
+            node_ids.add(s)
+            node_ids.add(t)
+        return np.array(sorted(node_ids), dtype=np.int64)
+
+    def _build_contracted_graph(
+        self, edges: List[Tuple[int, int, int, float]], node_ids: np.ndarray
+    ) -> Graph:
+        g = self.graph
+        sources = np.array([e[0] for e in edges], dtype=np.int64)
+        targets = np.array([e[1] for e in edges], dtype=np.int64)
+        first_edges = np.array([e[2] for e in edges], dtype=np.int64)
+        lengths = np.array([e[3] for e in edges], dtype=np.float64)
+
+        return Graph(
+            g.lat[node_ids],
+            g.lon[node_ids],
+            np.searchsorted(node_ids, sources),
+            np.searchsorted(node_ids, targets),
+            np.ones(len(edges), dtype=bool),
+            g.backward[first_edges],
+            lengths,
+            g.highway[first_edges],
+            g.max_v[first_edges],
+            g.name[first_edges],
+            g.osm_id[first_edges],
+            g.highway_categories,
+            g.name_categories,
+        )
@@ -7,14 +7,35 @@ except ImportError:
 def convert_to_networkx(graph):
     out_graph = nx.DiGraph()
 
-    for v in graph.vertices:
-        data_dict = {s: getattr(v.data, s) for s in v.data.__slots__}
-        out_graph.add_node(v.id, **data_dict)
+    out_graph.add_nodes_from(
+        (node_id, {"lat": lat, "lon": lon})
+        for node_id, (lat, lon) in enumerate(
+            zip(graph.lat.tolist(), graph.lon.tolist())
+        )
+    )
 
-    for e in graph.edges:
-        data_dict = {s: getattr(e.data, s) for s in e.data.__slots__}
-        out_graph.add_edge(e.s, e.t, **data_dict)
-        if e.backward:
-            out_graph.add_edge(e.t, e.s, **data_dict)
+    edges_data = [
+        {
+            "length": length,
+            "highway": graph.highway_categories[highway],
+            "max_v": max_v,
+            "name": graph.name_categories[name],
+            "osm_id": osm_id,
+        }
+        for length, highway, max_v, name, osm_id in zip(
+            graph.length.tolist(),
+            graph.highway.tolist(),
+            graph.max_v.tolist(),
+            graph.name.tolist(),
+            graph.osm_id.tolist(),
+        )
+    ]
+
+    for s, t, backward, data_dict in zip(
+        graph.edge_s.tolist(), graph.edge_t.tolist(), graph.backward.tolist(), edges_data
+    ):
+        out_graph.add_edge(s, t, **data_dict)
+        if backward:
+            out_graph.add_edge(t, s, **data_dict)
 
     return out_graph
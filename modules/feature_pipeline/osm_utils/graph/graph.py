@@ -1,41 +1,141 @@
-from typing import List
+from functools import cached_property
+from typing import List, Tuple
 
-from .graph_types import Edge, Vertex
+import numpy as np
+from scipy import sparse
+
+from .graph_types import Edge, EdgeData, Vertex, VertexData
 
 
 class Graph:
-    def __init__(self) -> None:
-        self.edges: List[Edge] = []
-        self.vertices: List[Vertex] = []
-        self.outneighbors: List[List[int]] = []
-        self.inneighbors: List[List[int]] = []
+    """
+    Array-backed road graph.
+
+    Vertices are indexed by their ID and described by lat/lon arrays. Edges are described by parallel
+    arrays (source, target, direction flags, length, maximum speed, OSM way ID); highway types and
+    street names are categorical codes into highway_categories and name_categories.
+    The undirected adjacency is an int32 CSR matrix, built on first use.
+    """
+
+    def __init__(
+        self,
+        lat: np.ndarray,
+        lon: np.ndarray,
+        edge_s: np.ndarray,
+        edge_t: np.ndarray,
+        forward: np.ndarray,
+        backward: np.ndarray,
+        length: np.ndarray,
+        highway: np.ndarray,
+        max_v: np.ndarray,
+        name: np.ndarray,
+        osm_id: np.ndarray,
+        highway_categories: List[str],
+        name_categories: List[str],
+    ) -> None:
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.edge_s = np.asarray(edge_s, dtype=np.int32)
+        self.edge_t = np.asarray(edge_t, dtype=np.int32)
+        self.forward = np.asarray(forward, dtype=bool)
+        self.backward = np.asarray(backward, dtype=bool)
+        self.length = np.asarray(length, dtype=np.float64)
+        self.highway = np.asarray(highway, dtype=np.int32)
+        self.max_v = np.asarray(max_v, dtype=np.int32)
+        self.name = np.asarray(name, dtype=np.int32)
+        self.osm_id = np.asarray(osm_id, dtype=np.int64)
+        self.highway_categories = highway_categories
+        self.name_categories = name_categories
+
+    def number_of_vertices(self) -> int:
+        return len(self.lat)
+
+    def number_of_edges(self) -> int:
+        return len(self.edge_s)
+
+    @cached_property
+    def adjacency(self) -> sparse.csr_matrix:
+        """Undirected adjacency matrix, without duplicated neighbors"""
+        n = self.number_of_vertices()
+        rows = np.concatenate([self.edge_s, self.edge_t])
+        cols = np.concatenate([self.edge_t, self.edge_s])
+        adjacency = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n, n)
+        )
+        adjacency.sum_duplicates()
+
+        return adjacency
 
-    def add_edge(self, edge: Edge) -> None:
-        self.edges.append(edge)
+    def degree(self) -> np.ndarray:
+        """Number of distinct neighbors of each vertex, in any direction"""
+        return np.diff(self.adjacency.indptr)
 
-        if edge.forward:
-            self.outneighbors[edge.s].append(edge.t)
-            self.inneighbors[edge.t].append(edge.s)
+    def all_neighbors(self, node_id: int) -> List[int]:
+        indptr = self.adjacency.indptr
+        return self.adjacency.indices[indptr[node_id] : indptr[node_id + 1]].tolist()
+
+    def out_edges(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        CSR lists of the edges that can be used to leave each vertex
+        Returns:
+            (indptr, edge IDs), such that edge IDs[indptr[v]:indptr[v + 1]] are the out edges of v
+        """
+        edge_ids = np.arange(self.number_of_edges())
+        nodes = np.concatenate([self.edge_s[self.forward], self.edge_t[self.backward]])
+        edge_ids = np.concatenate([edge_ids[self.forward], edge_ids[self.backward]])
 
-        if edge.backward:
-            self.outneighbors[edge.t].append(edge.s)
-            self.inneighbors[edge.s].append(edge.t)
+        # Keep the edges order for each vertex
+        order = np.lexsort((edge_ids, nodes))
+        indptr = np.zeros(self.number_of_vertices() + 1, dtype=np.int64)
+        np.cumsum(np.bincount(nodes, minlength=self.number_of_vertices()), out=indptr[1:])
 
-    def add_node(self, vertex: Vertex) -> None:
-        self.vertices.append(vertex)
-        self.outneighbors.append([])
-        self.inneighbors.append([])
+        return indptr, edge_ids[order]
 
     def get_node(self, node_id: int) -> Vertex:
-        return self.vertices[node_id]
+        return Vertex(
+            node_id, VertexData(float(self.lat[node_id]), float(self.lon[node_id]))
+        )
+
+    def get_edge(self, edge_id: int) -> Edge:
+        data = EdgeData(
+            length=float(self.length[edge_id]),
+            highway=self.highway_categories[self.highway[edge_id]],
+            max_v=int(self.max_v[edge_id]),
+            name=self.name_categories[self.name[edge_id]],
+            osm_id=int(self.osm_id[edge_id]),
+        )
+        return Edge(
+            int(self.edge_s[edge_id]),
+            int(self.edge_t[edge_id]),
+            bool(self.forward[edge_id]),
+            bool(self.backward[edge_id]),
+            data,
+        )
 
     def edge_description(self, edge_id):
-        return f"{self.edges[edge_id].description}"
+        return f"{self.get_edge(edge_id).description}"
 
     def edge_name(self, edge_id):
-        return f"{self.edges[edge_id].name}"
+        return f"{self.name_categories[self.name[edge_id]]}"
 
-    def all_neighbors(self, node_id: int) -> List[int]:
-        return list(
-            set(self.outneighbors[node_id]).union(set(self.inneighbors[node_id]))
+    def subgraph(self, node_mask: np.ndarray) -> "Graph":
+        """Keeps the vertices selected by the boolean mask (with new consecutive IDs), and the edges between them"""
+        new_ids = np.full(self.number_of_vertices(), -1, dtype=np.int64)
+        new_ids[node_mask] = np.arange(np.count_nonzero(node_mask))
+        keep = node_mask[self.edge_s] & node_mask[self.edge_t]
+
+        return Graph(
+            self.lat[node_mask],
+            self.lon[node_mask],
+            new_ids[self.edge_s[keep]],
+            new_ids[self.edge_t[keep]],
+            self.forward[keep],
+            self.backward[keep],
+            self.length[keep],
+            self.highway[keep],
+            self.max_v[keep],
+            self.name[keep],
+            self.osm_id[keep],
+            self.highway_categories,
+            self.name_categories,
         )
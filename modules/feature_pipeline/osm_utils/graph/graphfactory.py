@@ -1,8 +1,7 @@
-from dataclasses import replace
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Tuple
 
+import numpy as np
 from graph.graph import Graph
-from graph.graph_types import Edge, EdgeData, Vertex, VertexData
 from osm.osm_types import OSMNode, OSMWay
 
 from ..utils import geo_tools
@@ -15,171 +14,162 @@ def build_graph_from_osm(
     enrich: bool = False,
     distance_between_points: int = 0,
 ) -> Graph:
-    g = Graph()
-
     # 1. create mapping to 0 based index nodes
     node_ids = nodes.keys()
     id_mapper = dict(zip(node_ids, range(len(node_ids))))
+    lat = np.array([n.lat for n in nodes.values()], dtype=np.float64)
+    lon = np.array([n.lon for n in nodes.values()], dtype=np.float64)
 
-    # 2. add nodes and edges
-    _add_nodes(g, id_mapper, nodes)
+    # 2. build edges of all way segments
+    sources, targets, way_indexes = _way_segments(id_mapper, ways)
 
     if enrich:
-        # This funtion already adds edges to enriched graph
-        _enrich_graph(g, id_mapper, ways, distance_between_points)
-    else:
-        _add_edges(g, id_mapper, ways)
-
-    return g
-
-
-def _add_nodes(g: Graph, id_mapper: Dict[int, int], nodes: Dict[int, OSMNode]) -> None:
-    for n in nodes.values():
-        g.add_node(Vertex(id_mapper[n.osm_id], data=VertexData(n.lat, n.lon)))
-
-
-def _add_generated_nodes(
-    g: Graph, id_mapper: Dict[int, int], gen_nodes: List[Optional[Tuple[float, float]]]
-) -> Tuple[Dict[int, int], List[int]]:
-    new_nodes_ids = []
-    for n in gen_nodes:
-        gen_node_id = max(list(id_mapper.values())) + 1
-        id_mapper[-abs(gen_node_id)] = gen_node_id
-        g.add_node(Vertex(gen_node_id, data=VertexData(n[0], n[1])))
-        new_nodes_ids.append(gen_node_id)
-    return id_mapper, new_nodes_ids
-
-
-def _generate_points(
-    lat1: float, lon1: float, lat2: float, lon2: float, distance_between_points=0.05
-):
+        # Split segments with generated nodes, with IDs following the existing ones
+        gen_lat, gen_lon, sources, targets, edges_segment = _densify_segments(
+            lat, lon, sources, targets, len(lat), distance_between_points
+        )
+        lat = np.concatenate([lat, gen_lat])
+        lon = np.concatenate([lon, gen_lon])
+        way_indexes = way_indexes[edges_segment]
+
+    return _build_graph(lat, lon, ways, sources, targets, way_indexes)
+
+
+def _way_segments(
+    id_mapper: Dict[int, int], ways: List[OSMWay]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the (source, target, way index) arrays of all the consecutive node pairs of the ways"""
+    sources, targets, way_indexes = [], [], []
+    for way_index, w in enumerate(ways):
+        ids = [id_mapper[n] for n in w.nodes]
+        sources.extend(ids[:-1])
+        targets.extend(ids[1:])
+        way_indexes.extend([way_index] * (len(ids) - 1))
+
+    return (
+        np.array(sources, dtype=np.int64),
+        np.array(targets, dtype=np.int64),
+        np.array(way_indexes, dtype=np.int64),
+    )
+
+
+def _densify_segments(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    first_id: int,
+    distance_between_points: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
-    Generate points along a straight line between two given points with a specified
-    distance between them.
+    Splits all the segments at once, with generated points every ~distance_between_points meters
+    Args:
+        lat: latitudes of the existing vertices, by ID
+        lon: longitudes of the existing vertices, by ID
+        sources: segments source vertex IDs
+        targets: segments target vertex IDs
+        first_id: ID of the first generated vertex (IDs are then allocated consecutively)
+        distance_between_points: distance between generated points, in meters
+
+    Returns:
+        (generated lat, generated lon, edges source IDs, edges target IDs, edges segment index)
     """
-    # Calculate the initial distance in meters between the two points
-    total_distance = geo_tools.distance(lat1, lon1, lat2, lon2)
-
-    # Calculate the number of points to generate
-    num_points = int(total_distance / distance_between_points)
-
-    if num_points == 0:
-        return []
-    # Calculate the increment in latitude and longitude for each point
-    delta_lat = (lat2 - lat1) / num_points
-    delta_lon = (lon2 - lon1) / num_points
-
-    # Generate the points
-    points = [
-        (lat1 + i * delta_lat, lon1 + i * delta_lon) for i in range(1, num_points)
-    ]
-
-    return points
-
-
-def _enrich_graph(
-    g: Graph,
-    id_mapper: Dict[int, int],
+    nr_segments = len(sources)
+    lat1, lon1, lat2, lon2 = lat[sources], lon[sources], lat[targets], lon[targets]
+
+    # Number of sub-segments of each segment (points at 1..num_points-1 are generated)
+    num_points = np.zeros(nr_segments, dtype=np.int64)
+    if distance_between_points > 0:
+        total_distance = geo_tools.distance(lat1, lon1, lat2, lon2)
+        num_points = (total_distance / distance_between_points).astype(np.int64)
+    nr_generated = np.maximum(num_points - 1, 0)
+
+    # Interpolate the generated points of all the segments
+    segment_of_point = np.repeat(np.arange(nr_segments), nr_generated)
+    first_point = np.cumsum(nr_generated) - nr_generated
+    step = np.arange(len(segment_of_point)) - first_point[segment_of_point] + 1
+    fraction = step / num_points[segment_of_point]
+    gen_lat = lat1[segment_of_point] + fraction * (lat2 - lat1)[segment_of_point]
+    gen_lon = lon1[segment_of_point] + fraction * (lon2 - lon1)[segment_of_point]
+
+    # Chains of vertex IDs: source, generated points, target, for each segment
+    chain_length = nr_generated + 2
+    chain_start = np.cumsum(chain_length) - chain_length
+    chain = np.empty(chain_length.sum(), dtype=np.int64)
+    is_generated = np.ones(len(chain), dtype=bool)
+    is_generated[chain_start] = False
+    is_generated[chain_start + chain_length - 1] = False
+    chain[chain_start] = sources
+    chain[chain_start + chain_length - 1] = targets
+    chain[is_generated] = first_id + np.arange(len(segment_of_point))
+
+    # Consecutive chain elements form edges, except across segments
+    is_edge = np.ones(max(len(chain) - 1, 0), dtype=bool)
+    is_edge[(chain_start + chain_length - 1)[:-1]] = False
+    edges_source = chain[:-1][is_edge]
+    edges_target = chain[1:][is_edge]
+    edges_segment = np.repeat(np.arange(nr_segments), nr_generated + 1)
+
+    return gen_lat, gen_lon, edges_source, edges_target, edges_segment
+
+
+def _categorize(values: List[str]) -> Tuple[np.ndarray, List[str]]:
+    """Encodes strings as codes into the list of their distinct values"""
+    categories: Dict[str, int] = {}
+    codes = np.array(
+        [categories.setdefault(v, len(categories)) for v in values], dtype=np.int32
+    )
+
+    return codes, list(categories)
+
+
+def _build_graph(
+    lat: np.ndarray,
+    lon: np.ndarray,
     ways: List[OSMWay],
-    distance_between_points: int = 0,
-) -> None:
-    bidirectional_edges: Dict[Tuple[int, int], int] = {}
-    for w in ways:
-        for i in range(len(w.nodes) - 1):
-            s_id, t_id = id_mapper[w.nodes[i]], id_mapper[w.nodes[i + 1]]
-            s, t = g.vertices[s_id], g.vertices[t_id]
-
-            generated_points = _generate_points(
-                s.data.lat, s.data.lon, t.data.lat, t.data.lon, distance_between_points
-            )
-            id_mapper, new_nodes_ids = _add_generated_nodes(
-                g, id_mapper, generated_points
-            )
-
-            all_points = (
-                [(s.data.lat, s.data.lon)]
-                + generated_points
-                + [(t.data.lat, t.data.lon)]
-            )
-            all_ids = [s_id] + new_nodes_ids + [t_id]
-            for j in range(len(all_points) - 1):
-                length = round(
-                    geo_tools.distance(
-                        all_points[j][0],
-                        all_points[j][1],
-                        all_points[j + 1][0],
-                        all_points[j + 1][1],
-                    ),
-                    2,
-                )
-                data = EdgeData(
-                    length=length,
-                    highway=w.highway,
-                    max_v=w.max_speed_int,
-                    name=w.name,
-                    osm_id=w.osm_id,
-                )
-                start_id = all_ids[j]
-                stop_id = all_ids[j + 1]
-                edge = Edge(start_id, stop_id, w.forward, w.backward, data=data)
-
-                if w.forward and w.backward:
-                    smaller, bigger = min(start_id, stop_id), max(start_id, stop_id)
-                    if (smaller, bigger) in bidirectional_edges:
-                        print(
-                            f"found duplicated bidirectional edge {(smaller, bigger)}"
-                        )
-                        print(
-                            f"(osm ids {w.osm_id} and {bidirectional_edges[(smaller, bigger)]})... skipping one"
-                        )
-                        continue
-                    bidirectional_edges[(smaller, bigger)] = w.osm_id
-
-                g.add_edge(edge)
-
-
-def _add_edges(g: Graph, id_mapper: Dict[int, int], ways: List[OSMWay]) -> None:
-    bidirectional_edges: Dict[Tuple[int, int], int] = {}
-    for w in ways:
-        for i in range(len(w.nodes) - 1):
-            s_id, t_id = id_mapper[w.nodes[i]], id_mapper[w.nodes[i + 1]]
-            s, t = g.vertices[s_id], g.vertices[t_id]
-            length = round(
-                geo_tools.distance(s.data.lat, s.data.lon, t.data.lat, t.data.lon), 2
-            )
-            data = EdgeData(
-                length=length, highway=w.highway, max_v=w.max_speed_int, name=w.name
-            )
-            edge = Edge(s_id, t_id, w.forward, w.backward, data=data)
-            if w.forward and w.backward:
-                smaller, bigger = min(s_id, t_id), max(s_id, t_id)
-                if (smaller, bigger) in bidirectional_edges:
-                    print(f"found duplicated bidirectional edge {(smaller, bigger)}")
-                    print(
-                        f"(osm ids {w.osm_id} and {bidirectional_edges[(smaller, bigger)]})... skipping one"
-                    )
-                    continue
-                bidirectional_edges[(smaller, bigger)] = w.osm_id
-
-            g.add_edge(edge)
-
-
-# @timer.timer
-def build_graph_from_vertices_edges(vertices: List[Vertex], edges: List[Edge]) -> Graph:
-    g = Graph()
-
-    # 1. add all nodes and create mapping to 0 based index nodes
-    vertex_ids = set(v.id for v in vertices)
-    id_mapper = dict(zip(vertex_ids, range(len(vertex_ids))))
-    for v in vertices:
-        g.add_node(Vertex(id_mapper[v.id], v.data))
-
-    # 2. create edges with proper node ids
-    valid_edges = [e for e in edges if e.s in vertex_ids and e.t in vertex_ids]
-    new_edges = [replace(e, s=id_mapper[e.s], t=id_mapper[e.t]) for e in valid_edges]
-
-    # 3. add those new edges to the graph
-    for e in new_edges:
-        g.add_edge(e)
-
-    return g
+    sources: np.ndarray,
+    targets: np.ndarray,
+    way_indexes: np.ndarray,
+) -> Graph:
+    """Builds the graph with the attributes of their way; duplicated bidirectional edges are kept once"""
+    way_forward = np.array([w.forward for w in ways], dtype=bool)
+    way_backward = np.array([w.backward for w in ways], dtype=bool)
+    way_max_v = np.array([w.max_speed_int for w in ways], dtype=np.int32)
+    way_osm_id = np.array([w.osm_id for w in ways], dtype=np.int64)
+    way_highway, highway_categories = _categorize([w.highway for w in ways])
+    way_name, name_categories = _categorize([w.name for w in ways])
+
+    # Keep the first occurrence of each bidirectional edge
+    bidirectional = way_forward[way_indexes] & way_backward[way_indexes]
+    bidirectional_ids = np.flatnonzero(bidirectional)
+    pair_keys = np.minimum(sources, targets) * max(len(lat), 1) + np.maximum(
+        sources, targets
+    )
+    _, first = np.unique(pair_keys[bidirectional_ids], return_index=True)
+    keep = ~bidirectional
+    keep[bidirectional_ids[first]] = True
+    if not keep.all():
+        print(
+            f"found {np.count_nonzero(~keep)} duplicated bidirectional edges... skipping them"
+        )
+
+    sources, targets, way_indexes = sources[keep], targets[keep], way_indexes[keep]
+    lengths = np.round(
+        geo_tools.distance(lat[sources], lon[sources], lat[targets], lon[targets]), 2
+    )
+
+    return Graph(
+        lat,
+        lon,
+        sources,
+        targets,
+        way_forward[way_indexes],
+        way_backward[way_indexes],
+        lengths,
+        way_highway[way_indexes],
+        way_max_v[way_indexes],
+        way_name[way_indexes],
+        way_osm_id[way_indexes],
+        highway_categories,
+        name_categories,
+    )
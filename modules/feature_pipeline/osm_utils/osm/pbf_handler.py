@@ -0,0 +1,65 @@
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import osmium
+except ImportError:
+    osmium = None
+
+from .osm_types import OSMNode, OSMWay
+from .way_parser_helper import WayParserHelper
+
+
+class PBFHandler(osmium.SimpleHandler if osmium is not None else object):
+    """
+    Reads the accepted ways of an .osm.pbf extract, together with the coordinates of their nodes.
+    Node locations are resolved by osmium while streaming, so only referenced nodes are kept.
+    If a bbox (min_lon, max_lon, min_lat, max_lat) is given, only ways with a node inside it are kept.
+    """
+
+    def __init__(
+        self,
+        parser_helper: WayParserHelper,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+    ) -> None:
+        if osmium is None:
+            raise ImportError(
+                "Reading .osm.pbf files requires pyosmium: `pip install osmium`"
+            )
+        super().__init__()
+        self.parser_helper = parser_helper
+        self.bbox = bbox
+        self.found_ways: List[OSMWay] = []
+        self.nodes: Dict[int, OSMNode] = {}
+
+    def way(self, w) -> None:
+        osm_way = OSMWay(osm_id=w.id)
+        for tag in w.tags:
+            self.parser_helper.parse_tag(osm_way, tag.k, tag.v)
+
+        if not self.parser_helper.finalize_way(osm_way):
+            return
+
+        if self.bbox is not None and not self._intersects_bbox(w):
+            return
+
+        for node_ref in w.nodes:
+            osm_way.add_node(node_ref.ref)
+            if node_ref.ref not in self.nodes and node_ref.location.valid():
+                self.nodes[node_ref.ref] = OSMNode(
+                    node_ref.ref, node_ref.location.lat, node_ref.location.lon
+                )
+
+        self.found_ways.append(osm_way)
+
+    def _intersects_bbox(self, w) -> bool:
+        min_lon, max_lon, min_lat, max_lat = self.bbox
+        for node_ref in w.nodes:
+            location = node_ref.location
+            if (
+                location.valid()
+                and min_lon <= location.lon <= max_lon
+                and min_lat <= location.lat <= max_lat
+            ):
+                return True
+
+        return False
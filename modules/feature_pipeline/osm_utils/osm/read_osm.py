@@ -1,69 +1,83 @@
 import bz2
+import gzip
+import io
 import xml.sax
-from typing import Dict, List, Set, Tuple
+from typing import BinaryIO, Dict, List, Optional, Tuple
 
-from ..utils import timer
 from .osm_types import OSMNode, OSMWay
+from .pbf_handler import PBFHandler
 from .way_parser_helper import WayParserHelper
-from .xml_handler import NodeHandler, PercentageFile, WayHandler
+from .xml_handler import OSMHandler
+
+MAGIC_BZ2 = b"\x42\x5a\x68"
+MAGIC_GZIP = b"\x1f\x8b"
 
 
 # @timer.timer
 def read_file(
-    osm_filename, configuration, cloud_decompression=None
+    osm_filename,
+    configuration,
+    osm_stream: Optional[BinaryIO] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
 ) -> Tuple[Dict[int, OSMNode], List[OSMWay]]:
-    parserHelper = WayParserHelper(configuration)
-    if cloud_decompression is not None:
-        decompressed_content = cloud_decompression
-    else:
-        decompressed_content = decompress_content(osm_filename)
-    if decompressed_content:
-        ways, found_node_ids = _read_ways(decompressed_content, parserHelper)
-        nodes = _read_nodes(decompressed_content, found_node_ids)
-    else:
-        ways, found_node_ids = _read_ways(PercentageFile(osm_filename), parserHelper)
-        nodes = _read_nodes(PercentageFile(osm_filename), found_node_ids)
+    """
+    Reads the nodes and accepted ways of an OSM file, in a single pass
+    Args:
+        osm_filename: path of an OSM XML file (plain, gzip or bz2) or of an .osm.pbf extract
+        configuration: Configuration instance
+        osm_stream: binary stream of the OSM XML file, read instead of osm_filename (e.g. a GCS blob reader)
+        bbox: (min_lon, max_lon, min_lat, max_lat) used to skip ways of an .osm.pbf extract outside of it
+
+    Returns:
+        (nodes, ways) with nodes being only the ones referenced by the accepted ways
+    """
+    parser_helper = WayParserHelper(configuration)
+
+    if osm_stream is None and osm_filename.endswith(".pbf"):
+        return _read_pbf(osm_filename, parser_helper, bbox)
+
+    if osm_stream is None:
+        osm_stream = open(osm_filename, "rb")
 
-    return nodes, ways
+    with osm_stream, decompress_stream(osm_stream) as stream:
+        return _read_xml(stream, parser_helper)
 
 
-def decompress_content(osm_filename):
-    magic_bz2 = "\x42\x5a\x68"
+def decompress_stream(osm_stream: BinaryIO) -> BinaryIO:
+    """Wraps a binary stream with a streaming gzip/bz2 decompressor, based on its magic bytes"""
+    if not hasattr(osm_stream, "peek"):
+        osm_stream = io.BufferedReader(osm_stream)
 
-    with open(osm_filename, "r", encoding="utf-8", errors="replace") as f:
-        content_begin = f.read(10)
+    content_begin = osm_stream.peek(len(MAGIC_BZ2))[: len(MAGIC_BZ2)]
 
-    if content_begin.startswith(magic_bz2):
-        f = bz2.open(osm_filename, "rb")
-        content = f.read()
-        return content
+    if content_begin.startswith(MAGIC_BZ2):
+        return bz2.BZ2File(osm_stream, "rb")
+    if content_begin.startswith(MAGIC_GZIP):
+        return gzip.GzipFile(fileobj=osm_stream, mode="rb")
 
-    return None
+    return osm_stream
 
 
 # @timer.timer
-def _read_ways(osm_file, configuration) -> Tuple[List[OSMWay], Set[int]]:
+def _read_xml(
+    osm_stream: BinaryIO, parser_helper: WayParserHelper
+) -> Tuple[Dict[int, OSMNode], List[OSMWay]]:
     parser = xml.sax.make_parser()
-    w_handler = WayHandler(configuration)
+    handler = OSMHandler(parser_helper)
 
-    parser.setContentHandler(w_handler)
-    if isinstance(osm_file, PercentageFile):
-        parser.parse(osm_file)
-    else:
-        xml.sax.parseString(osm_file, w_handler)
+    parser.setContentHandler(handler)
+    parser.parse(osm_stream)
 
-    return w_handler.found_ways, w_handler.found_nodes
+    return handler.nodes, handler.found_ways
 
 
 # @timer.timer
-def _read_nodes(osm_file, found_nodes) -> Dict[int, OSMNode]:
-    parser = xml.sax.make_parser()
-    n_handler = NodeHandler(found_nodes)
-
-    parser.setContentHandler(n_handler)
-    if isinstance(osm_file, PercentageFile):
-        parser.parse(osm_file)
-    else:
-        xml.sax.parseString(osm_file, n_handler)
+def _read_pbf(
+    osm_filename: str,
+    parser_helper: WayParserHelper,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+) -> Tuple[Dict[int, OSMNode], List[OSMWay]]:
+    handler = PBFHandler(parser_helper, bbox)
+    handler.apply_file(osm_filename, locations=True)
 
-    return n_handler.nodes
+    return handler.nodes, handler.found_ways
@@ -1,5 +1,9 @@
+import sys
+
 from .osm_types import OSMWay
 
+intern = sys.intern
+
 
 class WayParserHelper:
     ONEWAY_STR = "oneway"
@@ -22,6 +26,41 @@ class WayParserHelper:
 
         return True
 
+    def parse_tag(self, way: OSMWay, key: str, value: str) -> None:
+        if key == "highway":
+            way.highway = value
+        elif key == "area":
+            way.area = value
+        elif key == "maxspeed":
+            way.max_speed_str = str(value)
+        elif key == "oneway":
+            if value == "yes":
+                way.direction = "oneway"
+        elif key == "name":
+            try:
+                way.name = intern(value)
+            except TypeError:
+                way.name = value
+        elif key == "junction":
+            if value == "roundabout":
+                way.direction = "oneway"
+        elif key == "indoor":
+            # this is not an ideal solution since it sets the pedestrian flag irrespective of the real value in osm data
+            # but aims to cover the simple indoor tagging approach: https://wiki.openstreetmap.org/wiki/Simple_Indoor_Tagging
+            # more info: https://help.openstreetmap.org/questions/61025/pragmatic-single-level-indoor-paths
+            if value == "corridor":
+                way.highway = "pedestrian_indoor"
+
+    def finalize_way(self, way: OSMWay) -> bool:
+        """Sets the speed and direction of an accepted way; returns False if the way is rejected"""
+        if not self.is_way_acceptable(way):
+            return False
+
+        way.max_speed_int = self.parse_max_speed(way)
+        way.forward, way.backward = self.parse_direction(way)
+
+        return True
+
     def parse_direction(self, way):
         if way.direction == self.ONEWAY_STR:
             return True, False
@@ -1,5 +1,5 @@
-import os
 import sys
+from array import array
 from typing import Dict, List, Optional, Set
 from xml.sax.handler import ContentHandler
 from xml.sax.xmlreader import AttributesImpl
@@ -7,50 +7,6 @@ from xml.sax.xmlreader import AttributesImpl
 from .osm_types import OSMNode, OSMWay
 from .way_parser_helper import WayParserHelper
 
-intern = sys.intern
-
-
-class PercentageFile:
-    def __init__(self, filename: str) -> None:
-        self.size = os.stat(filename)[6]
-        self.delivered = 0
-        self.f = open(filename, encoding="utf-8")
-        self.percentages = [1000] + [100 - 10 * x for x in range(0, 11)]
-
-    def read(self, size: Optional[int] = None) -> str:
-        if size is None:
-            self.delivered = self.size
-            return self.f.read()
-        data = self.f.read(size)
-        self.delivered += len(data)
-
-        if self.percentage >= self.percentages[-1]:
-            self.percentages = self.percentages[:-1]
-        return data
-
-    def close(self) -> None:
-        self.f.close()
-
-    @property
-    def percentage(self) -> float:
-        return float(self.delivered) / self.size * 100.0
-
-
-class NodeHandler(ContentHandler):
-    def __init__(self, found_nodes: Set[int]) -> None:
-        self.found_nodes: Set[int] = found_nodes
-        self.nodes: Dict[int, OSMNode] = {}
-
-    def startElement(self, name: str, attrs: AttributesImpl) -> None:
-        if name == "node":
-            osm_id = int(attrs["id"])
-            if osm_id not in self.found_nodes:
-                return
-
-            self.nodes[osm_id] = OSMNode(
-                osm_id, float(attrs["lat"]), float(attrs["lon"])
-            )
-
 
 class WayHandler(ContentHandler):
     def __init__(self, parser_helper: WayParserHelper) -> None:
@@ -73,29 +29,9 @@ class WayHandler(ContentHandler):
                     self.current_way.add_node(node_id)
 
                 elif name == "tag":
-                    if attrs["k"] == "highway":
-                        self.current_way.highway = attrs["v"]
-                    elif attrs["k"] == "area":
-                        self.current_way.area = attrs["v"]
-                    elif attrs["k"] == "maxspeed":
-                        self.current_way.max_speed_str = str(attrs["v"])
-                    elif attrs["k"] == "oneway":
-                        if attrs["v"] == "yes":
-                            self.current_way.direction = "oneway"
-                    elif attrs["k"] == "name":
-                        try:
-                            self.current_way.name = intern(attrs["v"])
-                        except TypeError:
-                            self.current_way.name = attrs["v"]
-                    elif attrs["k"] == "junction":
-                        if attrs["v"] == "roundabout":
-                            self.current_way.direction = "oneway"
-                    elif attrs["k"] == "indoor":
-                        # this is not an ideal solution since it sets the pedestrian flag irrespective of the real value in osm data
-                        # but aims to cover the simple indoor tagging approach: https://wiki.openstreetmap.org/wiki/Simple_Indoor_Tagging
-                        # more info: https://help.openstreetmap.org/questions/61025/pragmatic-single-level-indoor-paths
-                        if attrs["v"] == "corridor":
-                            self.current_way.highway = "pedestrian_indoor"
+                    self.parser_helper.parse_tag(
+                        self.current_way, attrs["k"], attrs["v"]
+                    )
             except:
                 e = sys.exc_info()[0]
                 print(f"Error while parsing: {e}")
@@ -104,20 +40,41 @@ class WayHandler(ContentHandler):
         if name == "way":
             assert self.current_way is not None
 
-            if not self.parser_helper.is_way_acceptable(self.current_way):
+            if not self.parser_helper.finalize_way(self.current_way):
                 self.current_way = None
                 return
 
             self.found_nodes.update(self.current_way.nodes)
-
-            self.current_way.max_speed_int = self.parser_helper.parse_max_speed(
-                self.current_way
-            )
-            (
-                self.current_way.forward,
-                self.current_way.backward,
-            ) = self.parser_helper.parse_direction(self.current_way)
-
             self.found_ways.append(self.current_way)
 
             self.current_way = None
+
+
+class OSMHandler(WayHandler):
+    """
+    Single-pass handler: buffers the coordinates of all nodes in compact arrays while parsing the
+    ways, and only materializes the nodes referenced by accepted ways at the end of the document.
+    """
+
+    def __init__(self, parser_helper: WayParserHelper) -> None:
+        super().__init__(parser_helper)
+        self.node_ids = array("q")
+        self.node_lats = array("d")
+        self.node_lons = array("d")
+
+    def startElement(self, name: str, attrs: AttributesImpl) -> None:
+        if name == "node":
+            self.node_ids.append(int(attrs["id"]))
+            self.node_lats.append(float(attrs["lat"]))
+            self.node_lons.append(float(attrs["lon"]))
+            return
+
+        super().startElement(name, attrs)
+
+    @property
+    def nodes(self) -> Dict[int, OSMNode]:
+        return {
+            osm_id: OSMNode(osm_id, lat, lon)
+            for osm_id, lat, lon in zip(self.node_ids, self.node_lats, self.node_lons)
+            if osm_id in self.found_nodes
+        }
@@ -4,6 +4,26 @@ from ..osm import read_osm, sanitize_input
 from . import write_graph as output
 
 
+def build_roadgraph(
+    nodes,
+    ways,
+    unconnected_components,
+    enrich=False,
+    distance_between_points: int = 0,
+):
+    """Builds the road graph from already parsed OSM nodes and ways"""
+    sanitize_input.sanitize_input(ways, nodes, verbose=False)
+
+    graph = graphfactory.build_graph_from_osm(
+        nodes, ways, enrich, distance_between_points
+    )
+
+    if not unconnected_components:
+        graph = algorithms.computeLCCGraph(graph)
+
+    return graph
+
+
 # @timer.timer
 def convert_osm_to_roadgraph(
     filename,
@@ -14,37 +34,31 @@ def convert_osm_to_roadgraph(
     enrich=False,
     distance_between_points: int = 0,
     bucket=None,
+    out_file=None,
 ):
     configuration = config.Configuration(network_type)
 
-    r_index = filename.rfind(".")
-    out_file = filename[:r_index]
+    # Output files are named after the input file by default
+    if out_file is None:
+        r_index = filename.rfind(".")
+        out_file = filename[:r_index]
 
-    cloud_decompression = None
+    osm_stream = None
 
     if bucket is not None:
-        # Download the content of the blob as bytes
-        cloud_blob = bucket.blob(filename)
-        # Decode the bytes to string
-        cloud_decompression = cloud_blob.download_as_string().decode("utf-8")
+        # Stream the blob content (plain, gzip or bz2), without decoding it to a single string
+        osm_stream = bucket.blob(filename).open("rb")
 
-    nodes, ways = read_osm.read_file(
-        filename, configuration, cloud_decompression=cloud_decompression
-    )
-
-    sanitize_input.sanitize_input(ways, nodes, verbose=False)
+    nodes, ways = read_osm.read_file(filename, configuration, osm_stream=osm_stream)
 
-    graph = graphfactory.build_graph_from_osm(
-        nodes, ways, enrich, distance_between_points
+    graph = build_roadgraph(
+        nodes, ways, unconnected_components, enrich, distance_between_points
     )
 
-    if not unconnected_components:
-        graph = algorithms.computeLCCGraph(graph)
-
     # output.write_to_file(graph, out_file, configuration.get_file_extension())
 
+    nx_graph = convert_graph.convert_to_networkx(graph)
     if networkx_output:
-        nx_graph = convert_graph.convert_to_networkx(graph)
         output.write_nx_to_file(nx_graph, f"{out_file}.json", bucket)
 
     if contract:
@@ -53,5 +67,9 @@ def convert_osm_to_roadgraph(
             contracted_graph, out_file, f"{configuration.get_file_extension()}c"
         )
         if networkx_output:
-            nx_graph = convert_graph.convert_to_networkx(contracted_graph)
-            output.write_nx_to_file(nx_graph, f"{out_file}_contracted.json", bucket)
+            nx_contracted_graph = convert_graph.convert_to_networkx(contracted_graph)
+            output.write_nx_to_file(
+                nx_contracted_graph, f"{out_file}_contracted.json", bucket
+            )
+
+    return nx_graph
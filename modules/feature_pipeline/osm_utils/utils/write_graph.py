@@ -25,17 +25,19 @@ def write_to_file(graph, filename_base, filename_ext):
         f.write(f"{file_header}\n")
         f.write(f"{header}\n")
 
-        f.write(f"{len(graph.vertices)}\n")
-        f.write(f"{len(graph.edges)}\n")
+        f.write(f"{graph.number_of_vertices()}\n")
+        f.write(f"{graph.number_of_edges()}\n")
 
         # write node information
-        for v in graph.vertices:
-            f.write(f"{v.description}\n")
+        for node_id, (lat, lon) in enumerate(
+            zip(graph.lat.tolist(), graph.lon.tolist())
+        ):
+            f.write(f"{node_id} {lat} {lon}\n")
 
         # write edge information
-        for e in graph.edges:
-            f.write(f"{e.description}\n")
-            f_names.write(e.data.name)
+        for edge_id in range(graph.number_of_edges()):
+            f.write(f"{graph.edge_description(edge_id)}\n")
+            f_names.write(graph.edge_name(edge_id))
             f_names.write("\n")
 
     f.close()
@@ -0,0 +1,138 @@
+"""
+Parity check of the image names planned by plan_images with the ones of the former per-node retrieval (retrieve_run),
+which named the images of the areas retrieved before the graph store format.
+
+Usage (from modules/feature_pipeline, with utils and osm_utils in PYTHONPATH):
+    python tools/check_image_names.py --graph SV_map_merged.json
+    python tools/check_image_names.py --random 300
+"""
+
+import argparse
+import json
+from itertools import combinations
+from typing import List, Set, Tuple
+
+import networkx as nx
+import numpy as np
+from graph_store import GraphStore
+from networkx.readwrite import json_graph
+from retrieve_engine import image_match_key
+from retrieve_utils import heading_degrees, plan_images
+
+
+def is_within_ranges(first_angle: float, second_angle: float, thresh: int = 45) -> bool:
+    """Former check of similar headings (same or opposite direction, within thresh degrees)"""
+    first_angle = first_angle % 360
+    first_angle_opposite = (first_angle + 180) % 360
+    second_angle = second_angle % 360
+
+    ranges = [
+        ((first_angle - thresh) % 360, (first_angle + thresh) % 360),
+        ((first_angle_opposite - thresh) % 360, (first_angle_opposite + thresh) % 360),
+    ]
+    for range_start, range_end in ranges:
+        if range_start > range_end:
+            if (range_start <= second_angle <= 360) or (0 <= second_angle <= range_end):
+                return True
+        if range_start <= second_angle <= range_end:
+            return True
+
+    return False
+
+
+def baseline_headings(
+    edges_headings: List[Tuple[float, float, float]], thresh: int = 45
+) -> List[Tuple[float, float, float]]:
+    """Former selection of the edges of a node (check_edge_headings), in the order of the neighbours"""
+    indexes = set()
+    for first, second in combinations(range(len(edges_headings)), 2):
+        smaller, bigger = sorted([edges_headings[first][0], edges_headings[second][0]])
+        if is_within_ranges(smaller, bigger, thresh):
+            indexes.add(first)
+        else:
+            indexes.update([first, second])
+
+    return [edges_headings[index] for index in sorted(indexes)]
+
+
+def baseline_names(g: nx.Graph, fov: int) -> Set[str]:
+    """Names (without their date) of the images the former retrieve_run gave to the nodes of a graph"""
+    names = set()
+    for node, data in g.nodes(data=True):
+        edges_headings = []
+        for neigh in g.neighbors(node):
+            heading = heading_degrees(
+                data["lat"], data["lon"], g.nodes[neigh]["lat"], g.nodes[neigh]["lon"]
+            )
+            edges_headings.append((heading, (heading + 90) % 360, (heading - 90) % 360))
+        if len(edges_headings) >= 2:
+            edges_headings = baseline_headings(edges_headings)
+
+        for heading_index, (_, h1, h2) in enumerate(edges_headings):
+            for side_index, h in enumerate([h1, h2]):
+                names.add(f"{data['lat']}_{data['lon']}_{heading_index}_{side_index}_{h}_{fov}_")
+
+    return names
+
+
+def planned_names(g: nx.Graph, fov: int) -> Set[str]:
+    """Names (without their date) of the images planned by plan_images for the same graph"""
+    table = plan_images(GraphStore.from_networkx(g))
+    columns = [
+        table[column].tolist()
+        for column in ("lat", "lon", "heading_index", "side_index", "heading")
+    ]
+
+    return {
+        f"{lat}_{lon}_{heading_index}_{side_index}_{heading}_{fov}_"
+        for lat, lon, heading_index, side_index, heading in zip(*columns)
+    }
+
+
+def random_graph(nr_nodes: int, seed: int) -> nx.Graph:
+    """Random geometric graph of pano-like nodes, with edges added in random order"""
+    rng = np.random.default_rng(seed)
+    lat = 6.5 + rng.random(nr_nodes) * 0.01
+    lon = 3.3 + rng.random(nr_nodes) * 0.01
+
+    g = nx.Graph()
+    for index in rng.permutation(nr_nodes).tolist():
+        g.add_node(f"pano_{index}", lat=float(lat[index]), lon=float(lon[index]))
+    edges = [
+        (f"pano_{u}", f"pano_{v}")
+        for u, v in combinations(range(nr_nodes), 2)
+        if (lat[u] - lat[v]) ** 2 + (lon[u] - lon[v]) ** 2 < 0.0012**2
+    ]
+    g.add_edges_from(edges[index] for index in rng.permutation(len(edges)).tolist())
+
+    return g
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--graph", help="Legacy networkx JSON graph (adjacency data) of an area")
+    source.add_argument("--random", type=int, help="Number of nodes of a random graph")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fov", type=int, default=90)
+    args = parser.parse_args()
+
+    if args.graph is not None:
+        with open(args.graph) as f:
+            g = json_graph.adjacency_graph(json.load(f))
+    else:
+        g = random_graph(args.random, args.seed)
+
+    baseline = baseline_names(g, args.fov)
+    planned = planned_names(g, args.fov)
+    exact = len(baseline & planned)
+    matched = len({image_match_key(name) for name in baseline} & {image_match_key(name) for name in planned})
+
+    print(f"Baseline images: {len(baseline)}, planned images: {len(planned)}")
+    print(f"Same name: {exact}/{len(baseline)}, same name but heading_index: {matched}/{len(baseline)}")
+    if exact != len(baseline) or len(planned) != len(baseline):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,17 @@
+import numpy as np
 from build_utils import get_available_sv, get_osm, osm_to_graph
 from card_utils import build_card
 from checks_utils import check_broader_area, check_polygon
 from cloud_utils import clean_intermediate_files, get_bucket
-from general_utils import enclosing_rectangle, split_window
+from delta_utils import delta_build
+from general_utils import enclosing_rectangle, plan_windows, split_window
+from logger import logger
 from logging_utils import log_func
 from merge_utils import merge_sub_windows
+from osm_pbf_utils import osm_pbf_to_graph
 from retrieve_utils import retrieve_images
 from upload_utils import upload_for_annotation, upload_from_annotation
+from window_utils import adaptive_split_window
 
 
 class Pipeline:
@@ -27,9 +32,21 @@ class Pipeline:
         # Define enclosing window for defined polygon
         enclosing_window = enclosing_rectangle(self.cfg.area.polygon)
 
-        # Split initial window in smaller squared sub-windows
-        self.windows = split_window(
-            enclosing_window, self.cfg.window_split_area, self.cfg.window_overlap
+        # Split initial window in smaller squared sub-windows, of about the same number of points if adaptive
+        if self.cfg.window_split == "adaptive":
+            self.windows = adaptive_split_window(
+                self.cfg, self.bucket, enclosing_window
+            )
+        else:
+            self.windows = split_window(
+                enclosing_window, self.cfg.window_split_area, self.cfg.window_overlap
+            )
+
+        # Keep only the sub-windows intersecting the polygon (indexes refer to the full windows array)
+        windows_mask = plan_windows(self.windows, self.cfg.area.polygon)
+        self.window_indexes = np.flatnonzero(windows_mask).tolist()
+        logger.info(
+            f"Window planner -- {len(self.window_indexes)}/{len(self.windows)} sub-windows intersect the area"
         )
 
     @log_func
@@ -62,14 +79,27 @@ class Pipeline:
         compute_graph = self.check_broader_area()
 
         if compute_graph:
-            # Get OSM data
-            get_osm(self.cfg, self.windows, self.bucket)
-
-            # Convert OSM data to OSM graphs
-            osm_to_graph(self.cfg, self.windows, self.bucket)
+            # Only rebuild the sub-windows where the SV imagery changed, if the area was already built
+            if self.cfg.features.build.delta and delta_build(
+                self.cfg, self.windows, self.bucket, self.window_indexes
+            ):
+                clean_intermediate_files(self.cfg, self.bucket)
+                return
+
+            if self.cfg.features.build.osm_source == "pbf":
+                # Build OSM graphs from the OSM extract
+                osm_pbf_to_graph(
+                    self.cfg, self.windows, self.bucket, self.window_indexes
+                )
+            else:
+                # Get OSM data
+                get_osm(self.cfg, self.windows, self.bucket, self.window_indexes)
+
+                # Convert OSM data to OSM graphs
+                osm_to_graph(self.cfg, self.windows, self.bucket, self.window_indexes)
 
             # Get available SV locations and build SV graphs
-            get_available_sv(self.cfg, self.windows, self.bucket)
+            get_available_sv(self.cfg, self.windows, self.bucket, self.window_indexes)
 
             # Merge sub windows
             merge_sub_windows(self.cfg, self.windows, self.bucket)
@@ -84,8 +114,8 @@ class Pipeline:
 
     @log_func
     def retrieve(self):
-        # Download images
-        retrieve_images(self.cfg, self.bucket)
+        # Download images (or estimate their retrieval)
+        retrieve_images(self.cfg, self.bucket, self.sub_polygons_df)
 
     @log_func
     def upload_for_annotation(self):
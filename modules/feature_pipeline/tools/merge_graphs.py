@@ -0,0 +1,87 @@
+"""
+Merges local graphs (.graph files, or legacy networkx JSON graphs of the areas built before the graph store format)
+into a single .graph file, with merge_graph_stores, and prints the merge statistics.
+
+Usage (from modules/feature_pipeline, with it, utils and osm_utils in PYTHONPATH):
+    python tools/merge_graphs.py merged.graph ward_1.graph ward_2.json --stats merge_stats.json
+    python tools/merge_graphs.py merged.graph temp/sv_graphs --json merged.json
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Iterator, List
+
+from cloud_utils import graph_from_adjacency_data
+from graph_store import GRAPH_EXTENSION, LEGACY_GRAPH_EXTENSION, GraphStore
+from merge_utils import merge_graph_stores
+from networkx.readwrite import json_graph
+
+
+def read_graph(path: str) -> GraphStore:
+    """Reads a local graph, as a .graph file or as a legacy JSON graph"""
+    if path.endswith(f".{LEGACY_GRAPH_EXTENSION}"):
+        with open(path) as f:
+            return graph_from_adjacency_data(json.load(f))
+
+    return GraphStore.load(path)
+
+
+def list_graphs(paths: List[str]) -> List[str]:
+    """Expands the directories of the input paths into their graph files, in name order"""
+    extensions = (f".{GRAPH_EXTENSION}", f".{LEGACY_GRAPH_EXTENSION}")
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.endswith(extensions)
+            )
+        else:
+            files.append(path)
+
+    return files
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("output", help="Merged .graph file")
+    parser.add_argument("inputs", nargs="+", help="Graph files, or directories of graph files")
+    parser.add_argument("--json", help="Also exports the merged graph as a networkx JSON graph (adjacency data)")
+    parser.add_argument("--stats", help="Writes the merge statistics to this JSON file")
+    args = parser.parse_args()
+
+    files = list_graphs(args.inputs)
+    if not files:
+        sys.exit("No graph to merge")
+
+    stats = {"files_processed": 0, "total_nodes_before": 0, "total_edges_before": 0}
+
+    def graphs() -> Iterator[GraphStore]:
+        for index, path in enumerate(files):
+            print(f"Processing {index + 1}/{len(files)}: {path}...")
+            g = read_graph(path)
+            stats["files_processed"] += 1
+            stats["total_nodes_before"] += g.number_of_nodes()
+            stats["total_edges_before"] += g.number_of_edges()
+            yield g
+
+    merged = merge_graph_stores(graphs())
+    merged.save(args.output)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(json_graph.adjacency_data(merged.to_networkx()), f)
+
+    stats["final_nodes"] = merged.number_of_nodes()
+    stats["final_edges"] = merged.number_of_edges()
+    stats["deduplicated_nodes"] = stats["total_nodes_before"] - stats["final_nodes"]
+    print(json.dumps(stats, indent=2))
+    if args.stats is not None:
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
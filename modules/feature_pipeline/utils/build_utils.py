@@ -1,27 +1,37 @@
-import ast
+import gzip
 import os
-import queue
 import threading
 import time
-import urllib.parse as urlparse
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import networkx as nx
-import networkx.readwrite.json_graph as json_graph
 import numpy as np
 import requests
+import shapely
 import tqdm
-from cloud_utils import get_signature, read_json_gcs, upload_json_to_gcs, upload_to_gcs
+from cloud_utils import (
+    list_window_indexes,
+    read_graph_gcs,
+    upload_graph_to_gcs,
+    upload_to_gcs,
+)
 from config_model import SetupConfig
-from finder_utils.run import driver_setup, find, replace_api_key
-from general_utils import distance as dist
+from finder_utils.run import DriverPool, find, replace_api_key
+from general_utils import date_bounds, get_window_indexes
+from geo_utils import distance as dist
+from geo_utils import to_enu
 from google.cloud.storage import Bucket
+from graph_store import GRAPH_EXTENSION, GraphStore, encode_dates, in_date_range
 from logger import logger
+from location_client import get_location_client
 from logging_utils import format_logging
+from metadata_cache import MetadataCache, get_metadata_cache, sync_metadata_cache
 from networkx import parse_adjlist
 from numpy.typing import NDArray
+from pano_registry import PanoRegistry
 from osm_utils.utils.converter import convert_osm_to_roadgraph
-from shapely import Point, Polygon
+from scipy.spatial import cKDTree
+from shapely import Polygon
 from viz_utils import plot_graph
 from concurrent.futures import ThreadPoolExecutor, wait
 
@@ -49,11 +59,11 @@ class OverpassThrottler:
 # Instance globale
 overpass_throttler = OverpassThrottler()
 
+# Types of 'highway' queried from Overpass, as defined in osm_utils/configuration.py -> 'car' type
+OVERPASS_HIGHWAYS = "motorway|trunk|primary|secondary|tertiary|unclassified|residential|service|living_street|primary_link|secondary_link|tertiary_link|motorway_link"
 
-# Global event for pausing and resuming threads
-pause_event_find = threading.Event()
-pause_event_find.set()
 
+# Global event for pausing and resuming threads
 pause_event_osm = threading.Event()
 pause_event_osm.set()
 
@@ -106,13 +116,13 @@ def retrieve_osm(
     query = """
     [out:xml]/*fixed by auto repair*/[timeout:25];
     (
-    way["highway"~"motorway|trunk|primary|secondary|tertiary|unclassified|residential|service|living_street|primary_link|secondary_link|tertiary_link|motorway_link"]({}, {}, {}, {});
+    way["highway"~"{}"]({}, {}, {}, {});
     node(w);
     <;
     );
     out body;
     """.format(
-        s, w, n, e
+        OVERPASS_HIGHWAYS, s, w, n, e
     )
 
     data = {"data": query}
@@ -156,17 +166,21 @@ def get_osm_run(
     window: NDArray[np.float64],
     overpass_headers: Dict[str, str],
     cfg: SetupConfig,
+    exists: bool,
 ) -> None:
-    """Retrieves OSM data in XML formatted style"""
+    """Retrieves OSM data in XML formatted style, if not present on cloud already"""
 
-    # Check if present on cloud already
-    exists = bucket.blob(window_path).exists()
     if not exists:
         # Retrieve OSM data, if not retrieved locally already
         response_text = retrieve_osm(window, overpass_headers, base_url, cfg)
 
-        # Upload string output to GCS, under .osm file
-        upload_to_gcs(bucket, response_text, window_path)
+        # Upload gzip compressed output to GCS, under .osm file (it is streamed back by the OSM reader)
+        upload_to_gcs(
+            bucket,
+            gzip.compress(response_text.encode("utf-8")),
+            window_path,
+            content_type="application/gzip",
+        )
 
     # Log information
     log_text = format_logging(
@@ -177,13 +191,19 @@ def get_osm_run(
     logger.info(log_text)
 
 
-def get_osm(cfg: SetupConfig, windows: NDArray[np.float64], bucket: Bucket) -> None:
+def get_osm(
+    cfg: SetupConfig,
+    windows: NDArray[np.float64],
+    bucket: Bucket,
+    window_indexes: Optional[List[int]] = None,
+) -> None:
     """
     Saves OSM data for each sub-window in the windows array, remotely (and locally, depending on cfg)
     Args:
         cfg: configuration object
         windows: np.ndarray[nr_sub_windows, 4]
         bucket: cloud bucket instance
+        window_indexes: indexes of the sub-windows to process (all of them by default)
     """
 
     # Set OverpassTurbo API headers and url
@@ -192,8 +212,12 @@ def get_osm(cfg: SetupConfig, windows: NDArray[np.float64], bucket: Bucket) -> N
 
     base_url = build_cfg.overpass_url
     max_chunk_size = build_cfg.max_chunk_size_osm
-    windows_indexes = list(range(len(windows)))
-    for i in range(0, len(windows), max_chunk_size):
+    windows_indexes = get_window_indexes(windows, window_indexes)
+
+    # List the already retrieved sub-windows once
+    existing = list_window_indexes(bucket, cfg.area.output_path, cfg.osm_name, "osm")
+
+    for i in range(0, len(windows_indexes), max_chunk_size):
         cur_windows = windows_indexes[i : i + max_chunk_size]
         retrieve_threads = []
 
@@ -211,6 +235,7 @@ def get_osm(cfg: SetupConfig, windows: NDArray[np.float64], bucket: Bucket) -> N
                     windows[window_index],
                     overpass_headers,
                     cfg,
+                    window_index in existing,
                 ),
                 daemon=True,
             )
@@ -222,6 +247,58 @@ def get_osm(cfg: SetupConfig, windows: NDArray[np.float64], bucket: Bucket) -> N
             thread.join()
 
 
+def polygon_mask(
+    lat: NDArray[np.float64],
+    lon: NDArray[np.float64],
+    polygon: Polygon,
+    reverse_coords: bool = False,
+    window_coords: Optional[NDArray[np.float64]] = None,
+) -> NDArray[np.bool_]:
+    """
+    Computes which points are inside a polygon (and a window), in bulk
+    Args:
+        lat: np.ndarray[nr_points] of latitudes
+        lon: np.ndarray[nr_points] of longitudes
+        polygon: shapely Polygon defining area of interest (prepared in place)
+        reverse_coords: true if coordinates of polygon are lon/lat, else lat/lon
+        window_coords: optional (min_lon, max_lon, min_lat, max_lat) window the points must also be part of
+
+    Returns:
+        np.ndarray[nr_points] keep-mask
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    x, y = (lon, lat) if reverse_coords else (lat, lon)
+
+    # Bounding box pre-filter, before the exact point in polygon test
+    min_x, min_y, max_x, max_y = polygon.bounds
+    mask = (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+    if window_coords is not None:
+        west, east, south, north = window_coords
+        mask &= (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+
+    shapely.prepare(polygon)
+    mask[mask] = shapely.contains_xy(polygon, x[mask], y[mask])
+
+    return mask
+
+
+def remove_nodes_outside_mask(
+    g: nx.Graph, polygon: Polygon, **mask_kwargs
+) -> nx.Graph:
+    """Removes, in a single call, the nodes of a graph with 'lat'/'lon' attributes outside polygon_mask"""
+    nodes, lat, lon = [], [], []
+    for node, data in g.nodes(data=True):
+        nodes.append(node)
+        lat.append(data["lat"])
+        lon.append(data["lon"])
+
+    keep = polygon_mask(lat, lon, polygon, **mask_kwargs)
+    g.remove_nodes_from(node for node, kept in zip(nodes, keep.tolist()) if not kept)
+
+    return g
+
+
 def remove_nodes_not_part_of_polygon(
     g: nx.Graph, polygon: Polygon, reverse_coords: bool = False
 ) -> nx.Graph:
@@ -230,30 +307,13 @@ def remove_nodes_not_part_of_polygon(
     Args:
         g: a networkx graph of OSM nodes
         polygon: shapely Polygon defining area of interest
-        reverse_coords: true if coordinates of polygon are lat/lon, else lon/lat
+        reverse_coords: true if coordinates of polygon are lon/lat, else lat/lon
 
     Returns:
         the new graph with points in area of interest.
     """
 
-    # Remove nodes that are not part of the window
-    nodes_to_remove = []
-    for node, data in g.nodes(data=True):
-        # Retrieve data
-        if reverse_coords:
-            c1, c2 = data["lon"], data["lat"]
-        else:
-            c1, c2 = data["lat"], data["lon"]
-
-        point = Point(c1, c2)
-        # Remove if not part of polygon
-        if not polygon.contains(point):
-            nodes_to_remove.append(node)
-
-    # Remove nodes not part of desired area
-    g.remove_nodes_from(nodes_to_remove)
-
-    return g
+    return remove_nodes_outside_mask(g, polygon, reverse_coords=reverse_coords)
 
 
 def remove_nodes_not_part_of_window_or_polygon(
@@ -270,30 +330,43 @@ def remove_nodes_not_part_of_window_or_polygon(
         The new graph with points in area of interest.
     """
 
-    # Remove nodes that are not part of the window
-    nodes_to_remove = []
-    for node, data in g.nodes(data=True):
-        # Retrieve data
-        node_lat, node_lon = data["lat"], data["lon"]
-        south, west, north, east = (
-            window_coords[2],
-            window_coords[0],
-            window_coords[3],
-            window_coords[1],
-        )
-        # Check if part of window
-        if south <= node_lat <= north and west <= node_lon <= east:
-            # Remove if not part of polygon
-            point = Point(node_lat, node_lon)
-            if not polygon.contains(point):
-                nodes_to_remove.append(node)
-        else:
-            nodes_to_remove.append(node)
+    return remove_nodes_outside_mask(g, polygon, window_coords=window_coords)
 
-    # Remove nodes not part of desired area
-    g.remove_nodes_from(nodes_to_remove)
 
-    return g
+def save_osm_window_graph(
+    cfg: SetupConfig,
+    bucket: Bucket,
+    g: nx.DiGraph,
+    window: NDArray[np.float64],
+    window_index: int,
+) -> None:
+    """Clips the road graph of a sub-window to the window and polygon, and saves it as an OSM graph"""
+
+    graph_output_path = f"{cfg.area.output_path}/{cfg.osm_name}_{window_index}.graph"
+
+    # Transform to undirected
+    g = g.to_undirected()
+
+    # Remove nodes that are not part of the window or polygon
+    polygon = Polygon(cfg.area.polygon)
+    g = remove_nodes_not_part_of_window_or_polygon(g, window, polygon)
+
+    # Relabel nodes IDs
+    node_mapping = {
+        node: f"{data['lon']},{data['lat']}" for node, data in g.nodes(data=True)
+    }
+    g = nx.relabel_nodes(g, node_mapping)
+
+    # Build the columnar graph (node IDs are "lon,lat", so no keys are stored) and compute edge lengths
+    graph = GraphStore.from_networkx(g, keep_keys=False)
+    graph.compute_distances()
+
+    # Write to cloud
+    upload_graph_to_gcs(bucket, graph_output_path, graph)
+
+    if cfg.features.build.viz and g.number_of_nodes() > 0:
+        output_map_path = f"{cfg.area.viz_path}/{cfg.osm_name}_{window_index}.html"
+        plot_graph(g, cfg.mapbox_token, output_map_path, "red", bucket)
 
 
 def osm_to_graph_run(
@@ -302,24 +375,20 @@ def osm_to_graph_run(
     window_index: int,
     window: NDArray[np.float64],
     nr_windows: int,
+    exists: bool,
 ) -> None:
-    """Converts OSM data in XML format to OSM json graph"""
+    """Converts OSM data in XML format to OSM graph, if the graph was not already created"""
 
     # Retrieve config for build action
     build_cfg = cfg.features.build
 
-    # Get paths
-    json_graph_output_path = (
-        f"{cfg.area.output_path}/{cfg.osm_name}_{window_index}.json"
-    )
+    # Get path
     osm_path = f"{cfg.area.output_path}/{cfg.osm_name}_{window_index}.osm"
 
-    # Check if the road graph was not already created for an OSM file
-    exists = bucket.blob(json_graph_output_path).exists()
     if not exists:
 
-        # Create a json file with the roads network
-        convert_osm_to_roadgraph(
+        # Build the roads network graph
+        g = convert_osm_to_roadgraph(
             osm_path,
             build_cfg.network_type,
             build_cfg.unconnected_components,
@@ -328,47 +397,16 @@ def osm_to_graph_run(
             build_cfg.enrich,
             build_cfg.distance_between_points,
             bucket=bucket,
+            # Not named <osm_name>_<index>.json, as the legacy window graphs are
+            out_file=f"{cfg.area.output_path}/{cfg.osm_name}_{window_index}_raw",
         )
-        # Read graph
-        json_data = read_json_gcs(bucket, json_graph_output_path)
-        g = json_graph.adjacency_graph(json_data)
-
-        # Transform to undirected
-        g = g.to_undirected()
-
-        # Remove nodes that are not part of the window or polygon
-        polygon = Polygon(cfg.area.polygon)
-        g = remove_nodes_not_part_of_window_or_polygon(g, window, polygon)
-
-        # Relabel nodes IDs
-        node_mapping = {
-            node: f"{data['lon']},{data['lat']}" for node, data in g.nodes(data=True)
-        }
-        g = nx.relabel_nodes(g, node_mapping)
-
-        # Compute edge length and store on edge
-        for u, v in g.edges():
-            # Get the coordinates of the two nodes
-            lat1, lon1 = g.nodes[u]["lat"], g.nodes[u]["lon"]
-            lat2, lon2 = g.nodes[v]["lat"], g.nodes[v]["lon"]
-
-            # Calculate the Haversine distance
-            distance = dist(lat1, lon1, lat2, lon2)
-
-            # Add the distance as an edge attribute
-            g.edges[u, v]["distance"] = distance
 
-        # Build the dict data from the graph and write to cloud
-        graph_dict = json_graph.adjacency_data(g)
-        upload_json_to_gcs(bucket, json_graph_output_path, graph_dict)
-
-        if build_cfg.viz and g.number_of_nodes() > 0:
-            output_map_path = f"{cfg.area.viz_path}/{cfg.osm_name}_{window_index}.html"
-            plot_graph(g, cfg.mapbox_token, output_map_path, "red", bucket)
+        # Clip, label and save the window graph
+        save_osm_window_graph(cfg, bucket, g, window, window_index)
 
     # Log information
     log_text = format_logging(
-        stage="OSM to JSON graph",
+        stage="OSM to graph",
         progress=f"{window_index}/{nr_windows - 1}",
         exists=exists,
     )
@@ -376,26 +414,43 @@ def osm_to_graph_run(
 
 
 def osm_to_graph(
-    cfg: SetupConfig, windows: NDArray[np.float64], bucket: Bucket
+    cfg: SetupConfig,
+    windows: NDArray[np.float64],
+    bucket: Bucket,
+    window_indexes: Optional[List[int]] = None,
 ) -> None:
     """
-    Converts OSM data to a JSON graph of points
+    Converts OSM data to a graph of points
     Args:
         cfg: configuration object
         windows: np.ndarray[nr_sub_windows, 4]
         bucket: cloud bucket instance
+        window_indexes: indexes of the sub-windows to process (all of them by default)
     """
 
     max_chunk_size = cfg.features.build.max_chunk_size_osm_to_graph
-    windows_indexes = list(range(len(windows)))
-    for i in range(0, len(windows), max_chunk_size):
+    windows_indexes = get_window_indexes(windows, window_indexes)
+
+    # List the already converted sub-windows once
+    existing = list_window_indexes(
+        bucket, cfg.area.output_path, cfg.osm_name, GRAPH_EXTENSION
+    )
+
+    for i in range(0, len(windows_indexes), max_chunk_size):
         cur_windows = windows_indexes[i : i + max_chunk_size]
         retrieve_threads = []
 
         for window_index in cur_windows:
             thread = threading.Thread(
                 target=osm_to_graph_run,
-                args=(cfg, bucket, window_index, windows[window_index], len(windows)),
+                args=(
+                    cfg,
+                    bucket,
+                    window_index,
+                    windows[window_index],
+                    len(windows),
+                    window_index in existing,
+                ),
                 daemon=True,
             )
             retrieve_threads.append(thread)
@@ -406,12 +461,67 @@ def osm_to_graph(
             thread.join()
 
 
+def grid_thin(x: NDArray[np.float64], y: NDArray[np.float64], spacing: float) -> NDArray[np.int64]:
+    """Indexes of the first point of each spacing x spacing cell (x/y in meters)"""
+    cells = np.stack([np.floor(x / spacing), np.floor(y / spacing)], axis=1)
+    _, first = np.unique(cells, axis=0, return_index=True)
+
+    return np.sort(first)
+
+
+def thin_query_points(
+    lat: NDArray[np.float64],
+    lon: NDArray[np.float64],
+    min_spacing: float,
+    max_gap: Optional[float] = None,
+) -> NDArray[np.bool_]:
+    """
+    Selects the OSM points to query in the SV finder, about min_spacing meters apart (grid hashing), as
+    neighboring points mostly resolve to the same panorama
+    Args:
+        lat: latitudes of the points
+        lon: longitudes of the points
+        min_spacing: size of the grid cells, in meters
+        max_gap: if given, dropped points farther than max_gap meters from all the kept ones are queried too
+            (thinned again), until every point has a kept one within max_gap
+
+    Returns:
+        np.ndarray[nr_points] mask of the points to query
+    """
+    keep = np.zeros(len(lat), dtype=bool)
+    if len(lat) == 0:
+        return keep
+
+    x, y = to_enu(lat, lon, float(lat.mean()), float(lon.mean()))
+    keep[grid_thin(x, y, min_spacing)] = True
+
+    # Refine where the thinning left gaps
+    while max_gap is not None:
+        dropped = np.flatnonzero(~keep)
+        if len(dropped) == 0:
+            break
+
+        kept = np.flatnonzero(keep)
+        gaps, _ = cKDTree(np.stack([x[kept], y[kept]], axis=1)).query(
+            np.stack([x[dropped], y[dropped]], axis=1)
+        )
+        far = dropped[gaps > max_gap]
+        if len(far) == 0:
+            break
+        keep[far[grid_thin(x[far], y[far], min_spacing)]] = True
+
+    return keep
+
+
 def build_mapping_adjacency(
-    image_res: List[List[str | List[dict]]],
+    image_res: List[dict],
     lats: Tuple[float, ...],
     lons: Tuple[float, ...],
 ) -> Tuple[Dict[str, Tuple[Tuple[float, float], str, str]], List[str]]:
-    """Builds mapping from OSM points to available SV locations"""
+    """
+    Builds mapping from OSM points to available SV locations. Panos out of the date range are mapped (so that they
+    are not looked up again when linked by other panos), but not added to the adjacency list
+    """
 
     # Initialize dict and adjacency list
     nodes_mapping_dict = {}
@@ -419,19 +529,15 @@ def build_mapping_adjacency(
 
     # Build mapping from current node to found result/location
     for j, res in enumerate(image_res):
-        if res not in ["NO_RESULTS", "SAME"]:
+        if res["status"] in ["OK", "OUT_OF_RANGE"]:
             # Retrieve location, date and panoID data
-            location = ast.literal_eval(res[0])
-            date = res[2]
-            pano = res[1]
-            nodes_mapping_dict[f"{lats[j]},{lons[j]}"] = (location, pano, date)
+            location = (res["lat"], res["lng"])
+            pano = res["pano"]
+            nodes_mapping_dict[f"{lats[j]},{lons[j]}"] = (location, pano, res["date"])
 
+        if res["status"] == "OK":
             # Add row to adjacency list
-            links = res[3]
-            targets_pano_str = ""
-            for link in links:
-                targets_pano_str += f"{link['pano']} "
-            adjacency_list.append(f"{pano} {targets_pano_str[:-1]}")
+            adjacency_list.append(" ".join([pano] + res["links"]))
 
     # Remove results where retrieved location is the same
     seen_values = set()
@@ -444,58 +550,17 @@ def build_mapping_adjacency(
     return result_dict, adjacency_list
 
 
-def retrieve_location_run(
-    api_key: str, secret: str, pano: str, result_queue: queue.Queue
-) -> None:
-    """Retrieves lat/lon location for a specific pano ID"""
-
-    # default urls
-    meta_base = "https://maps.googleapis.com/maps/api/streetview/metadata?"
-
-    # define the params for the metadata request
-    meta_params = {"key": api_key, "pano": pano}
-
-    input_url_meta = meta_base + urlparse.urlencode(meta_params)
-    meta_params["signature"] = get_signature(input_url_meta, secret)
-
-    while True:
-        # Wait if the pause event is set
-        pause_event_find.wait()
-
-        try:
-            meta_response = requests.get(meta_base, params=meta_params, verify=False)
-            meta_response.raise_for_status()  # Raise an HTTPError for bad responses
-
-            meta_data = meta_response.json()
-            if meta_data["status"] == "OK":
-                lat, lon = meta_data["location"]["lat"], meta_data["location"]["lng"]
-                date = meta_data["date"]
-                result_queue.put((pano, (lat, lon), date))
-            else:
-                # ZERO_RESULT can be present here
-                result_queue.put((pano, None, None))
-
-            # Exit the loop if request is successful
-            break
-
-        except Exception as e:
-            logger.error(f"Location retrieve -- Error at fetch: {e}")
-            pause_event_find.clear()
-            time.sleep(60)
-            pause_event_find.set()
-
-
 def retrieve_location_date(
     cfg: SetupConfig,
     graph: nx.Graph,
     nodes_mapping_dict: Dict[str, Tuple[Tuple[float, float], str, str]],
+    metadata_cache: Optional[MetadataCache] = None,
+    pano_registry: Optional[PanoRegistry] = None,
 ) -> nx.Graph:
-    """Adds lat lon as attributes to a graph with nodes as pano IDs"""
-
-    # Get config parameters
-    max_chunk_size = cfg.features.build.max_chunk_retrieve_location
-    api_key = cfg.google_token
-    secret = cfg.google_secret
+    """
+    Adds lat lon as attributes to a graph with nodes as pano IDs (from the panos located by other sub-windows and
+    the metadata cache first, if given)
+    """
 
     # Build set of nodes in SV graph
     nodes_set = set(graph.nodes())
@@ -512,41 +577,89 @@ def retrieve_location_date(
     # Get necessary set of nodes for finding the location
     nodes = list(nodes_set.difference(location_available_set))
 
-    # Initialize queue
-    result_queue = queue.Queue()
+    # Use the panos located by other sub-windows
+    if pano_registry is not None:
+        unknown_nodes = []
+        for node in nodes:
+            known = pano_registry.get(node)
+            if known is None:
+                unknown_nodes.append(node)
+            else:
+                graph.nodes[node]["lat"], graph.nodes[node]["lon"], graph.nodes[node]["date"] = known
+        nodes = unknown_nodes
+
+    # Use the cached metadata, only query the others
+    if metadata_cache is not None:
+        uncached_nodes = []
+        for node in nodes:
+            meta_data = metadata_cache.get(MetadataCache.pano_key(node))
+            if meta_data is None:
+                uncached_nodes.append(node)
+            elif meta_data["status"] == "OK":
+                graph.nodes[node]["lat"] = meta_data["lat"]
+                graph.nodes[node]["lon"] = meta_data["lon"]
+                graph.nodes[node]["date"] = meta_data["date"]
+        nodes = uncached_nodes
+
+    # Query the metadata of the other nodes
+    client = get_location_client(cfg)
+    for pano, meta_data in client.fetch_panos(nodes).items():
+        if meta_data is None:
+            continue
+
+        if metadata_cache is not None:
+            metadata_cache.put(MetadataCache.pano_key(pano), meta_data)
+
+        # ZERO_RESULT can be present here
+        if meta_data["status"] == "OK":
+            graph.nodes[pano]["lat"] = meta_data["location"]["lat"]
+            graph.nodes[pano]["lon"] = meta_data["location"]["lng"]
+            graph.nodes[pano]["date"] = meta_data["date"]
 
-    # Process chunks of nodes
-    for i in range(0, len(nodes), max_chunk_size):
-        cur_nodes = nodes[i : i + max_chunk_size]
-        retrieve_threads = []  # Initialize the list for each chunk
+    return graph
 
-        for node in cur_nodes:
-            if graph.nodes[node].get("lat"):
-                continue
 
-            # Start threads equal to the number of nodes in a chunk
-            thread = threading.Thread(
-                target=retrieve_location_run,
-                args=(api_key, secret, node, result_queue),
-                daemon=True,
-            )
-            retrieve_threads.append(thread)
-            thread.start()
+def remove_out_of_range_panos(
+    g: nx.Graph, start: Optional[str] = None, end: Optional[str] = None
+) -> nx.Graph:
+    """
+    Removes the panos dated outside a range of months (undated panos are kept)
+    Args:
+        g: graph with nodes as pano IDs, and 'date' ('YYYY-MM') node attributes
+        start: first month to keep, as 'YYYY-MM', None for unbounded
+        end: last month to keep, as 'YYYY-MM', None for unbounded
 
-        # Wait for all threads to complete
-        for thread in retrieve_threads:
-            thread.join()
+    Returns:
+        the graph, without the panos out of the range
+    """
+    if start is None and end is None:
+        return g
 
-    # Collect results from the queue
-    while not result_queue.empty():
-        pano, location, date = result_queue.get()
-        if location is not None:
-            lat, lon = location
-            graph.nodes[pano]["lat"] = lat
-            graph.nodes[pano]["lon"] = lon
-            graph.nodes[pano]["date"] = date
+    nodes = list(g.nodes())
+    keep = in_date_range(encode_dates([g.nodes[node].get("date") for node in nodes]), start, end)
+    g.remove_nodes_from([node for node, kept in zip(nodes, keep.tolist()) if not kept])
 
-    return graph
+    return g
+
+
+def edge_distances(g: nx.Graph, edges: List[Tuple[str, str]]) -> NDArray[np.float64]:
+    """
+    Computes the lengths (meters) of the given edges of a graph with 'lat'/'lon' node attributes
+    Args:
+        g: graph
+        edges: list of (u, v) edges
+
+    Returns:
+        np.ndarray[nr_edges] of edge lengths
+    """
+    lat = nx.get_node_attributes(g, "lat")
+    lon = nx.get_node_attributes(g, "lon")
+    lat1 = np.array([lat[u] for u, _ in edges], dtype=np.float64)
+    lon1 = np.array([lon[u] for u, _ in edges], dtype=np.float64)
+    lat2 = np.array([lat[v] for _, v in edges], dtype=np.float64)
+    lon2 = np.array([lon[v] for _, v in edges], dtype=np.float64)
+
+    return dist(lat1, lon1, lat2, lon2)
 
 
 def remove_big_edges(g: nx.Graph, thresh: int = None, q: int = 90) -> nx.Graph:
@@ -561,29 +674,16 @@ def remove_big_edges(g: nx.Graph, thresh: int = None, q: int = 90) -> nx.Graph:
         new graph with big edges removed
     """
 
+    # Compute all edge lengths in a single pass
+    edges = list(g.edges())
+    distances = edge_distances(g, edges)
+
     if thresh is None:
         assert q in list(range(45, 100, 5)), "Bad value for quantile"
-        distances = []
         # Compute quantiles based on edge lengths:
-        for u, v, data in g.edges(data=True):
-            distances.append(
-                dist(
-                    g.nodes[u]["lat"],
-                    g.nodes[u]["lon"],
-                    g.nodes[v]["lat"],
-                    g.nodes[v]["lon"],
-                )
-            )
-        thresh = np.percentile(np.array(distances), [q])
+        thresh = np.percentile(distances, [q])
 
-    edges_to_remove = [
-        (u, v)
-        for u, v, data in g.edges(data=True)
-        if dist(
-            g.nodes[u]["lat"], g.nodes[u]["lon"], g.nodes[v]["lat"], g.nodes[v]["lon"]
-        )
-        > thresh
-    ]
+    edges_to_remove = [edge for edge, big in zip(edges, distances > thresh) if big]
     g.remove_edges_from(edges_to_remove)
 
     return g
@@ -592,10 +692,14 @@ def remove_big_edges(g: nx.Graph, thresh: int = None, q: int = 90) -> nx.Graph:
 def get_available_sv_run(
     cfg: SetupConfig,
     bucket: Bucket,
-    html_file_path: str,
+    driver_pool: DriverPool,
     index: int,
     nr_windows: int,
     stop_event: threading.Event,
+    sv_graph_exists: bool,
+    osm_graph_exists: bool,
+    metadata_cache: Optional[MetadataCache] = None,
+    pano_registry: Optional[PanoRegistry] = None,
 ) -> None:
     """Runs the SV location finding for one sub-window"""
 
@@ -603,20 +707,17 @@ def get_available_sv_run(
         return
 
     build_cfg = cfg.features.build
-    sv_graph_path = f"{cfg.area.output_path}/{cfg.sv_name}_{index}.json"
-    sv_graph_exists = bucket.blob(sv_graph_path).exists()
+    sv_graph_path = f"{cfg.area.output_path}/{cfg.sv_name}_{index}.graph"
 
     # If the mapping are not computed
     if not sv_graph_exists:
 
-        osm_json_path = f"{cfg.area.output_path}/{cfg.osm_name}_{index}.json"
-        osm_json_exists = bucket.blob(osm_json_path).exists()
+        osm_graph_path = f"{cfg.area.output_path}/{cfg.osm_name}_{index}.graph"
 
-        # If the OSM json file was created
-        if osm_json_exists:
+        # If the OSM graph file was created
+        if osm_graph_exists:
             # Read roads graph
-            json_data = read_json_gcs(bucket, osm_json_path)
-            g = json_graph.adjacency_graph(json_data)
+            g = read_graph_gcs(bucket, osm_graph_path)
 
             # The graph can have 0 points, avoid that
             if not g.number_of_nodes() > 0:
@@ -625,6 +726,30 @@ def get_available_sv_run(
                 )
                 return
 
+            # Query only points about find_min_spacing meters apart, still covering the roads within the finder radius
+            radius = build_cfg.distance_between_points * 2
+            if build_cfg.find_min_spacing:
+                query_mask = thin_query_points(
+                    g.lat,
+                    g.lon,
+                    build_cfg.find_min_spacing,
+                    radius if build_cfg.find_refine_gaps else None,
+                )
+                logger.info(
+                    f"SV file {cfg.area.name} -- querying {query_mask.sum()}/{len(query_mask)} points "
+                    f"for sub-window {index}/{nr_windows - 1}"
+                )
+                g = g.subgraph(query_mask)
+
+            # Skip the points already covered by a pano found in another sub-window
+            if pano_registry is not None:
+                g = g.subgraph(~pano_registry.covered(g.lat, g.lon, radius))
+                if not g.number_of_nodes() > 0:
+                    logger.info(
+                        f"SV file {cfg.area.name} -- points covered by other sub-windows for sub-window {index}/{nr_windows - 1}"
+                    )
+                    return
+
             image_res = []
             lats = ()
             lons = ()
@@ -632,25 +757,27 @@ def get_available_sv_run(
             attempt = 0
             max_attempts = 5
             initial_timeout = 120
-            driver = None
 
             while attempt < max_attempts:
                 try:
-                    # Initialize driver
-                    driver = driver_setup()
-
-                    # Find SV locations
-                    image_res, lats, lons = find(
-                        g,
-                        html_file_path,
-                        driver,
-                        radius=build_cfg.distance_between_points * 2,
-                        cfg=cfg
-                    )
-                    if image_res and all(res == "NO_RESULTS" for res in image_res):
+                    # Find SV locations, on a browser session of the pool (recycled if it fails)
+                    with driver_pool.session() as driver:
+                        image_res, lats, lons = find(
+                            g,
+                            driver,
+                            radius=radius,
+                            cfg=cfg,
+                            timeout=build_cfg.sv_timeout,
+                        )
+                    if image_res and all(
+                        res["status"] == "NO_RESULTS" for res in image_res
+                    ):
                         logger.info(f"SV file {cfg.area.name} -- no SV coverage for sub-window {index}/{nr_windows - 1}")
                         return
 
+                    # Found, stop retrying
+                    break
+
                 except Exception as e:
                     
                     attempt += 1
@@ -665,16 +792,26 @@ def get_available_sv_run(
                         backoff_time = initial_timeout * (2 ** (attempt - 1))
                         logger.warning(f"Retrying in {backoff_time} seconds...")
                         time.sleep(backoff_time)
+            else:
+                # Points could not be searched (e.g. FindError on quota or network errors): the sub-window is not
+                # written, so that the next build searches it again
+                logger.error(
+                    f"SV file {cfg.area.name} -- SV finder failed for sub-window {index}/{nr_windows - 1}"
+                )
+                return
 
-
-                finally:
-                    if driver:
-                        # Ensure driver is always quit
-                        driver.quit()
+            # Share the panos found out of the date range, so that the other sub-windows skip them
+            if pano_registry is not None:
+                pano_registry.add(
+                    (res["pano"], res["lat"], res["lng"], res["date"])
+                    for res in image_res
+                    if res["status"] == "OUT_OF_RANGE"
+                )
 
             # Build mapping from current nodes to found locations and build SV adjacency list
             all_negative = all(
-                element in ["NO_RESULTS", "SAME"] for element in image_res
+                element["status"] in ["NO_RESULTS", "SAME", "OUT_OF_RANGE"]
+                for element in image_res
             )
 
             if not all_negative:
@@ -686,28 +823,49 @@ def get_available_sv_run(
                 pano_graph = parse_adjlist(pano_adjacency_list_str, nodetype=str)
 
                 # Retrieve location for nodes that do not have location information
-                pano_graph = retrieve_location_date(cfg, pano_graph, nodes_mapping_dict)
+                pano_graph = retrieve_location_date(
+                    cfg, pano_graph, nodes_mapping_dict, metadata_cache, pano_registry
+                )
+
+                # Remove the panos that could not be located (no metadata, or not OK status)
+                unlocated = [
+                    node for node, data in pano_graph.nodes(data=True) if "lat" not in data
+                ]
+                if unlocated:
+                    pano_graph.remove_nodes_from(unlocated)
+                    logger.info(
+                        f"SV file {cfg.area.name} -- {len(unlocated)} panos without location removed for "
+                        f"sub-window {index}/{nr_windows - 1}"
+                    )
+
+                # Share the located panos with the other sub-windows
+                if pano_registry is not None:
+                    pano_registry.add(
+                        (node, data["lat"], data["lon"], data.get("date"))
+                        for node, data in pano_graph.nodes(data=True)
+                        if "lat" in data
+                    )
+
+                # Remove the panos out of the date range (linked by the ones in the range)
+                nr_panos = pano_graph.number_of_nodes()
+                pano_graph = remove_out_of_range_panos(
+                    pano_graph, *date_bounds(build_cfg.date_range)
+                )
+                if pano_graph.number_of_nodes() < nr_panos:
+                    logger.info(
+                        f"SV file {cfg.area.name} -- {nr_panos - pano_graph.number_of_nodes()}/{nr_panos} panos "
+                        f"out of the date range for sub-window {index}/{nr_windows - 1}"
+                    )
 
                 # Remove big edges
                 pano_graph = remove_big_edges(
                     pano_graph, thresh=build_cfg.big_edges_thresh
                 )
 
-                # compute edge length and store it
-                for u, v in pano_graph.edges():
-                    # Get the coordinates of the two nodes
-                    lat1, lon1 = pano_graph.nodes[u]["lat"], pano_graph.nodes[u]["lon"]
-                    lat2, lon2 = pano_graph.nodes[v]["lat"], pano_graph.nodes[v]["lon"]
-
-                    # Calculate the Haversine distance
-                    distance = dist(lat1, lon1, lat2, lon2)
-
-                    # Add the distance as an edge attribute
-                    pano_graph.edges[u, v]["distance"] = distance
-
-                # Write graph to file
-                graph_dict = json_graph.adjacency_data(pano_graph)
-                upload_json_to_gcs(bucket, sv_graph_path, graph_dict)
+                # Compute edge lengths and write graph to file
+                sv_graph = GraphStore.from_networkx(pano_graph)
+                sv_graph.compute_distances()
+                upload_graph_to_gcs(bucket, sv_graph_path, sv_graph)
 
                 if build_cfg.viz and pano_graph.number_of_nodes() > 0:
                     output_map_graph_path = (
@@ -739,7 +897,10 @@ def get_available_sv_run(
 
 
 def get_available_sv(
-    cfg: SetupConfig, windows: NDArray[np.float64], bucket: Bucket
+    cfg: SetupConfig,
+    windows: NDArray[np.float64],
+    bucket: Bucket,
+    window_indexes: Optional[List[int]] = None,
 ) -> None:
     """
     Finds available street view locations, corresponding to OSM points
@@ -747,6 +908,7 @@ def get_available_sv(
         cfg: config dictionary
         windows: sub-window polygons that form the desired area
         bucket: GCS bucket
+        window_indexes: indexes of the sub-windows to process (all of them by default)
     """
     # Define stop event
     stop_event = threading.Event()
@@ -759,14 +921,38 @@ def get_available_sv(
     resume_from = cfg.features.build.resume_sv_find_from
     
     # NOUVEAU : Limiter le nombre de workers
-    max_workers = min(16, max_chunk_size)
-    
-    windows_indexes = list(range(len(windows)))
+    max_workers = min(cfg.features.build.max_workers_sv, max_chunk_size)
+
+    # Long-lived browser sessions, one per worker at most
+    driver_pool = DriverPool(
+        html_file_path, max_workers, cfg.features.build.driver_recycle_after
+    )
     
+    # Resume from a sub-window index
+    windows_indexes = [
+        index
+        for index in get_window_indexes(windows, window_indexes)
+        if index >= resume_from
+    ]
+
+    # List the already computed SV graphs and the available OSM graphs once
+    existing_sv = list_window_indexes(
+        bucket, cfg.area.output_path, cfg.sv_name, GRAPH_EXTENSION
+    )
+    existing_osm = list_window_indexes(
+        bucket, cfg.area.output_path, cfg.osm_name, GRAPH_EXTENSION
+    )
+
+    # Panoramas metadata cache, shared by all the sub-windows
+    metadata_cache = get_metadata_cache(cfg, bucket)
+
+    # Panoramas located during this build, shared by all the sub-windows
+    pano_registry = PanoRegistry() if cfg.features.build.pano_registry else None
+
     try:
         # NOUVEAU : Utiliser ThreadPoolExecutor
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            for i in range(resume_from, len(windows), max_chunk_size):
+            for i in range(0, len(windows_indexes), max_chunk_size):
                 cur_windows = windows_indexes[i : i + max_chunk_size]
                 
                 # Soumettre tous les jobs pour ce chunk
@@ -776,10 +962,14 @@ def get_available_sv(
                         get_available_sv_run,
                         cfg,
                         bucket,
-                        html_file_path,
+                        driver_pool,
                         window_index,
                         len(windows),
-                        stop_event
+                        stop_event,
+                        window_index in existing_sv,
+                        window_index in existing_osm,
+                        metadata_cache,
+                        pano_registry,
                     )
                     futures.append(future)
                     
@@ -795,11 +985,17 @@ def get_available_sv(
                     raise RuntimeError("Program terminated due to repeated errors in threads.")
                 
                 # Pause entre les chunks
-                if i + max_chunk_size < len(windows):
-                    logger.info(f"Completed chunk ending at {min(i + max_chunk_size, len(windows))}/{len(windows)}")
+                if i + max_chunk_size < len(windows_indexes):
+                    logger.info(f"Completed chunk ending at {min(i + max_chunk_size, len(windows_indexes))}/{len(windows_indexes)}")
                     time.sleep(2)
                     
     finally:
+        # Close the browser sessions
+        driver_pool.close()
+
         # Remove temporary html file
         if os.path.exists(html_file_path):
-            os.remove(html_file_path)
\ No newline at end of file
+            os.remove(html_file_path)
+
+        # Share the queried metadata with the next runs
+        sync_metadata_cache(cfg, bucket)
\ No newline at end of file
@@ -7,10 +7,9 @@ from typing import Any, Dict, Optional, Tuple
 
 import geopandas as gpd
 import networkx as nx
-import networkx.readwrite.json_graph as json_graph
 import pandas as pd
 import tqdm
-from cloud_utils import read_json_gcs
+from cloud_utils import graph_exists, read_graph_gcs
 from config_model import SetupConfig
 from google.cloud.storage import Bucket
 from joblib import Parallel, delayed
@@ -322,26 +321,24 @@ def build_card(
     """
 
     # Get graph of SV data
-    sv_graph_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.json"
-    sv_merged_exists = bucket.blob(sv_graph_path).exists()
+    sv_graph_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph"
+    sv_merged_exists = graph_exists(bucket, sv_graph_path)
     assert sv_merged_exists, logger.error(
         f"Card -- SV map not computed. Please run build process before!"
     )
 
     # Get graph of SV data
-    osm_graph_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.json"
-    osm_merged_exists = bucket.blob(osm_graph_path).exists()
+    osm_graph_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.graph"
+    osm_merged_exists = graph_exists(bucket, osm_graph_path)
     assert osm_merged_exists, logger.error(
         f"Card -- OSM map not computed. Please run build process before!"
     )
 
     # Get graph SV data
-    json_sv = read_json_gcs(bucket, sv_graph_path)
-    g_sv = json_graph.adjacency_graph(json_sv)
+    g_sv = read_graph_gcs(bucket, sv_graph_path).nx_graph
 
     # Get graph of OSM data
-    json_osm = read_json_gcs(bucket, osm_graph_path)
-    g_osm = json_graph.adjacency_graph(json_osm)
+    g_osm = read_graph_gcs(bucket, osm_graph_path, mmap=True).nx_graph
 
     # Get area name
     area_name = os.path.basename(cfg.area.name)
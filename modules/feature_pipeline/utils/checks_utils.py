@@ -2,9 +2,16 @@ import os
 from typing import List, Optional, Tuple
 
 import geopandas as gpd
-import networkx.readwrite.json_graph as json_graph
-from build_utils import remove_nodes_not_part_of_polygon
-from cloud_utils import read_json_gcs, upload_json_to_gcs
+import numpy as np
+import shapely
+from build_utils import polygon_mask
+from cloud_utils import (
+    graph_exists,
+    read_graph_gcs,
+    read_json_gcs,
+    upload_graph_to_gcs,
+    upload_json_to_gcs,
+)
 from config_model import SetupConfig
 from general_utils import reverse_lat_lon
 from google.cloud.storage import Bucket
@@ -12,7 +19,6 @@ from logger import logger
 from omegaconf import ListConfig
 from polygon_reader_utils import read_region_polygons
 from shapely import Polygon
-from shapely.geometry import MultiPoint
 from viz_utils import plot_graph
 
 
@@ -36,11 +42,11 @@ def check_broader_area(cfg: SetupConfig, bucket: Bucket) -> bool:
         broader_region_data = f"{cfg.database_path}/{broader_region}/{os.path.basename(cfg.area.data_path)}"
 
         # Search for broader region files
-        broader_region_data_osm = f"{broader_region_data}/{cfg.osm_name}_merged.json"
-        broader_region_data_sv = f"{broader_region_data}/{cfg.sv_name}_merged.json"
+        broader_region_data_osm = f"{broader_region_data}/{cfg.osm_name}_merged.graph"
+        broader_region_data_sv = f"{broader_region_data}/{cfg.sv_name}_merged.graph"
 
-        osm_graph_exists = bucket.blob(broader_region_data_osm).exists()
-        sv_graph_exists = bucket.blob(broader_region_data_sv).exists()
+        osm_graph_exists = graph_exists(bucket, broader_region_data_osm)
+        sv_graph_exists = graph_exists(bucket, broader_region_data_sv)
 
         # If the broader region files exist
         if osm_graph_exists and sv_graph_exists:
@@ -49,56 +55,65 @@ def check_broader_area(cfg: SetupConfig, bucket: Bucket) -> bool:
             current_polygon = Polygon(cfg.area.polygon)
 
             # Read graph for broader OSM
-            osm_data = read_json_gcs(bucket, broader_region_data_osm)
-            g = json_graph.adjacency_graph(osm_data)
-
-            # Extract the positions of the nodes
-            positions = [[data["lat"], data["lon"]] for _, data in g.nodes(data=True)]
-            # Create a MultiPoint object from the positions
-            points = MultiPoint(positions)
-            # Get the convex hull of the points (enclosing polygon)
+            osm_graph = read_graph_gcs(bucket, broader_region_data_osm, mmap=True)
+
+            # Get the convex hull of the node positions (enclosing polygon)
+            points = shapely.multipoints(np.column_stack([osm_graph.lat, osm_graph.lon]))
             broader_polygon = points.convex_hull
 
             # Check that broader polygon fully contain the current region
             if broader_polygon.contains(current_polygon):
 
                 # Keep only nodes part of current window
-                g = remove_nodes_not_part_of_polygon(g, current_polygon)
-                json_data = json_graph.adjacency_data(g)
+                osm_graph = osm_graph.subgraph(
+                    polygon_mask(osm_graph.lat, osm_graph.lon, current_polygon)
+                )
 
                 # Save data
-                osm_graph_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.json"
-                upload_json_to_gcs(bucket, osm_graph_path, json_data)
+                osm_graph_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.graph"
+                upload_graph_to_gcs(bucket, osm_graph_path, osm_graph)
 
-                if cfg.viz and g.number_of_nodes() > 0:
+                if cfg.viz and osm_graph.number_of_nodes() > 0:
                     output_map_osm_path = (
                         f"{cfg.area.viz_path}/{cfg.osm_name}_merged.html"
                     )
-                    plot_graph(g, cfg.mapbox_token, output_map_osm_path, "blue", bucket)
+                    plot_graph(
+                        osm_graph.nx_graph,
+                        cfg.mapbox_token,
+                        output_map_osm_path,
+                        "blue",
+                        bucket,
+                    )
 
                 # Delete osm data from memory
-                del osm_data
+                del osm_graph
 
                 # Read broader SV data
-                sv_data = read_json_gcs(bucket, broader_region_data_sv)
-                g = json_graph.adjacency_graph(sv_data)
+                sv_graph = read_graph_gcs(bucket, broader_region_data_sv)
 
                 # Keep only nodes part of current window
-                g = remove_nodes_not_part_of_polygon(g, current_polygon)
-                json_data = json_graph.adjacency_data(g)
+                sv_graph = sv_graph.subgraph(
+                    polygon_mask(sv_graph.lat, sv_graph.lon, current_polygon)
+                )
 
                 # Save data
-                sv_graph_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.json"
-                upload_json_to_gcs(bucket, sv_graph_path, json_data)
+                sv_graph_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph"
+                upload_graph_to_gcs(bucket, sv_graph_path, sv_graph)
 
-                if cfg.viz and g.number_of_nodes() > 0:
+                if cfg.viz and sv_graph.number_of_nodes() > 0:
                     output_map_sv_path = (
                         f"{cfg.area.viz_path}/mapbox_{cfg.sv_name}_merged.html"
                     )
-                    plot_graph(g, cfg.mapbox_token, output_map_sv_path, "blue", bucket)
+                    plot_graph(
+                        sv_graph.nx_graph,
+                        cfg.mapbox_token,
+                        output_map_sv_path,
+                        "blue",
+                        bucket,
+                    )
 
-                # Delete osm data from emory
-                del sv_data
+                # Delete sv data from memory
+                del sv_graph
 
                 return False
             else:
@@ -111,13 +126,13 @@ def check_broader_area(cfg: SetupConfig, bucket: Bucket) -> bool:
     continue_pipeline = True
 
     # Check for existence
-    osm_merged_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.json"
-    osm_merged_exists = bucket.blob(osm_merged_path).exists()
+    osm_merged_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.graph"
+    osm_merged_exists = graph_exists(bucket, osm_merged_path)
     if osm_merged_exists:
         logger.info(f"Broader area check -- OSM map merged already computed!")
 
-    sv_merged_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.json"
-    sv_merged_exists = bucket.blob(sv_merged_path).exists()
+    sv_merged_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph"
+    sv_merged_exists = graph_exists(bucket, sv_merged_path)
     if sv_merged_exists:
         logger.info(f"Broader area check -- SV map merged already computed!")
 
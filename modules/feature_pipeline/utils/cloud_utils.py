@@ -4,17 +4,21 @@ import hashlib
 import hmac
 import json
 import os
+import re
+import tempfile
 import urllib.parse as urlparse
 from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from typing import Iterable, List, Optional, Set
 
 import cv2
 import geopandas as gpd
+import networkx.readwrite.json_graph as json_graph
 import numpy as np
 import shapefile
 from config_model import SetupConfig
 from google.cloud import storage
-from google.cloud.storage import Bucket
+from google.cloud.storage import Blob, Bucket
+from graph_store import GRAPH_EXTENSION, LEGACY_GRAPH_EXTENSION, GraphStore
 from logger import logger
 from shapely.geometry import shape
 
@@ -116,6 +120,59 @@ def copy_blob(
     )
 
 
+def rewrite_blob(
+    source_bucket: Bucket, blob_name: str, destination_bucket: Bucket
+) -> None:
+    """Copies a blob to another bucket, under the same name, server-side (rewritten in as many calls as needed)"""
+    source_blob = source_bucket.blob(blob_name)
+    destination_blob = destination_bucket.blob(blob_name)
+
+    token, _, _ = destination_blob.rewrite(source_blob)
+    while token is not None:
+        token, _, _ = destination_blob.rewrite(source_blob, token=token)
+
+
+def publish_blobs(
+    bucket: Bucket,
+    blob_names: Iterable[str],
+    public_bucket: Bucket,
+    prefix: Optional[str] = None,
+    max_workers: int = 50,
+) -> int:
+    """
+    Copies, server-side and in parallel, the blobs missing from the public bucket
+    Args:
+        bucket: private GCS bucket
+        blob_names: names of the blobs to publish
+        public_bucket: public GCS bucket
+        prefix: common prefix of the blobs, to list the already published ones once (if None, the existence of each
+            blob is checked before its copy)
+        max_workers: number of parallel copies
+
+    Returns:
+        number of blobs copied
+    """
+    to_publish = set(blob_names)
+    if prefix is not None:
+        to_publish -= set(get_names_gcs(public_bucket, prefix))
+
+    def publish(blob_name: str) -> bool:
+        if prefix is None and public_bucket.blob(blob_name).exists():
+            return False
+        rewrite_blob(bucket, blob_name, public_bucket)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(publish, blob_name) for blob_name in sorted(to_publish)]
+        nr_copied = sum(
+            future.result() for future in concurrent.futures.as_completed(futures)
+        )
+
+    logger.info(f"Publish -- {nr_copied} blobs copied to bucket {public_bucket.name}")
+
+    return nr_copied
+
+
 def set_folder_public(bucket: Bucket, folder_path: str):
     """Set a folder (prefix) and its objects to be publicly accessible."""
 
@@ -184,6 +241,115 @@ def read_json_gcs(bucket: Bucket, source_file: str) -> dict:
     return json_data
 
 
+def upload_graph_to_gcs(
+    bucket: Bucket, destination_blob_name: str, graph: GraphStore
+) -> None:
+    """Uploads a graph, in the binary graph store format, to a Google Cloud Storage bucket"""
+
+    upload_to_gcs(
+        bucket,
+        graph.to_bytes(),
+        destination_blob_name,
+        content_type="application/octet-stream",
+    )
+
+
+def legacy_graph_path(path: str) -> str:
+    """Path of the networkx JSON graph written, before the graph store format, instead of a .graph file"""
+    return f"{path[: -len(GRAPH_EXTENSION)]}{LEGACY_GRAPH_EXTENSION}"
+
+
+def get_graph_blob(bucket: Bucket, path: str) -> Optional[Blob]:
+    """Returns the blob of a graph, or of its legacy JSON graph if only this one exists, None if none exists"""
+    blob = bucket.get_blob(path)
+    if blob is None and path.endswith(f".{GRAPH_EXTENSION}"):
+        blob = bucket.get_blob(legacy_graph_path(path))
+
+    return blob
+
+
+def graph_exists(bucket: Bucket, path: str) -> bool:
+    """Whether a graph exists, as a .graph file or as a legacy JSON graph"""
+    return get_graph_blob(bucket, path) is not None
+
+
+def graph_from_adjacency_data(data: dict) -> GraphStore:
+    """
+    Converts a legacy networkx JSON graph (adjacency data) to a graph store. The node IDs are only kept if they are
+    not the "lon,lat" IDs of the OSM graphs
+    """
+    g = json_graph.adjacency_graph(data)
+    keep_keys = any(
+        node != f"{node_data.get('lon')},{node_data.get('lat')}"
+        for node, node_data in g.nodes(data=True)
+    )
+
+    return GraphStore.from_networkx(g, keep_keys=keep_keys)
+
+
+def read_legacy_graph_gcs(bucket: Bucket, source_file: str) -> GraphStore:
+    """Reads a legacy networkx JSON graph (adjacency data) as a graph store"""
+    return graph_from_adjacency_data(read_json_gcs(bucket, source_file))
+
+
+def read_graph_gcs(bucket: Bucket, source_file: str, mmap: bool = False) -> GraphStore:
+    """
+    Reads a graph from a Google Cloud Storage bucket (from its legacy JSON graph, if there is no .graph file)
+    Args:
+        bucket: GCS bucket
+        source_file: path of the graph blob
+        mmap: whether to download the graph to a local file and memory-map it
+
+    Returns:
+        GraphStore instance
+    """
+
+    # Areas built before the graph store format only have JSON graphs
+    if source_file.endswith(f".{GRAPH_EXTENSION}") and not bucket.blob(source_file).exists():
+        legacy_file = legacy_graph_path(source_file)
+        if bucket.blob(legacy_file).exists():
+            return read_legacy_graph_gcs(bucket, legacy_file)
+
+    if mmap:
+        local_path = download_to_local(bucket, source_file, "graph_store")
+        return GraphStore.load(local_path, mmap=True)
+
+    return GraphStore.from_bytes(bucket.blob(source_file).download_as_bytes())
+
+
+def download_to_local(
+    bucket: Bucket, source_file: str, cache_dir: str, overwrite: bool = True
+) -> str:
+    """
+    Downloads a blob under the local temporary directory
+    Args:
+        bucket: GCS bucket
+        source_file: path of the blob
+        cache_dir: name of the sub-directory of the temporary directory
+        overwrite: if False, a local file with the same size as the blob is reused
+
+    Returns:
+        Local path of the downloaded file
+    """
+
+    blob = bucket.get_blob(source_file)
+    if blob is None:
+        raise FileNotFoundError(f"gs://{bucket.name}/{source_file} does not exist!")
+
+    local_path = os.path.join(tempfile.gettempdir(), cache_dir, source_file)
+    if (
+        not overwrite
+        and os.path.exists(local_path)
+        and os.path.getsize(local_path) == blob.size
+    ):
+        return local_path
+
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    blob.download_to_filename(local_path)
+
+    return local_path
+
+
 def get_names_gcs(bucket: Bucket, prefix: str) -> List[str]:
     """Reads all file names from a Google Cloud Storage bucket + prefix."""
 
@@ -193,15 +359,48 @@ def get_names_gcs(bucket: Bucket, prefix: str) -> List[str]:
     return object_names
 
 
+def list_window_indexes(
+    bucket: Bucket, output_path: str, name: str, extension: str
+) -> Set[int]:
+    """
+    Lists, in a single request, the sub-windows for which an output file exists
+    Args:
+        bucket: GCS bucket
+        output_path: folder of the sub-windows files
+        name: prefix of the file names (e.g. OSM_map)
+        extension: extension of the files (e.g. graph)
+
+    Returns:
+        set of the sub-windows indexes, from the files named <output_path>/<name>_<index>.<extension> (graphs
+        also from the legacy JSON graphs)
+    """
+
+    extensions = [extension]
+    if extension == GRAPH_EXTENSION:
+        extensions.append(LEGACY_GRAPH_EXTENSION)
+    pattern = re.compile(
+        rf"{re.escape(name)}_(\d+)\.({'|'.join(map(re.escape, extensions))})"
+    )
+    prefix = f"{output_path}/{name}_"
+
+    window_indexes = set()
+    for blob in bucket.list_blobs(prefix=prefix):
+        match = pattern.fullmatch(blob.name[len(output_path) + 1 :])
+        if match:
+            window_indexes.add(int(match.group(1)))
+
+    return window_indexes
+
+
 def clean_intermediate_files(cfg: SetupConfig, bucket: Bucket) -> None:
     """Cleans intermediate files used to build and merge graphs"""
 
     # Check for existence of merged OSM map and SV map
-    merged_sv_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.json"
-    merged_sv_map_exists = bucket.blob(merged_sv_path).exists()
+    merged_sv_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph"
+    merged_sv_map_exists = graph_exists(bucket, merged_sv_path)
 
-    merged_osm_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.json"
-    merged_osm_map_exists = bucket.blob(merged_osm_path).exists()
+    merged_osm_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.graph"
+    merged_osm_map_exists = graph_exists(bucket, merged_osm_path)
 
     assert merged_sv_map_exists, logger.error(
         f"Merge -- ERROR: SV map was not created!"
@@ -262,30 +461,40 @@ def read_shapefiles(polygons_base_path: str, bucket: Bucket) -> gpd.GeoDataFrame
     return gdf
 
 
-def download_blob(bucket, blob_name, destination_folder):
+def download_blob(bucket, blob_name, destination_folder, destination_name=None):
     """
-    Download a single blob from a GCS bucket to a local folder.
+    Download a single blob from a GCS bucket to a local folder (under its own name, if no destination_name).
     """
     blob = bucket.blob(blob_name)
-    destination_path = os.path.join(destination_folder, os.path.basename(blob_name))
+    destination_path = os.path.join(
+        destination_folder, destination_name or os.path.basename(blob_name)
+    )
     logger.info(f"Downloading {blob_name} to {destination_path}...")
     blob.download_to_filename(destination_path)
 
 
 def download_images(
-    bucket, blob_names, destination_folder: str = "./temp_dataset", max_threads: int = 4
+    bucket,
+    blob_names,
+    destination_folder: str = "./temp_dataset",
+    max_threads: int = 4,
+    destination_names: Optional[List[str]] = None,
 ) -> None:
     """
     Download specific image blobs from a GCS bucket to a local folder using multiple threads.
     """
     os.makedirs(destination_folder, exist_ok=True)
+    if destination_names is None:
+        destination_names = [None] * len(blob_names)
 
     # Use ThreadPoolExecutor for parallel downloads
     with ThreadPoolExecutor(max_threads) as executor:
         # Submit tasks for each blob to be downloaded
         futures = [
-            executor.submit(download_blob, bucket, blob_name, destination_folder)
-            for blob_name in blob_names
+            executor.submit(
+                download_blob, bucket, blob_name, destination_folder, destination_name
+            )
+            for blob_name, destination_name in zip(blob_names, destination_names)
         ]
         # Wait for all threads to complete
         for future in futures:
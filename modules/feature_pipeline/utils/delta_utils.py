@@ -0,0 +1,355 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from build_utils import get_available_sv, thin_query_points
+from cloud_utils import (
+    graph_exists,
+    list_window_indexes,
+    read_graph_gcs,
+    upload_graph_to_gcs,
+    upload_json_to_gcs,
+)
+from config_model import SetupConfig
+from finder_utils.run import DriverPool, find, replace_api_key
+from general_utils import date_bounds, get_window_indexes
+from google.cloud.storage import Bucket
+from graph_store import GRAPH_EXTENSION, GraphStore, encode_dates
+from logger import logger
+from merge_utils import merge_graph_stores, merge_graphs_parallel
+from numpy.typing import NDArray
+from pano_registry import PanoRegistry
+
+
+def window_pairs(
+    lat: NDArray[np.float64],
+    lon: NDArray[np.float64],
+    windows: NDArray[np.float64],
+    window_indexes: List[int],
+) -> Tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """
+    Finds the sub-windows the points are part of (sub-windows overlap, so a point can be part of several)
+    Args:
+        lat: np.ndarray[nr_points] of latitudes
+        lon: np.ndarray[nr_points] of longitudes
+        windows: np.ndarray[nr_sub_windows, 4] of (min_lon, max_lon, min_lat, max_lat)
+        window_indexes: indexes of the sub-windows to consider
+
+    Returns:
+        (point indexes, window indexes) pairs, sorted by point index
+    """
+    window_indexes = np.asarray(window_indexes, dtype=np.int64)
+    if len(lat) == 0 or len(window_indexes) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    selected = windows[window_indexes]
+    boxes = shapely.box(selected[:, 0], selected[:, 2], selected[:, 1], selected[:, 3])
+    points, boxes_index = shapely.STRtree(boxes).query(
+        shapely.points(lon, lat), predicate="intersects"
+    )
+    order = np.argsort(points, kind="stable")
+
+    return points[order], window_indexes[boxes_index[order]]
+
+
+def changed_points(
+    image_res: List[dict],
+    lat: NDArray[np.float64],
+    lon: NDArray[np.float64],
+    stored_dates: Dict[str, float],
+    stored_panos: PanoRegistry,
+    radius: float,
+) -> NDArray[np.bool_]:
+    """
+    Compares the finder results of probe points with the stored SV graph
+    Args:
+        image_res: finder results of the probe points (see find)
+        lat: np.ndarray[nr_points] of latitudes of the probe points
+        lon: np.ndarray[nr_points] of longitudes of the probe points
+        stored_dates: pano ID -> YYYYMM encoded date, of the stored SV graph
+        stored_panos: registry of the stored panos, to find the stored coverage
+        radius: finder radius, in meters
+
+    Returns:
+        np.ndarray[nr_points] mask of the points where a new pano, a new date or no pano (where the stored graph
+        has some) was found, the points the finder could not search are not changed
+    """
+    changed = np.zeros(len(image_res), dtype=bool)
+    no_results = []
+    for i, res in enumerate(image_res):
+        if res["status"] == "OK":
+            stored_date = stored_dates.get(res["pano"])
+            if stored_date is None:
+                changed[i] = True
+            else:
+                date = encode_dates([res.get("date")])[0]
+                changed[i] = date != stored_date and not (
+                    np.isnan(date) and np.isnan(stored_date)
+                )
+        elif res["status"] == "NO_RESULTS":
+            no_results.append(i)
+        # Points that could not be searched (ERROR) are left out of the comparison
+
+    # Coverage removed where the stored graph has panos
+    if no_results:
+        changed[no_results] = stored_panos.covered(lat[no_results], lon[no_results], radius)
+
+    return changed
+
+
+def probe_window(
+    cfg: SetupConfig,
+    driver_pool: DriverPool,
+    lat: NDArray[np.float64],
+    lon: NDArray[np.float64],
+) -> List[dict]:
+    """Runs the SV finder on the probe points of a sub-window (the points it could not search are returned as ERROR)"""
+    build_cfg = cfg.features.build
+    empty = np.empty(0, dtype=np.int64)
+    g = GraphStore.from_edges(lat, lon, empty, empty)
+
+    with driver_pool.session() as driver:
+        image_res, _, _ = find(
+            g,
+            driver,
+            radius=build_cfg.distance_between_points * 2,
+            cfg=cfg,
+            timeout=build_cfg.sv_timeout,
+            allow_errors=True,
+        )
+
+    return image_res
+
+
+def probe_windows(
+    cfg: SetupConfig,
+    osm_graph: GraphStore,
+    sv_graph: GraphStore,
+    pairs: Tuple[NDArray[np.int64], NDArray[np.int64]],
+) -> Tuple[List[int], dict]:
+    """
+    Probes the SV coverage of the sub-windows, on the OSM points about delta_probe_spacing meters apart, and
+    compares it with the stored SV graph
+    Args:
+        cfg: configuration object
+        osm_graph: merged OSM graph of the area
+        sv_graph: merged SV graph of the area
+        pairs: (point indexes, window indexes) pairs of the OSM points (see window_pairs)
+
+    Returns:
+        (changed window indexes, probe report)
+    """
+    build_cfg = cfg.features.build
+    radius = build_cfg.distance_between_points * 2
+    points, point_windows = pairs
+
+    # Probe each point once, from the first sub-window it is part of
+    probed, first = np.unique(points, return_index=True)
+    probe_windows_index = point_windows[first]
+    window_points = {}
+    for window_index in np.unique(probe_windows_index).tolist():
+        candidates = probed[probe_windows_index == window_index]
+        keep = thin_query_points(
+            osm_graph.lat[candidates], osm_graph.lon[candidates], build_cfg.delta_probe_spacing
+        )
+        window_points[window_index] = candidates[keep]
+
+    # Stored panos, with their dates and locations
+    panos = sv_graph.node_keys()
+    stored_dates = dict(zip(panos, sv_graph.date.tolist()))
+    stored_panos = PanoRegistry()
+    stored_panos.add(
+        (pano, lat, lon, None)
+        for pano, lat, lon in zip(panos, sv_graph.lat.tolist(), sv_graph.lon.tolist())
+    )
+
+    html_file_path = replace_api_key(cfg.google_token)
+    max_workers = max(1, min(build_cfg.max_workers_sv, len(window_points)))
+    driver_pool = DriverPool(html_file_path, max_workers, build_cfg.driver_recycle_after)
+
+    # Number of probe points the finder could not search, per sub-window
+    errored_points = []
+
+    def probe(window_index: int) -> Optional[NDArray[np.int64]]:
+        """Changed OSM points of a sub-window, None if the probe failed"""
+        indexes = window_points[window_index]
+        lat, lon = osm_graph.lat[indexes], osm_graph.lon[indexes]
+        try:
+            image_res = probe_window(cfg, driver_pool, lat, lon)
+        except Exception as e:
+            logger.error(f"Delta build -- probe failed for sub-window {window_index}: {e}")
+            return None
+
+        nr_errors = sum(res["status"] == "ERROR" for res in image_res)
+        if nr_errors:
+            errored_points.append(nr_errors)
+            logger.warning(
+                f"Delta build -- {nr_errors}/{len(image_res)} probe points not searched for sub-window {window_index}"
+            )
+
+        return indexes[changed_points(image_res, lat, lon, stored_dates, stored_panos, radius)]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(window_points, executor.map(probe, window_points)))
+    finally:
+        driver_pool.close()
+        if os.path.exists(html_file_path):
+            os.remove(html_file_path)
+
+    # Sub-windows containing a changed point (in any of the sub-windows it is part of), or whose probe failed
+    failed = [window_index for window_index, changed in results.items() if changed is None]
+    changed = np.concatenate(
+        [np.empty(0, dtype=np.int64)]
+        + [changed for changed in results.values() if changed is not None]
+    )
+    changed_windows = sorted(
+        set(point_windows[np.isin(points, changed)].tolist()) | set(failed)
+    )
+
+    report = {
+        "probed_windows": len(window_points),
+        "probed_points": int(sum(len(indexes) for indexes in window_points.values())),
+        "changed_points": int(len(changed)),
+        "errored_points": int(sum(errored_points)),
+        "failed_windows": failed,
+        "changed_windows": changed_windows,
+    }
+
+    return changed_windows, report
+
+
+def write_osm_windows(
+    cfg: SetupConfig,
+    bucket: Bucket,
+    osm_graph: GraphStore,
+    pairs: Tuple[NDArray[np.int64], NDArray[np.int64]],
+    window_indexes: List[int],
+) -> None:
+    """Clips the merged OSM graph to the sub-windows to rebuild, instead of querying and converting OSM again"""
+    points, point_windows = pairs
+
+    for window_index in window_indexes:
+        mask = np.zeros(osm_graph.number_of_nodes(), dtype=bool)
+        mask[points[point_windows == window_index]] = True
+        if not mask.any():
+            continue
+
+        upload_graph_to_gcs(
+            bucket,
+            f"{cfg.area.output_path}/{cfg.osm_name}_{window_index}.graph",
+            osm_graph.subgraph(mask),
+        )
+
+
+def patch_merged_sv(
+    cfg: SetupConfig,
+    bucket: Bucket,
+    windows: NDArray[np.float64],
+    sv_graph: GraphStore,
+    window_indexes: List[int],
+) -> GraphStore:
+    """
+    Replaces the panos of the rebuilt sub-windows in the merged SV graph by their new SV graphs
+    Args:
+        cfg: configuration object
+        bucket: cloud bucket instance
+        windows: np.ndarray[nr_sub_windows, 4]
+        sv_graph: merged SV graph of the area
+        window_indexes: indexes of the rebuilt sub-windows
+
+    Returns:
+        patched merged SV graph
+    """
+    build_cfg = cfg.features.build
+
+    # Keep the panos outside the rebuilt sub-windows
+    inside = np.zeros(sv_graph.number_of_nodes(), dtype=bool)
+    inside[window_pairs(sv_graph.lat, sv_graph.lon, windows, window_indexes)[0]] = True
+    result_graph = sv_graph.subgraph(~inside)
+
+    # Add the new SV graphs of the rebuilt sub-windows
+    existing = list_window_indexes(
+        bucket, cfg.area.output_path, cfg.sv_name, GRAPH_EXTENSION
+    )
+    sub_window_sv_filenames = [
+        f"{cfg.area.output_path}/{cfg.sv_name}_{i}.graph"
+        for i in window_indexes
+        if i in existing
+    ]
+    if sub_window_sv_filenames:
+        new_graph = merge_graphs_parallel(
+            bucket,
+            sub_window_sv_filenames,
+            build_cfg.max_workers_merge,
+            "SV",
+            date_range=date_bounds(build_cfg.date_range),
+        )
+        result_graph = merge_graph_stores([result_graph, new_graph])
+
+    logger.info(
+        f"Delta build -- {int(inside.sum())} stored panos replaced by the SV graphs of "
+        f"{len(sub_window_sv_filenames)} sub-windows"
+    )
+
+    # Compute the missing edge lengths and upload
+    result_graph.compute_distances(only_missing=True)
+    upload_graph_to_gcs(
+        bucket, f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph", result_graph
+    )
+
+    return result_graph
+
+
+def delta_build(
+    cfg: SetupConfig,
+    windows: NDArray[np.float64],
+    bucket: Bucket,
+    window_indexes: Optional[List[int]] = None,
+) -> bool:
+    """
+    Updates the SV graph of an already built area, only where the SV imagery changed: the sub-windows are probed
+    with the finder on a sample of the stored OSM points, and only the sub-windows where new panos (or dates) are
+    found are rebuilt and patched into the merged SV graph. The stored OSM graph is reused as is.
+    Args:
+        cfg: configuration object
+        windows: np.ndarray[nr_sub_windows, 4]
+        bucket: cloud bucket instance
+        window_indexes: indexes of the sub-windows to probe (all of them by default)
+
+    Returns:
+        False if the area has no merged graphs to update (a full build is needed), True otherwise
+    """
+    merged_osm_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.graph"
+    merged_sv_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph"
+    if not (graph_exists(bucket, merged_osm_path) and graph_exists(bucket, merged_sv_path)):
+        logger.info(f"Delta build -- {cfg.area.name} was not built yet, running a full build")
+        return False
+
+    osm_graph = read_graph_gcs(bucket, merged_osm_path)
+    sv_graph = read_graph_gcs(bucket, merged_sv_path)
+
+    # Probe the sub-windows and find the ones where the imagery changed
+    window_indexes = get_window_indexes(windows, window_indexes)
+    pairs = window_pairs(osm_graph.lat, osm_graph.lon, windows, window_indexes)
+    changed_windows, report = probe_windows(cfg, osm_graph, sv_graph, pairs)
+    logger.info(
+        f"Delta build -- {report['changed_points']}/{report['probed_points']} probe points changed, "
+        f"{len(changed_windows)}/{report['probed_windows']} sub-windows to rebuild"
+    )
+
+    if changed_windows:
+        # Rebuild the SV graphs of the changed sub-windows only, from the stored OSM graph
+        write_osm_windows(cfg, bucket, osm_graph, pairs, changed_windows)
+        get_available_sv(cfg, windows, bucket, changed_windows)
+
+        # Patch the merged SV graph in place
+        patched_graph = patch_merged_sv(cfg, bucket, windows, sv_graph, changed_windows)
+        report["panos_before"] = sv_graph.number_of_nodes()
+        report["panos_after"] = patched_graph.number_of_nodes()
+
+    upload_json_to_gcs(bucket, f"{cfg.area.data_path}/delta_build.json", report)
+
+    return True
@@ -1,73 +1,114 @@
-const foundLocations = new Set();
-let pauseRequests = false;
+// State of the current search, polled from Python with pollFind()
+let finder = null;
 
 function delay(ms) {
   return new Promise(resolve => setTimeout(resolve, ms));
 }
 
-async function run(lats, lons, initialRadius) {
-  const originalLats = lats.split(',').map((value) => parseFloat(value));
-  const originalLngs = lons.split(',').map((value) => parseFloat(value));
-  const results = await Promise.all(originalLats.map(async (originalLat, i) => {
-    const originalLng = originalLngs[i];
-    const panoramaLocation = await findPanoramaWithPause(originalLat, originalLng, initialRadius);
-    return panoramaLocation;
+// Starts the search of the panoramas closest to the points (lats[i], lngs[i]), with at most `concurrency`
+// requests in flight. Panoramas dated ('YYYY-MM') outside [dateStart, dateEnd] (null for unbounded) are returned
+// as OUT_OF_RANGE, without their links, and points still failing after maxAttempts as ERROR. Returns immediately: results are collected with pollFind()
+function startFind(lats, lngs, initialRadius, concurrency, maxAttempts, dateStart, dateEnd) {
+  const state = {
+    total: lats.length,
+    dateStart: dateStart || null,
+    dateEnd: dateEnd || null,
+    next: 0,
+    completed: 0,
+    results: [],
+    // The page is reused across sub-windows: only deduplicate the locations of this one
+    foundLocations: new Set(),
+  };
+  finder = state;
 
-  }));
-  return results;
+  async function worker() {
+    while (state.next < state.total) {
+      const index = state.next++;
+      const result = await findPanorama(state, lats[index], lngs[index], initialRadius, maxAttempts);
+      result.index = index;
+      state.results.push(result);
+      state.completed++;
+    }
+  }
+
+  const nrWorkers = Math.max(1, Math.min(concurrency, state.total));
+  for (let i = 0; i < nrWorkers; i++) {
+    worker();
+  }
 }
 
-async function findPanoramaWithPause(originalLat, originalLng, initialRadius) {
-  while (pauseRequests) {
-    await delay(60000); // Wait for 10 second if paused
+// Returns (and removes) up to maxItems of the results found since the last call, with the search progress
+function pollFind(maxItems) {
+  if (finder === null) {
+    return { results: [], completed: 0, total: 0, done: true };
   }
-  return findPanorama(originalLat, originalLng, initialRadius);
+  return {
+    results: finder.results.splice(0, maxItems),
+    completed: finder.completed,
+    total: finder.total,
+    done: finder.completed === finder.total && finder.results.length === 0,
+  };
 }
 
-async function findPanorama(originalLat, originalLng, initialRadius) {
-  var panoramaService = new google.maps.StreetViewService();
-  var prefType = google.maps.StreetViewPreference.NEAREST;
-  var sourceTypes = [google.maps.StreetViewSource.OUTDOOR, google.maps.StreetViewSource.OUTDOOR];
-  var latLon = new google.maps.LatLng(originalLat, originalLng);
+function getPanorama(panoramaService, request) {
+  return new Promise(resolve => {
+    panoramaService.getPanorama(request, (data, status) => resolve({ data, status }));
+  });
+}
+
+// Finds the panorama closest to a point. Failed requests are retried on their own, with a jittered backoff,
+// without pausing the other ones
+async function findPanorama(state, originalLat, originalLng, initialRadius, maxAttempts) {
+  const panoramaService = new google.maps.StreetViewService();
+  const request = {
+    location: new google.maps.LatLng(originalLat, originalLng),
+    preference: google.maps.StreetViewPreference.NEAREST,
+    radius: initialRadius,
+    sources: [google.maps.StreetViewSource.OUTDOOR],
+  };
+
+  for (let attempt = 0; attempt < maxAttempts; attempt++) {
+    let response;
+    try {
+      response = await getPanorama(panoramaService, request);
+    } catch (e) {
+      response = { data: null, status: 'ERROR' };
+    }
+    const { data, status } = response;
+
+    if (status === 'OK') {
+      const lat = data.location.latLng.lat();
+      const lng = data.location.latLng.lng();
+      const locationKey = `${lat},${lng}`;
+      if (state.foundLocations.has(locationKey)) {
+        return { status: 'SAME' };
+      }
+      state.foundLocations.add(locationKey);
 
-  return new Promise(function(resolve, reject) {
-    // Initialize attempts counter
-    let attempts = 0;
-    async function attemptFetch() {
-      if (attempts > 2) {
-        return resolve('NO_RESULTS');
+      // Out of the date range: keep the location and date, so that the pano is not looked up again, but do not
+      // follow its links
+      const date = data.imageDate;
+      if (date && ((state.dateStart && date < state.dateStart) || (state.dateEnd && date > state.dateEnd))) {
+        return { status: 'OUT_OF_RANGE', lat: lat, lng: lng, pano: data.location.pano, date: date };
       }
-      panoramaService.getPanorama({ location: latLon, preference: prefType, radius: initialRadius, sources: sourceTypes }, async function (data, status) {
-        if (status === 'OK') {
-          const panoramaLocation = data.location.latLng.toString();
-          const panoramaID = data.location.pano;
-          const date = data.imageDate
-          const links = data.links
-          if (!foundLocations.has(panoramaLocation)) {
-            // Add to found locations set
-            foundLocations.add(panoramaLocation);
-            resolve([panoramaLocation, panoramaID, date, links]);
-          } else {
-            // Resolve to 'SAME' to continue searching
-            resolve('SAME');
-          }
-        } else {
-            if (status == 'ZERO_RESULTS') {
-                resolve('NO_RESULTS')
-            }
-            else {
-              // Retry in case of error
-              attempts++;
 
-              pauseRequests = true;
-              await delay(60000); // Wait for 10 second
-              pauseRequests = false; // Resume requests
-              attemptFetch();
-  //          setTimeout(attemptFetch, 100); // Wait 1 second before retrying
-            }
-        }
-      });
+      return {
+        status: 'OK',
+        lat: lat,
+        lng: lng,
+        pano: data.location.pano,
+        date: date,
+        links: (data.links || []).map(link => link.pano),
+      };
     }
-    attemptFetch();
-  });
+    if (status === 'ZERO_RESULTS') {
+      return { status: 'NO_RESULTS' };
+    }
+
+    // Retry in case of error
+    await delay(Math.random() * 1000 * 2 ** attempt);
+  }
+
+  // Not the same as no panorama here: the point could not be searched (quota, network)
+  return { status: 'ERROR' };
 }
@@ -1,12 +1,15 @@
-import ast
 import os
-from typing import List, Tuple
-
-import networkx as nx
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+from general_utils import date_bounds
+from graph_store import GraphStore
 from logger import logger
 from selenium import webdriver
 from selenium.webdriver.chrome.webdriver import WebDriver
-import datetime
 
 def driver_setup() -> WebDriver:
     """Sets up a headless Chrome webdriver"""
@@ -22,15 +25,105 @@ def driver_setup() -> WebDriver:
     return webdriver.Chrome(options=op)
 
 
-def nodes_to_string(g: nx.Graph) -> Tuple[str, str]:
-    """Create string representations of (latitudes, longitudes) coordinates of points in graph"""
-    string_lats = ""
-    string_lons = ""
-    for _, node in g.nodes(data=True):
-        string_lats += f"{node['lat']},"
-        string_lons += f"{node['lon']},"
+class DriverSession:
+    """Headless Chrome session with the finder page loaded"""
+
+    def __init__(self, html_file_path: str) -> None:
+        self.html_file_path = html_file_path
+        self.nr_windows = 0
+        self.driver = driver_setup()
+        self.load_page()
+
+    def load_page(self) -> None:
+        """Opens the finder page (Google Maps JS and find.js)"""
+        self.driver.get(f"file://{self.html_file_path}")
+
+    def is_healthy(self) -> bool:
+        """Whether the browser answers and the finder page is still loaded"""
+        try:
+            return self.driver.execute_script(
+                "return typeof google === 'object' && typeof startFind === 'function';"
+            )
+        except Exception:
+            return False
+
+    def quit(self) -> None:
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.error(f"Driver pool -- Error at closing a session: {e}")
+
+
+class DriverPool:
+    """
+    Pool of long-lived headless Chrome sessions, keeping the finder page loaded between sub-windows.
+    Sessions are started on demand (at most size), checked before being handed out, and recycled after
+    max_windows sub-windows or when a sub-window failed on them.
+    """
 
-    return string_lats[:-1], string_lons[:-1]
+    def __init__(self, html_file_path: str, size: int, max_windows: int = 50) -> None:
+        self.html_file_path = html_file_path
+        self.size = size
+        self.max_windows = max_windows
+        self._idle: queue.Queue = queue.Queue()
+        self._nr_sessions = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> DriverSession:
+        """Returns an idle session, or starts a new one if the pool is not full"""
+        with self._lock:
+            start_new = self._idle.empty() and self._nr_sessions < self.size
+            if start_new:
+                self._nr_sessions += 1
+
+        if not start_new:
+            session = self._idle.get()
+            if session.is_healthy():
+                return session
+
+            # Reload the page, else restart the browser
+            try:
+                session.load_page()
+                if session.is_healthy():
+                    return session
+            except Exception as e:
+                logger.warning(f"Driver pool -- Unhealthy session, restarting it: {e}")
+            session.quit()
+
+        try:
+            return DriverSession(self.html_file_path)
+        except Exception:
+            with self._lock:
+                self._nr_sessions -= 1
+            raise
+
+    def _release(self, session: DriverSession, failed: bool) -> None:
+        """Gives a session back to the pool, or closes it if it failed or served max_windows sub-windows"""
+        session.nr_windows += 1
+        if failed or session.nr_windows >= self.max_windows:
+            session.quit()
+            with self._lock:
+                self._nr_sessions -= 1
+        else:
+            self._idle.put(session)
+
+    @contextmanager
+    def session(self) -> Iterator[WebDriver]:
+        """Context manager lending a webdriver with the finder page loaded"""
+        session = self._acquire()
+        failed = True
+        try:
+            yield session.driver
+            failed = False
+        finally:
+            self._release(session, failed)
+
+    def close(self) -> None:
+        """Closes all the idle sessions"""
+        while not self._idle.empty():
+            self._idle.get().quit()
+        with self._lock:
+            self._nr_sessions = 0
 
 
 def replace_api_key(api_key: str) -> str:
@@ -57,88 +150,86 @@ def replace_api_key(api_key: str) -> str:
     return os.path.abspath(output_html)
 
 
+class FindError(Exception):
+    """Points could not be searched by the SV finder (quota, network), after all their attempts"""
+
+
 def find(
-    g: nx.Graph,
-    html_file_path: str,
+    g: GraphStore,
     driver: WebDriver,
     radius: int,
     cfg,
-    timeout: int = 60  # ← AJOUTER ce paramètre avec valeur par défaut
-) -> Tuple[List[List[str]], Tuple[float, ...], Tuple[float, ...]]:
+    timeout: int = 60,
+    allow_errors: bool = False,
+) -> Tuple[List[dict], Tuple[float, ...], Tuple[float, ...]]:
     """
-    Finds available SV locations
+    Finds available SV locations. The search runs in the page with a bounded concurrency, and its results are
+    polled in chunks, so that large sub-windows do not hit the script timeout.
     Args:
         g: graph of OS points
-        html_file_path: path to HTML file to be loaded in the headless browser
-        driver: chrome webdriver
+        driver: chrome webdriver, with the finder page loaded (see DriverPool)
         radius: radius in meters, set around each OSM point, and used in panorama search
+        cfg: configuration object
+        timeout: seconds without any new result after which the search is considered stuck
+        allow_errors: whether to return the results of the points that could not be searched (ERROR status),
+            instead of raising a FindError
 
     Returns:
-        (available_locations_dates, lats, lons) with:
-
-        available_locations_dates -> [['(sv_lat1, sv_lon1)', 'sv_date1'], ['(sv_lat2, sv_lon2)', 'sv_date2'], ....]
+        (available_locations, lats, lons) with:
+
+        available_locations -> one result per point, with status in [OK, OUT_OF_RANGE, SAME, NO_RESULTS, ERROR]:
+            [{'status': 'OK', 'lat': sv_lat1, 'lng': sv_lon1, 'pano': pano1, 'date': date1, 'links': [pano, ...]},
+             {'status': 'OUT_OF_RANGE', 'lat': sv_lat2, 'lng': sv_lon2, 'pano': pano2, 'date': date2},
+             {'status': 'NO_RESULTS'}, {'status': 'ERROR'}, ....]
+            OUT_OF_RANGE panos are dated outside features.build.date_range, and their links are not followed.
+            ERROR points could not be searched (only returned with allow_errors)
         lats -> (lat1, lat2, .....)
         lons -> (lon1, lon2, .....)
     """
+    build_cfg = cfg.features.build
+    date_start, date_end = date_bounds(build_cfg.date_range)
+    lats = tuple(g.lat.tolist())
+    lons = tuple(g.lon.tolist())
 
-    # Transform nodes coords to string
-    string_lats, string_lons = nodes_to_string(g)
-
-    # Open the HTML file in the browser
-    try:
-        driver.get(f"file://{html_file_path}")
-    except Exception as e:
-        logger.error(f"Inside run error is: {e}")
-
-    # Set timeout for the script
+    # Set timeout for the scripts
     driver.set_script_timeout(timeout)
 
-    # Load the JS code in memory
-    with open("utils/finder_utils/find.js", "r") as f:
-        _ = f.read()
-
-    # Execute the string command ( taken from the JS file loaded into memory)
-    available_locations_dates = driver.execute_script(
-        "return run(arguments[0], arguments[1], arguments[2]);",
-        string_lats,
-        string_lons,
+    driver.execute_script(
+        "startFind(arguments[0], arguments[1], arguments[2], arguments[3], arguments[4], arguments[5], "
+        "arguments[6]);",
+        lats,
+        lons,
         radius,
+        build_cfg.find_concurrency,
+        build_cfg.find_max_attempts,
+        date_start,
+        date_end,
     )
-    # -----------------------------------------------
-    # FILTER STEP: Keep only dates between config start and end
-    # -----------------------------------------------
-
-    # # Get the date range from the configuration
-    # build_cfg = cfg.features.build
-    # start_str = build_cfg.date_range.start  # 'YYYY-MM-DD'
-    # end_str   = build_cfg.date_range.end    # 'YYYY-MM-DD'
-    # # convert to datetime objects
-    # start_dt = datetime.datetime.strptime(start_str, "%Y-%m-%d")
-    # end_dt   = datetime.datetime.strptime(end_str,   "%Y-%m-%d")
-
-    # filtered_locations = []
-    # for coord_pair, date_str in available_locations_dates:
-    #     # date_str is in 'YYYYMMDD' format; convert to a datetime object
-    #     try:
-    #         img_date = datetime.datetime.strptime(date_str, "%Y%m%d")
-    #     except ValueError:
-    #         # If the date string is malformed for any reason, skip it
-    #         continue
-
-    #     # If the image date is within the inclusive range start_dt to end_dt, keep it
-    #     if start_dt <= img_date <= end_dt:
-    #         filtered_locations.append([coord_pair, date_str])
-
-    # # Replace the original list with our filtered list
-    # available_locations_dates = filtered_locations
-    # Convert to lists of numbers
-    lats = ast.literal_eval(string_lats)
-    lons = ast.literal_eval(string_lons)
-
-    if not isinstance(lats, tuple):
-        lats = tuple([lats])
-
-    if not isinstance(lons, tuple):
-        lons = tuple([lons])
-
-    return available_locations_dates, lats, lons
+
+    # Poll the results until all the points are processed
+    available_locations = [None] * len(lats)
+    last_progress = time.monotonic()
+    while True:
+        state = driver.execute_script(
+            "return pollFind(arguments[0]);", build_cfg.find_chunk_size
+        )
+        for result in state["results"]:
+            available_locations[result.pop("index")] = result
+
+        if state["done"]:
+            break
+
+        if state["results"]:
+            last_progress = time.monotonic()
+        elif time.monotonic() - last_progress > timeout:
+            raise TimeoutError(
+                f"SV finder stuck at {state['completed']}/{state['total']} points"
+            )
+
+        time.sleep(build_cfg.find_poll_interval)
+
+    nr_errors = sum(result["status"] == "ERROR" for result in available_locations)
+    if nr_errors and not allow_errors:
+        raise FindError(f"SV finder failed for {nr_errors}/{len(lats)} points")
+
+    return available_locations, lats, lons
@@ -1,49 +1,18 @@
 import json
 import math
-from math import acos, cos, pi, sin
-from typing import List
+from typing import List, Optional, Tuple
 
 import networkx as nx
 import networkx.readwrite.json_graph as json_graph
 import numpy as np
+import shapely
 import yaml
+from config_model import DateRange
+from geo_utils import distance
 from numpy.typing import NDArray
 from shapely import Polygon
 
 
-# from http://www.johndcook.com/blog/python_longitude_latitude/
-def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """
-    Computes the distance between 2 points defined by lat/lon
-    Args:
-        lat1: Latitude of first points
-        lon1: Longitude of first point
-        lat2: Latitude of second points
-        lon2: Longitude of second point
-
-    Returns:
-        distance in meters between the 2 points
-    """
-
-    # Convert latitude and longitude to
-    # spherical coordinates in radians.
-    degrees_to_radians = pi / 180.0
-
-    # phi = 90 - latitude
-    phi1 = (90.0 - lat1) * degrees_to_radians
-    phi2 = (90.0 - lat2) * degrees_to_radians
-
-    # theta = longitude
-    theta1 = lon1 * degrees_to_radians
-    theta2 = lon2 * degrees_to_radians
-
-    cos_val = sin(phi1) * sin(phi2) * cos(theta1 - theta2) + cos(phi1) * cos(phi2)
-    cos_val = min(1, cos_val)
-    arc_val = acos(cos_val)
-
-    return arc_val * 6373000
-
-
 def read_graph_json(json_path: str) -> nx.DiGraph:
     with open(json_path, "r", encoding="utf-8") as f:
         js_graph = json.load(f)
@@ -171,3 +140,45 @@ def split_window(
     ordered_windows = order_windows_coordinates(np.array(result))
 
     return ordered_windows
+
+
+def plan_windows(
+    windows: NDArray[np.float64], polygon_coords: List[List[float]]
+) -> NDArray[np.bool_]:
+    """
+    Marks the sub-windows intersecting the area polygon, the others do not need to be processed
+    Args:
+        windows: np.ndarray[num_sub_windows, 4] -> the order on last axis is: (min_lon, max_lon, min_lat, max_lat)
+        polygon_coords: list of lat/lon coordinates of the area polygon
+
+    Returns:
+        np.ndarray[num_sub_windows] mask of the sub-windows to process
+    """
+    polygon = Polygon(polygon_coords)
+    shapely.prepare(polygon)
+
+    # Boxes in the lat/lon order of the polygon
+    boxes = shapely.box(windows[:, 2], windows[:, 0], windows[:, 3], windows[:, 1])
+
+    return shapely.intersects(polygon, boxes)
+
+
+def get_window_indexes(
+    windows: NDArray[np.float64], window_indexes: Optional[List[int]] = None
+) -> List[int]:
+    """Returns the indexes of the sub-windows to process, all of them if not specified"""
+    if window_indexes is None:
+        return list(range(len(windows)))
+
+    return list(window_indexes)
+
+
+def date_bounds(date_range: Optional[DateRange]) -> Tuple[Optional[str], Optional[str]]:
+    """First and last months ('YYYY-MM') of the SV imagery to keep, None when unbounded"""
+    if date_range is None:
+        return None, None
+
+    return (
+        str(date_range.start)[:7] if date_range.start else None,
+        str(date_range.end)[:7] if date_range.end else None,
+    )
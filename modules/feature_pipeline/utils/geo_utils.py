@@ -0,0 +1,101 @@
+from typing import Tuple
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+
+# Earth radius in meters, as used for all the distances of the pipeline
+EARTH_RADIUS = 6373000
+
+
+def distance(
+    lat1: ArrayLike, lon1: ArrayLike, lat2: ArrayLike, lon2: ArrayLike
+) -> NDArray[np.float64]:
+    """
+    Computes the great circle (haversine) distance between points defined by lat/lon, element-wise
+    Args:
+        lat1: latitudes of the first points
+        lon1: longitudes of the first points
+        lat2: latitudes of the second points
+        lon2: longitudes of the second points
+
+    Returns:
+        distances in meters (a float for scalar inputs)
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def bearing(
+    lat1: ArrayLike, lon1: ArrayLike, lat2: ArrayLike, lon2: ArrayLike
+) -> NDArray[np.float64]:
+    """
+    Computes the initial bearing from the first to the second points, element-wise
+    Returns:
+        bearings in degrees, clockwise from north, in [0, 360)
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    d_lon = lon2 - lon1
+
+    y = np.sin(d_lon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(d_lon)
+
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def destination(
+    lat: ArrayLike, lon: ArrayLike, heading: ArrayLike, dist: ArrayLike
+) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Computes the points reached from lat/lon after dist meters along the heading, element-wise
+    Args:
+        lat: latitudes of the start points
+        lon: longitudes of the start points
+        heading: bearings in degrees, clockwise from north
+        dist: distances in meters
+
+    Returns:
+        (latitudes, longitudes) of the destination points
+    """
+    lat, lon, heading = map(np.radians, (lat, lon, heading))
+    angle = np.asarray(dist) / EARTH_RADIUS
+
+    lat2 = np.arcsin(
+        np.sin(lat) * np.cos(angle) + np.cos(lat) * np.sin(angle) * np.cos(heading)
+    )
+    lon2 = lon + np.arctan2(
+        np.sin(heading) * np.sin(angle) * np.cos(lat),
+        np.cos(angle) - np.sin(lat) * np.sin(lat2),
+    )
+
+    return np.degrees(lat2), (np.degrees(lon2) + 540) % 360 - 180
+
+
+def to_enu(
+    lat: ArrayLike, lon: ArrayLike, lat0: float, lon0: float
+) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Projects points to the local east/north plane tangent at lat0/lon0 (meters).
+    Accurate for the short ranges (a few km) the pipeline works with.
+    """
+    east = np.radians(np.asarray(lon) - lon0) * EARTH_RADIUS * np.cos(np.radians(lat0))
+    north = np.radians(np.asarray(lat) - lat0) * EARTH_RADIUS
+
+    return east, north
+
+
+def from_enu(
+    east: ArrayLike, north: ArrayLike, lat0: float, lon0: float
+) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """Inverse of to_enu: maps local east/north offsets (meters) around lat0/lon0 back to lat/lon"""
+    lat = lat0 + np.degrees(np.asarray(north) / EARTH_RADIUS)
+    lon = lon0 + np.degrees(
+        np.asarray(east) / (EARTH_RADIUS * np.cos(np.radians(lat0)))
+    )
+
+    return lat, lon
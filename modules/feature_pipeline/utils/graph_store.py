@@ -0,0 +1,435 @@
+import json
+import math
+import struct
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+from geo_utils import distance as geo_distance
+from numpy.typing import NDArray
+
+# File signature and layout version of the binary graph format
+GRAPH_MAGIC = b"GEOGRAPH"
+GRAPH_VERSION = 1
+
+# Alignment (in bytes) of every array in the data section, so they can be memory-mapped
+ARRAY_ALIGNMENT = 64
+
+# Extension used for all graphs written by the pipeline
+GRAPH_EXTENSION = "graph"
+
+# Extension of the networkx JSON graphs written before the graph store format (still readable)
+LEGACY_GRAPH_EXTENSION = "json"
+
+
+def encode_dates(dates: List[Optional[str]]) -> NDArray[np.float64]:
+    """
+    Encodes 'YYYY-MM' date strings as YYYYMM floats (NaN for missing values)
+    Args:
+        dates: list of date strings, or None
+
+    Returns:
+        np.ndarray[nr_dates] of encoded dates
+    """
+    encoded = np.full(len(dates), np.nan, dtype=np.float64)
+    for i, date in enumerate(dates):
+        if isinstance(date, str) and len(date) >= 7:
+            try:
+                encoded[i] = int(date[:4]) * 100 + int(date[5:7])
+            except ValueError:
+                continue
+
+    return encoded
+
+
+def decode_date(date: float) -> Optional[str]:
+    """Decodes a YYYYMM float to its 'YYYY-MM' string representation"""
+    if math.isnan(date):
+        return None
+    date = int(date)
+
+    return f"{date // 100:04d}-{date % 100:02d}"
+
+
+def in_date_range(
+    dates: NDArray[np.float64], start: Optional[str] = None, end: Optional[str] = None
+) -> NDArray[np.bool_]:
+    """
+    Finds the encoded dates within a range of months (undated values are kept)
+    Args:
+        dates: np.ndarray[nr_dates] of YYYYMM encoded dates
+        start: first month of the range, as 'YYYY-MM(-DD)', None for unbounded
+        end: last month of the range, as 'YYYY-MM(-DD)', None for unbounded
+
+    Returns:
+        np.ndarray[nr_dates] mask of the dates in the range
+    """
+    first, last = encode_dates([start, end])
+
+    # Comparisons with NaN (missing date or bound) are False
+    return ~(dates < first) & ~(dates > last)
+
+
+class GraphStore:
+    """
+    Columnar, undirected graph of geo-located nodes.
+
+    Nodes are indexed by integers and described by float64 lat/lon/date arrays. Edges are stored
+    as a symmetric CSR adjacency (indptr/indices), with the edge length in meters in a parallel
+    `distance` array. An optional `keys` array keeps the string IDs of the nodes (e.g. pano IDs for
+    SV graphs); when missing, the key of a node is its "lon,lat" string, as for OSM graphs.
+    """
+
+    def __init__(
+        self,
+        lat: NDArray[np.float64],
+        lon: NDArray[np.float64],
+        indptr: NDArray[np.int64],
+        indices: NDArray[np.int32],
+        distance: NDArray[np.float64],
+        date: Optional[NDArray[np.float64]] = None,
+        keys: Optional[NDArray[np.bytes_]] = None,
+    ) -> None:
+        self.lat = lat
+        self.lon = lon
+        self.indptr = indptr
+        self.indices = indices
+        self.distance = distance
+        self.date = (
+            date if date is not None else np.full(len(lat), np.nan, dtype=np.float64)
+        )
+        self.keys = keys
+
+    def number_of_nodes(self) -> int:
+        return len(self.lat)
+
+    def number_of_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def node_keys(self) -> List[str]:
+        """Returns the string IDs of the nodes, as used in the networkx view"""
+        if self.keys is not None:
+            return [key.decode("utf-8") for key in self.keys.tolist()]
+
+        return [f"{lon},{lat}" for lon, lat in zip(self.lon.tolist(), self.lat.tolist())]
+
+    def degree(self) -> NDArray[np.int64]:
+        return np.diff(self.indptr)
+
+    def edges(
+        self,
+    ) -> Tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.float64]]:
+        """
+        Returns every undirected edge once
+        Returns:
+            (u, v, distance) arrays, with u < v
+        """
+        sources = np.repeat(np.arange(self.number_of_nodes()), self.degree())
+        targets = self.indices.astype(np.int64)
+        mask = sources < targets
+
+        return sources[mask], targets[mask], self.distance[mask]
+
+    def compute_distances(self, only_missing: bool = False) -> None:
+        """
+        Sets the edge lengths (meters) from the node coordinates, in a single vectorized pass
+        Args:
+            only_missing: only fill the edges without a length (NaN or 0)
+        """
+        sources = np.repeat(np.arange(self.number_of_nodes()), self.degree())
+        distance = np.array(self.distance, dtype=np.float64)
+        mask = np.ones(len(distance), dtype=bool)
+        if only_missing:
+            mask = np.isnan(distance) | (distance == 0)
+
+        targets = self.indices[mask]
+        distance[mask] = geo_distance(
+            self.lat[sources[mask]],
+            self.lon[sources[mask]],
+            self.lat[targets],
+            self.lon[targets],
+        )
+        self.distance = distance
+
+    def neighbors(self, node: int) -> NDArray[np.int32]:
+        return self.indices[self.indptr[node] : self.indptr[node + 1]]
+
+    @classmethod
+    def from_edges(
+        cls,
+        lat: NDArray[np.float64],
+        lon: NDArray[np.float64],
+        u: NDArray[np.int64],
+        v: NDArray[np.int64],
+        distance: Optional[NDArray[np.float64]] = None,
+        date: Optional[NDArray[np.float64]] = None,
+        keys: Optional[NDArray[np.bytes_]] = None,
+    ) -> "GraphStore":
+        """
+        Builds a graph from node arrays and an undirected edge list
+        Args:
+            lat: np.ndarray[nr_nodes] of latitudes
+            lon: np.ndarray[nr_nodes] of longitudes
+            u: np.ndarray[nr_edges] of source node indexes
+            v: np.ndarray[nr_edges] of target node indexes
+            distance: np.ndarray[nr_edges] of edge lengths in meters (NaN if unknown)
+            date: np.ndarray[nr_nodes] of YYYYMM encoded dates
+            keys: np.ndarray[nr_nodes] of node string IDs
+
+        Returns:
+            GraphStore instance
+        """
+        nr_nodes = len(lat)
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        if distance is None:
+            distance = np.full(len(u), np.nan, dtype=np.float64)
+
+        # Drop self loops, the length of an undirected edge is the one of its first occurrence
+        not_loop = u != v
+        u, v, distance = u[not_loop], v[not_loop], np.asarray(distance)[not_loop]
+        _, first, inverse = np.unique(
+            np.minimum(u, v) * nr_nodes + np.maximum(u, v), return_index=True, return_inverse=True
+        )
+        distance = distance[first][inverse]
+
+        # Symmetric CSR adjacency. The neighbours of a node keep the order of the edge list (edges listing the node
+        # as source first), as in the adjacency of the networkx graphs: the images planned at a node depend on it
+        nr_edges = len(u)
+        sources = np.concatenate([u, v])
+        targets = np.concatenate([v, u])
+        distances = np.concatenate([distance, distance])
+        order = np.lexsort(
+            (
+                np.tile(np.arange(nr_edges), 2),
+                np.repeat([0, 1], nr_edges),
+                sources,
+            )
+        )
+        sources, targets, distances = sources[order], targets[order], distances[order]
+
+        # Keep each directed edge once
+        _, unique_index = np.unique(sources * nr_nodes + targets, return_index=True)
+        unique_index.sort()
+        sources, targets, distances = (
+            sources[unique_index],
+            targets[unique_index],
+            distances[unique_index],
+        )
+        indptr = np.zeros(nr_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=nr_nodes), out=indptr[1:])
+
+        return cls(
+            lat=np.asarray(lat, dtype=np.float64),
+            lon=np.asarray(lon, dtype=np.float64),
+            indptr=indptr,
+            indices=targets.astype(np.int32),
+            distance=distances.astype(np.float64),
+            date=None if date is None else np.asarray(date, dtype=np.float64),
+            keys=keys,
+        )
+
+    @classmethod
+    def from_networkx(cls, g: nx.Graph, keep_keys: bool = True) -> "GraphStore":
+        """
+        Builds a graph from a networkx graph with 'lat'/'lon'(/'date') node attributes
+        Args:
+            g: networkx graph (directed graphs are converted to undirected)
+            keep_keys: whether to store the node IDs; set it to False when the IDs are "lon,lat"
+
+        Returns:
+            GraphStore instance
+        """
+        node_ids = list(g.nodes())
+        node_index = {node: i for i, node in enumerate(node_ids)}
+        node_data = [data for _, data in g.nodes(data=True)]
+
+        lat = np.array([data.get("lat", np.nan) for data in node_data], dtype=np.float64)
+        lon = np.array([data.get("lon", np.nan) for data in node_data], dtype=np.float64)
+        date = encode_dates([data.get("date") for data in node_data])
+
+        # Edges listed from the adjacency of each node, to keep the order of its neighbours
+        u, v, distance = [], [], []
+        for s, neighbours in g.adjacency():
+            for t, data in neighbours.items():
+                u.append(node_index[s])
+                v.append(node_index[t])
+                distance.append(data.get("distance", np.nan))
+
+        keys = None
+        if keep_keys:
+            keys = np.array([str(node).encode("utf-8") for node in node_ids], dtype=np.bytes_)
+
+        return cls.from_edges(
+            lat,
+            lon,
+            np.array(u, dtype=np.int64),
+            np.array(v, dtype=np.int64),
+            np.array(distance, dtype=np.float64),
+            date=date,
+            keys=keys,
+        )
+
+    def to_networkx(self) -> nx.Graph:
+        """Builds a networkx graph with the same node IDs and attributes as the legacy JSON graphs"""
+        g = nx.Graph()
+        node_keys = self.node_keys()
+
+        for key, lat, lon, date in zip(
+            node_keys, self.lat.tolist(), self.lon.tolist(), self.date.tolist()
+        ):
+            data = {"lat": lat, "lon": lon}
+            date = decode_date(date)
+            if date is not None:
+                data["date"] = date
+            g.add_node(key, **data)
+
+        u, v, distance = self.edges()
+        g.add_edges_from(
+            (node_keys[s], node_keys[t], {"distance": d})
+            for s, t, d in zip(u.tolist(), v.tolist(), distance.tolist())
+        )
+
+        return g
+
+    @cached_property
+    def nx_graph(self) -> nx.Graph:
+        """Lazy networkx view, only built on first access"""
+        return self.to_networkx()
+
+    def subgraph(self, node_mask: NDArray[np.bool_]) -> "GraphStore":
+        """Keeps only the nodes selected by the boolean mask, and the edges between them"""
+        new_index = np.full(self.number_of_nodes(), -1, dtype=np.int64)
+        new_index[node_mask] = np.arange(np.count_nonzero(node_mask))
+
+        # All the directed edges, in CSR order, to keep the order of the neighbours
+        u = np.repeat(np.arange(self.number_of_nodes()), self.degree())
+        v = self.indices.astype(np.int64)
+        distance = self.distance
+        keep = node_mask[u] & node_mask[v]
+
+        return GraphStore.from_edges(
+            self.lat[node_mask],
+            self.lon[node_mask],
+            new_index[u[keep]],
+            new_index[v[keep]],
+            distance[keep],
+            date=self.date[node_mask],
+            keys=None if self.keys is None else self.keys[node_mask],
+        )
+
+    def _arrays(self) -> Dict[str, NDArray]:
+        arrays = {
+            "lat": self.lat,
+            "lon": self.lon,
+            "date": self.date,
+            "indptr": self.indptr,
+            "indices": self.indices,
+            "distance": self.distance,
+        }
+        if self.keys is not None:
+            arrays["keys"] = self.keys
+
+        return arrays
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the graph as: magic | version | header length | JSON header | aligned arrays.
+        The header maps each array name to its dtype, shape and offset in the data section.
+        """
+        header = {"arrays": {}}
+        chunks = []
+        offset = 0
+        for name, array in self._arrays().items():
+            array = np.ascontiguousarray(array)
+            padding = -offset % ARRAY_ALIGNMENT
+            chunks.append(b"\x00" * padding)
+            offset += padding
+            header["arrays"][name] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+            chunks.append(array.tobytes())
+            offset += array.nbytes
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        prefix = GRAPH_MAGIC + struct.pack("<II", GRAPH_VERSION, len(header_bytes))
+        header_bytes += b" " * (-(len(prefix) + len(header_bytes)) % ARRAY_ALIGNMENT)
+
+        return prefix + header_bytes + b"".join(chunks)
+
+    @staticmethod
+    def _read_header(prefix: bytes) -> Tuple[dict, int]:
+        """Parses the file header and returns it with the offset of the data section"""
+        if prefix[: len(GRAPH_MAGIC)] != GRAPH_MAGIC:
+            raise ValueError("Not a graph store file!")
+        start = len(GRAPH_MAGIC)
+        version, header_length = struct.unpack("<II", prefix[start : start + 8])
+        if version != GRAPH_VERSION:
+            raise ValueError(f"Unsupported graph store version {version}!")
+        start += 8
+        header = json.loads(prefix[start : start + header_length])
+        data_offset = start + header_length
+        data_offset += -data_offset % ARRAY_ALIGNMENT
+
+        return header, data_offset
+
+    @classmethod
+    def from_bytes(cls, buffer: bytes) -> "GraphStore":
+        """Deserializes a graph without copying the array data"""
+        header, data_offset = cls._read_header(buffer)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            shape = tuple(spec["shape"])
+            arrays[name] = np.frombuffer(
+                buffer,
+                dtype=dtype,
+                count=int(np.prod(shape)),
+                offset=data_offset + spec["offset"],
+            ).reshape(shape)
+
+        return cls(**arrays)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "GraphStore":
+        """
+        Loads a graph from a local file
+        Args:
+            path: local file path
+            mmap: whether to memory-map the arrays instead of reading them in memory
+
+        Returns:
+            GraphStore instance
+        """
+        if not mmap:
+            with open(path, "rb") as f:
+                return cls.from_bytes(f.read())
+
+        with open(path, "rb") as f:
+            prefix = f.read(len(GRAPH_MAGIC) + 8)
+            header_length = struct.unpack("<I", prefix[-4:])[0]
+            prefix += f.read(header_length)
+        header, data_offset = cls._read_header(prefix)
+
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=np.dtype(spec["dtype"]))
+                continue
+            arrays[name] = np.memmap(
+                path,
+                dtype=np.dtype(spec["dtype"]),
+                mode="r",
+                offset=data_offset + spec["offset"],
+                shape=shape,
+            )
+
+        return cls(**arrays)
@@ -0,0 +1,118 @@
+import io
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import shapely
+from google.cloud.storage import Bucket
+from logger import logger
+from shapely import Polygon
+
+# Columns of the image manifests
+MANIFEST_COLUMNS = [
+    "name",
+    "key",
+    "pano",
+    "lat",
+    "lon",
+    "heading_index",
+    "side_index",
+    "heading",
+    "fov",
+    "date",
+]
+
+
+def heading_bin(heading: float, tolerance: float) -> float:
+    """Heading, in degrees, of the bin of tolerance degrees the heading falls in"""
+    nr_bins = int(round(360 / tolerance))
+
+    return (int(round(heading / tolerance)) % nr_bins) * tolerance
+
+
+def store_key(
+    store_path: str,
+    pano: str,
+    heading: float,
+    fov: int,
+    pitch: int,
+    img_size: List[int],
+) -> str:
+    """
+    Path of an image in the global image store, shared by all the areas: a pano view is only stored once, whatever
+    the node (and the area) it was planned for
+    Args:
+        store_path: root of the image store
+        pano: pano ID
+        heading: heading of the view, binned (see heading_bin)
+        fov: field of view
+        pitch: pitch
+        img_size: image size, as [width, height]
+
+    Returns:
+        <store_path>/<pano>/<heading>_<fov>_<pitch>_<width>x<height>.jpg
+    """
+    return f"{store_path}/{pano}/{heading:g}_{fov}_{pitch}_{img_size[0]}x{img_size[1]}.jpg"
+
+
+def manifest_prefix(data_path: str) -> str:
+    """Folder of the manifest parts of an area"""
+    return f"{data_path}/images_manifest/"
+
+
+def read_manifest(bucket: Bucket, data_path: str) -> pd.DataFrame:
+    """
+    Reads the image manifest of an area, from all its parts (the latest entry of an image name wins)
+    Args:
+        bucket: cloud bucket instance
+        data_path: data path of the area
+
+    Returns:
+        DataFrame with the MANIFEST_COLUMNS, empty if the area has no manifest
+    """
+    parts = [
+        pd.read_parquet(io.BytesIO(blob.download_as_bytes()))
+        for blob in sorted(
+            bucket.list_blobs(prefix=manifest_prefix(data_path)), key=lambda blob: blob.name
+        )
+        if blob.name.endswith(".parquet")
+    ]
+    if not parts:
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+
+    return (
+        pd.concat(parts, ignore_index=True)
+        .drop_duplicates(subset="name", keep="last")
+        .reset_index(drop=True)
+    )
+
+
+def write_manifest(bucket: Bucket, path: str, manifest: pd.DataFrame) -> None:
+    """Uploads a manifest (part) as Parquet"""
+    buffer = io.BytesIO()
+    manifest[MANIFEST_COLUMNS].to_parquet(buffer, index=False)
+    bucket.blob(path).upload_from_string(
+        buffer.getvalue(), content_type="application/vnd.apache.parquet"
+    )
+
+    logger.info(f"Image manifest -- {len(manifest)} images written to {path}")
+
+
+def manifest_view(manifest: pd.DataFrame, polygon: List[List[float]]) -> pd.DataFrame:
+    """Keeps the images of a manifest inside a polygon, given as [lat, lon] pairs"""
+    polygon = Polygon(polygon)
+    shapely.prepare(polygon)
+    inside = shapely.contains_xy(
+        polygon, manifest["lat"].to_numpy(np.float64), manifest["lon"].to_numpy(np.float64)
+    )
+
+    return manifest[inside].reset_index(drop=True)
+
+
+def image_blobs(manifest: pd.DataFrame, images_path: str) -> Dict[str, str]:
+    """Maps the image paths of an area (<images_path>/<name>) to the blobs storing them"""
+    return {
+        f"{images_path}/{name}": key
+        for name, key in zip(manifest["name"].tolist(), manifest["key"].tolist())
+    }
+
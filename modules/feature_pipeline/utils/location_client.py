@@ -0,0 +1,186 @@
+import asyncio
+import random
+import threading
+import time
+import urllib.parse as urlparse
+from typing import Dict, Iterable, Optional
+
+import aiohttp
+import yarl
+from cloud_utils import get_signature
+from config_model import SetupConfig
+from logger import logger
+
+# Street View metadata API
+META_BASE = "https://maps.googleapis.com/maps/api/streetview/metadata"
+
+# Statuses of the metadata API worth retrying (the other ones are final)
+RETRY_STATUSES = ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+
+# Client of the process, shared by all the threads
+_client: Optional["LocationClient"] = None
+_client_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, shared by the event loops of all the threads of the process.
+    Tokens are reserved under a lock, and the caller sleeps (without blocking its loop) until its token is available.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Takes a token, returns the seconds to wait before it can be used"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= 1
+
+            return max(0.0, -self._tokens / self.rate)
+
+    async def acquire(self) -> None:
+        wait_time = self._reserve()
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+
+class LocationClient:
+    """
+    Asynchronous client of the Street View metadata API, used to locate panoramas.
+    Requests go through a single keep-alive session per batch, with at most max_concurrency requests in flight and
+    a process-wide token bucket. Failed requests are retried on their own, with a jittered exponential backoff,
+    without pausing the other requests.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        secret: str,
+        max_concurrency: int = 100,
+        rate_limit: float = 200,
+        max_attempts: int = 5,
+        backoff_initial: float = 1,
+        backoff_max: float = 60,
+        timeout: float = 30,
+        base_url: str = META_BASE,
+    ) -> None:
+        self.api_key = api_key
+        self.secret = secret
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucket(rate_limit)
+        self.max_attempts = max_attempts
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.base_url = base_url
+
+    def _url(self, pano: str) -> yarl.URL:
+        """Signed URL of the metadata request of a pano (kept encoded, as signed)"""
+        url = f"{self.base_url}?" + urlparse.urlencode({"key": self.api_key, "pano": pano})
+        if self.secret:
+            url += "&" + urlparse.urlencode({"signature": get_signature(url, self.secret)})
+
+        return yarl.URL(url, encoded=True)
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter backoff: uniform in [0, min(backoff_max, backoff_initial * 2^attempt)]"""
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_initial * 2**attempt)
+        )
+
+    async def fetch_pano(
+        self,
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        pano: str,
+    ) -> Optional[dict]:
+        """
+        Queries the metadata of a pano, with retries
+        Returns:
+            metadata API response, None if all the attempts failed
+        """
+        url = self._url(pano)
+
+        for attempt in range(self.max_attempts):
+            try:
+                async with semaphore:
+                    await self.rate_limiter.acquire()
+                    async with session.get(url) as response:
+                        response.raise_for_status()
+                        meta_data = await response.json(content_type=None)
+
+                if meta_data.get("status") not in RETRY_STATUSES:
+                    return meta_data
+                error = meta_data.get("status")
+
+            except aiohttp.ClientResponseError as e:
+                # Client errors other than throttling will not get better
+                if e.status < 500 and e.status != 429:
+                    logger.error(f"Location retrieve -- Error for pano {pano}: {e}")
+                    return None
+                error = repr(e)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(self._backoff(attempt))
+
+        logger.error(
+            f"Location retrieve -- Failed for pano {pano} after {self.max_attempts} attempts: {error}"
+        )
+        return None
+
+    async def fetch_panos_async(self, panos: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Queries the metadata of all the panos, concurrently, over a single keep-alive session"""
+        panos = list(panos)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            results = await asyncio.gather(
+                *(self.fetch_pano(session, semaphore, pano) for pano in panos)
+            )
+
+        return dict(zip(panos, results))
+
+    def fetch_panos(self, panos: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """
+        Queries the metadata of all the panos (blocking, callable from any thread)
+        Args:
+            panos: pano IDs
+
+        Returns:
+            dictionary pano ID -> metadata API response (None if it could not be retrieved)
+        """
+        return asyncio.run(self.fetch_panos_async(panos))
+
+
+def get_location_client(cfg: SetupConfig) -> LocationClient:
+    """Returns the location client of the process, so that all the sub-windows share its rate limit"""
+    global _client
+
+    build_cfg = cfg.features.build
+    with _client_lock:
+        if _client is None:
+            _client = LocationClient(
+                cfg.google_token,
+                cfg.google_secret,
+                max_concurrency=build_cfg.max_chunk_retrieve_location,
+                rate_limit=build_cfg.location_rate_limit,
+                max_attempts=build_cfg.location_retry_attempts,
+                backoff_initial=build_cfg.location_backoff_initial,
+                timeout=build_cfg.location_timeout,
+            )
+
+    return _client
@@ -1,22 +1,27 @@
 import concurrent.futures
-import json
 import math
-import os
-import tempfile
-from typing import List, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 import networkx as nx
-import networkx.readwrite.json_graph as json_graph
 import numpy as np
-from cloud_utils import read_json_gcs, upload_json_to_gcs
+from cloud_utils import (
+    graph_exists,
+    list_window_indexes,
+    read_graph_gcs,
+    upload_graph_to_gcs,
+)
 from config_model import SetupConfig
-from general_utils import distance as dist
+from general_utils import date_bounds
 from google.cloud.storage import Bucket
+from graph_store import GRAPH_EXTENSION, GraphStore, in_date_range
 from logger import logger
 from numpy.typing import NDArray
 from shapely import Polygon
 from viz_utils import plot_graph
 
+# Precision (in degrees, about 1 cm) of the coordinates identifying the nodes of graphs without keys, as in OSM
+COORDINATE_QUANTUM = 1e-7
+
 
 def compute_center(coordinates: List[Tuple[float, float]]) -> Tuple[float, float]:
     """
@@ -111,48 +116,101 @@ def get_search_polygon(g: nx.Graph) -> Polygon:
     return Polygon(new_coords)
 
 
-def merge_pair(g1, g2) -> nx.Graph:
-    return nx.compose(g1, g2)
+class GraphMerger:
+    """
+    Merges graphs by streaming their node and edge arrays, instead of composing networkx graphs.
+    Nodes are identified by their key (pano ID) when all the graphs have keys, else by their coordinates quantized
+    to COORDINATE_QUANTUM degrees; as with nx.compose, the last occurrence of a node (or edge) wins.
+    """
 
+    def __init__(self) -> None:
+        self.nr_nodes = 0
+        self._lat: List[NDArray[np.float64]] = []
+        self._lon: List[NDArray[np.float64]] = []
+        self._date: List[NDArray[np.float64]] = []
+        self._keys: List[Optional[NDArray[np.bytes_]]] = []
+        self._u: List[NDArray[np.int64]] = []
+        self._v: List[NDArray[np.int64]] = []
+        self._distance: List[NDArray[np.float64]] = []
+
+    def add(self, g: GraphStore) -> None:
+        """Appends the nodes and edges of a graph (node indexes offset by the nodes already added)"""
+        u, v, distance = g.edges()
+        self._lat.append(np.asarray(g.lat, dtype=np.float64))
+        self._lon.append(np.asarray(g.lon, dtype=np.float64))
+        self._date.append(np.asarray(g.date, dtype=np.float64))
+        self._keys.append(None if g.keys is None else np.asarray(g.keys))
+        self._u.append(u + self.nr_nodes)
+        self._v.append(v + self.nr_nodes)
+        self._distance.append(np.asarray(distance, dtype=np.float64))
+        self.nr_nodes += g.number_of_nodes()
+
+    def merge(self) -> GraphStore:
+        """Builds the merged graph, with duplicate nodes and edges removed"""
+        if not self._lat:
+            raise ValueError("Empty graph list provided to GraphMerger.")
+
+        lat = np.concatenate(self._lat)
+        lon = np.concatenate(self._lon)
+        date = np.concatenate(self._date)
+        use_keys = all(keys is not None for keys in self._keys)
+        keys = np.concatenate(self._keys) if use_keys else None
+        node_ids = keys if use_keys else coordinate_ids(lat, lon)
+
+        # Last occurrence of each node
+        _, last, inverse = np.unique(
+            node_ids[::-1], return_index=True, return_inverse=True
+        )
+        last = len(node_ids) - 1 - last
+        inverse = inverse.reshape(-1)[::-1]
+
+        # Map the edges to the merged nodes; from_edges keeps the first occurrence of an edge, so reverse them
+        u = inverse[np.concatenate(self._u)][::-1]
+        v = inverse[np.concatenate(self._v)][::-1]
+        distance = np.concatenate(self._distance)[::-1]
+
+        return GraphStore.from_edges(
+            lat[last],
+            lon[last],
+            u,
+            v,
+            distance,
+            date=date[last],
+            keys=keys[last] if use_keys else None,
+        )
 
-def parallel_merge(graphs: List[nx.Graph], max_workers: int) -> nx.Graph:
-    """Create pairs of 2 graphs and merge them 2 by 2."""
 
-    if not graphs:
-        raise ValueError("Empty graph list provided to parallel_merge.")
+def coordinate_ids(lat: NDArray[np.float64], lon: NDArray[np.float64]) -> NDArray[np.uint64]:
+    """Packs the coordinates, quantized to COORDINATE_QUANTUM degrees, into single integer IDs"""
+    lat_q = np.round(lat / COORDINATE_QUANTUM).astype(np.int64) + 2**31
+    lon_q = np.round(lon / COORDINATE_QUANTUM).astype(np.int64) + 2**31
 
-    while len(graphs) > 1:
-        pairs = [(graphs[i], graphs[i + 1]) for i in range(0, len(graphs) - 1, 2)]
-        if len(graphs) % 2 == 1:
-            pairs.append((graphs[-1], nx.Graph()))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(merge_pair, g1, g2) for g1, g2 in pairs]
-            graphs = [
-                future.result() for future in concurrent.futures.as_completed(futures)
-            ]
-    return graphs[0]
+    return (lat_q.astype(np.uint64) << np.uint64(32)) | lon_q.astype(np.uint64)
 
 
-def read_and_parse_json_gcs(bucket: Bucket, path: str) -> nx.Graph:
-    """Reads JSON from GCS and parses it into a NetworkX graph."""
-    json_data = read_json_gcs(bucket, path)
-    return json_graph.adjacency_graph(json_data)
+def merge_graph_stores(graphs: Iterable[GraphStore]) -> GraphStore:
+    """Merges graphs (see GraphMerger)"""
+    merger = GraphMerger()
+    for g in graphs:
+        merger.add(g)
 
+    return merger.merge()
 
-def save_intermediate_graph(graph: nx.Graph, directory: str, index: int) -> str:
-    """Saves an intermediate graph to a temporary file and returns the file path."""
-    path = os.path.join(directory, f"intermediate_graph_{index}.json")
-    json_data = json_graph.adjacency_data(graph)
-    with open(path, "w") as f:
-        json.dump(json_data, f)
-    return path
 
+def read_window_graph(
+    bucket: Bucket,
+    path: str,
+    date_range: Tuple[Optional[str], Optional[str]] = (None, None),
+) -> GraphStore:
+    """
+    Reads a sub-window graph from GCS, keeping only the nodes dated within date_range ('YYYY-MM' first and last
+    months, None for unbounded)
+    """
+    g = read_graph_gcs(bucket, path)
+    if date_range != (None, None):
+        g = g.subgraph(in_date_range(g.date, *date_range))
 
-def load_intermediate_graph(path: str) -> nx.Graph:
-    """Loads an intermediate graph from a file."""
-    with open(path, "r") as f:
-        json_data = json.load(f)
-    return json_graph.adjacency_graph(json_data)
+    return g
 
 
 def merge_graphs_parallel(
@@ -161,62 +219,48 @@ def merge_graphs_parallel(
     max_workers: int,
     type_name: str,
     batch_size: int = 100,
-) -> nx.Graph:
+    date_range: Tuple[Optional[str], Optional[str]] = (None, None),
+) -> GraphStore:
     """
-    Function for merging multiple graphs defined in the 'window_graph_filenames' list
+    Function for merging multiple graphs defined in the 'window_graph_filenames' list. The graphs are read in
+    parallel, and streamed in order into a GraphMerger
     Args:
         bucket: GCS bucket
         window_graph_filenames: list of paths of graphs for one or more sub-windows
         max_workers: number of threads
         type_name: 'OSM' or 'SV'
-        batch_size: Number of graphs to process in each batch
+        batch_size: Number of graphs read concurrently, at most
+        date_range: first and last months ('YYYY-MM') of the nodes to keep, None for unbounded
 
     Returns:
-        merged networkx graph
+        merged graph
     """
 
     logger.info(f"Merge -- computing {type_name} graphs")
 
-    # Temporary directory for intermediate graphs
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        intermediate_paths = []
+    merger = GraphMerger()
+
+    # Use ThreadPoolExecutor for I/O bound operations
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
 
         # Process in batches
         for i in range(0, len(window_graph_filenames), batch_size):
             batch_filenames = window_graph_filenames[i : i + batch_size]
-            graphs = []
-
-            # Use ThreadPoolExecutor for I/O bound operations
-            with concurrent.futures.ThreadPoolExecutor(
-                max_workers=max_workers
-            ) as executor:
-                future_to_fname = {
-                    executor.submit(read_and_parse_json_gcs, bucket, fname): fname
-                    for fname in batch_filenames
-                }
-                for future in concurrent.futures.as_completed(future_to_fname):
-                    fname = future_to_fname[future]
-                    try:
-                        graph = future.result()
-                        graphs.append(graph)
-                    except Exception as e:
-                        logger.error(f"Error reading {fname}: {e}")
-
-            # Merge graphs in the batch using threads
-            batch_merged_graph = parallel_merge(graphs, max_workers)
-
-            # Save the intermediate merged graph
-            intermediate_path = save_intermediate_graph(
-                batch_merged_graph, tmpdirname, len(intermediate_paths)
-            )
-            intermediate_paths.append(intermediate_path)
-            logger.info(f"Merge -- Step {i}/{len(window_graph_filenames)} ")
+            futures = [
+                executor.submit(read_window_graph, bucket, fname, date_range)
+                for fname in batch_filenames
+            ]
 
-        # Load and merge all intermediate graphs
-        final_graphs = [load_intermediate_graph(path) for path in intermediate_paths]
-        merged_graph = parallel_merge(final_graphs, max_workers)
+            # Add the graphs in the order of the filenames
+            for fname, future in zip(batch_filenames, futures):
+                try:
+                    merger.add(future.result())
+                except Exception as e:
+                    logger.error(f"Error reading {fname}: {e}")
+
+            logger.info(f"Merge -- Step {i}/{len(window_graph_filenames)} ")
 
-    return merged_graph
+    return merger.merge()
 
 
 def merge_sub_windows(
@@ -233,69 +277,65 @@ def merge_sub_windows(
     # Retrieve merge configuration
     build_cfg = cfg.features.build
 
-    merged_sv_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.json"
-    merged_sv_map_exists = bucket.blob(merged_sv_path).exists()
+    merged_sv_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph"
+    merged_sv_map_exists = graph_exists(bucket, merged_sv_path)
 
     # If the SV merged map does not exist
     if (not merged_sv_map_exists) or cfg.force_compute_graph:
 
-        # Get all available SV map filenames
+        # Get all available SV map filenames (listed once)
+        existing = list_window_indexes(
+            bucket, cfg.area.output_path, cfg.sv_name, GRAPH_EXTENSION
+        )
         sub_window_sv_filenames = []
         for i, window in enumerate(windows):
-            window_path = f"{cfg.area.output_path}/{cfg.sv_name}_{i}.json"
-            sv_map_exists = bucket.blob(window_path).exists()
+            window_path = f"{cfg.area.output_path}/{cfg.sv_name}_{i}.graph"
 
-            if sv_map_exists:
+            if i in existing:
                 sub_window_sv_filenames.append(window_path)
             else:
                 logger.info(f"Merge -- {window_path} was not created or has 0 points!")
 
-        # Merge SV graph
+        # Merge SV graph (sub-window graphs computed before a change of the date range are filtered too)
         result_graph = merge_graphs_parallel(
-            bucket, sub_window_sv_filenames, build_cfg.max_workers_merge, "SV"
+            bucket,
+            sub_window_sv_filenames,
+            build_cfg.max_workers_merge,
+            "SV",
+            date_range=date_bounds(build_cfg.date_range),
         )
 
-        # Compute edge length and store where needed
-        for u, v in result_graph.edges():
-            # Get the coordinates of the two nodes
-            lat1, lon1 = result_graph.nodes[u]["lat"], result_graph.nodes[u]["lon"]
-            lat2, lon2 = result_graph.nodes[v]["lat"], result_graph.nodes[v]["lon"]
-
-            if not result_graph.edges[u, v].get("distance", None):
-                # Calculate the Haversine distance
-                distance = dist(lat1, lon1, lat2, lon2)
-                # Add the distance as an edge attribute
-                result_graph.edges[u, v]["distance"] = distance
-
         # Define output path
-        out_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.json"
+        out_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph"
 
-        # Export to json and upload to cloud
-        json_data = json_graph.adjacency_data(result_graph)
-        upload_json_to_gcs(bucket, out_path, json_data)
+        # Compute edge length where needed and upload to cloud
+        result_graph.compute_distances(only_missing=True)
+        upload_graph_to_gcs(bucket, out_path, result_graph)
 
         # Visualize results
         if build_cfg.viz and result_graph.number_of_nodes() > 0:
             output_map_sv_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.html"
             plot_graph(
-                result_graph, cfg.mapbox_token, output_map_sv_path, "blue", bucket
+                result_graph.nx_graph, cfg.mapbox_token, output_map_sv_path, "blue", bucket
             )
     else:
         logger.info(f"Merged SV map already exists!")
 
-    merged_osm_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.json"
-    merged_osm_map_exists = bucket.blob(merged_osm_path).exists()
+    merged_osm_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.graph"
+    merged_osm_map_exists = graph_exists(bucket, merged_osm_path)
 
     # If the SV merged map does not exist
     if (not merged_osm_map_exists) or cfg.force_compute_graph:
 
-        # Get all available OSM map filenames
+        # Get all available OSM map filenames (listed once)
+        existing = list_window_indexes(
+            bucket, cfg.area.output_path, cfg.osm_name, GRAPH_EXTENSION
+        )
         sub_window_osm_filenames = []
         for i, window in enumerate(windows):
-            window_path = f"{cfg.area.output_path}/{cfg.osm_name}_{i}.json"
+            window_path = f"{cfg.area.output_path}/{cfg.osm_name}_{i}.graph"
 
-            osm_map_exists = bucket.blob(window_path).exists()
-            if osm_map_exists:
+            if i in existing:
                 sub_window_osm_filenames.append(window_path)
             else:
                 logger.info(f"Merge -- {window_path} was not created!")
@@ -304,30 +344,18 @@ def merge_sub_windows(
         result_graph = merge_graphs_parallel(
             bucket, sub_window_osm_filenames, build_cfg.max_workers_merge, "OSM"
         )
-        # Compute edge length and store where needed
-        for u, v in result_graph.edges():
-            # Get the coordinates of the two nodes
-            lat1, lon1 = result_graph.nodes[u]["lat"], result_graph.nodes[u]["lon"]
-            lat2, lon2 = result_graph.nodes[v]["lat"], result_graph.nodes[v]["lon"]
-
-            if not result_graph.edges[u, v].get("distance", None):
-                # Calculate the Haversine distance
-                distance = dist(lat1, lon1, lat2, lon2)
-                # Add the distance as an edge attribute
-                result_graph.edges[u, v]["distance"] = distance
-
         # Define output path
-        out_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.json"
+        out_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.graph"
 
-        # Export to json and upload to Cloud
-        json_data = json_graph.adjacency_data(result_graph)
-        upload_json_to_gcs(bucket, out_path, json_data)
+        # Compute edge length where needed and upload to cloud
+        result_graph.compute_distances(only_missing=True)
+        upload_graph_to_gcs(bucket, out_path, result_graph)
 
         # Visualize results
         if build_cfg.viz and result_graph.number_of_nodes() > 0:
             output_map_osm_path = f"{cfg.area.data_path}/{cfg.osm_name}_merged.html"
             plot_graph(
-                result_graph, cfg.mapbox_token, output_map_osm_path, "blue", bucket
+                result_graph.nx_graph, cfg.mapbox_token, output_map_osm_path, "blue", bucket
             )
     else:
         logger.info(f"Merged OSM map already exists!")
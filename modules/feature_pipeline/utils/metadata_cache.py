@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from config_model import SetupConfig
+from google.cloud.storage import Bucket
+from logger import logger
+
+# Statuses of the Street View metadata API that are final, thus cached (errors and quota statuses are not)
+CACHED_STATUSES = ("OK", "ZERO_RESULTS", "NOT_FOUND")
+
+# Number of writes after which the cache is committed
+COMMIT_EVERY = 500
+
+# Cache of the process, shared by all the threads
+_cache: Optional["MetadataCache"] = None
+_cache_lock = threading.Lock()
+
+
+class MetadataCache:
+    """
+    SQLite key-value cache of the Street View metadata responses (pano, location, date), shared by all the areas.
+    Entries are keyed by pano ID or by requested location, and expire after ttl_days. The cache is thread safe,
+    and synced with a copy on GCS, so that batch jobs reuse the metadata queried by the previous ones.
+    """
+
+    def __init__(self, local_path: str, ttl_days: float) -> None:
+        self.local_path = local_path
+        self.ttl = ttl_days * 24 * 3600
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+
+        self._conn = sqlite3.connect(local_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                pano TEXT,
+                lat REAL,
+                lon REAL,
+                date TEXT,
+                fetched_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def pano_key(pano: str) -> str:
+        return f"pano:{pano}"
+
+    @staticmethod
+    def location_key(lat: float, lon: float) -> str:
+        return f"location:{lat},{lon}"
+
+    def get(self, key: str) -> Optional[dict]:
+        """Returns the cached metadata (status, pano, lat, lon, date) of the key, None if missing or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, pano, lat, lon, date, fetched_at FROM metadata WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+        if row is None or time.time() - row[5] > self.ttl:
+            return None
+
+        return dict(zip(("status", "pano", "lat", "lon", "date"), row[:5]))
+
+    def put(self, key: str, meta_data: dict) -> None:
+        """Caches a response of the Street View metadata API, if its status is final"""
+        status = meta_data.get("status")
+        if status not in CACHED_STATUSES:
+            return
+
+        location = meta_data.get("location", {})
+        row = (
+            key,
+            status,
+            meta_data.get("pano_id"),
+            location.get("lat"),
+            location.get("lng"),
+            meta_data.get("date"),
+            time.time(),
+        )
+
+        # A found pano also gives the metadata of its ID and of its exact location
+        keys = {key}
+        if status == "OK":
+            keys.add(self.pano_key(row[2]))
+            keys.add(self.location_key(row[3], row[4]))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(cur_key,) + row[1:] for cur_key in sorted(keys)],
+            )
+
+            self._pending_writes += 1
+            if self._pending_writes >= COMMIT_EVERY:
+                self._conn.commit()
+                self._pending_writes = 0
+
+    def sync(self, bucket: Bucket, blob_path: str) -> None:
+        """
+        Merges the GCS copy of the cache into the local one (keeping the most recent entries), drops the expired
+        entries and uploads the result back
+        Args:
+            bucket: cloud bucket instance
+            blob_path: path of the cache in the bucket
+        """
+        blob = bucket.blob(blob_path)
+
+        with self._lock, tempfile.TemporaryDirectory() as tmp_dir:
+            self._conn.commit()
+            self._pending_writes = 0
+
+            # Merge the entries written by other jobs meanwhile
+            remote_path = os.path.join(tmp_dir, "remote.sqlite")
+            if blob.exists():
+                blob.download_to_filename(remote_path)
+                self._conn.execute("ATTACH DATABASE ? AS remote", (remote_path,))
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO metadata
+                    SELECT r.* FROM remote.metadata r
+                    LEFT JOIN metadata m ON m.key = r.key
+                    WHERE m.key IS NULL OR r.fetched_at > m.fetched_at
+                    """
+                )
+                self._conn.commit()
+                self._conn.execute("DETACH DATABASE remote")
+
+            self._conn.execute(
+                "DELETE FROM metadata WHERE fetched_at < ?", (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+
+            # Upload a consistent snapshot of the cache
+            snapshot_path = os.path.join(tmp_dir, "snapshot.sqlite")
+            snapshot = sqlite3.connect(snapshot_path)
+            self._conn.backup(snapshot)
+            snapshot.close()
+            blob.upload_from_filename(
+                snapshot_path, content_type="application/vnd.sqlite3"
+            )
+
+            nr_entries = self._conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+        logger.info(f"Metadata cache -- synced {nr_entries} entries to {blob_path}")
+
+
+def get_metadata_cache(cfg: SetupConfig, bucket: Bucket) -> Optional[MetadataCache]:
+    """
+    Returns the metadata cache of the process, initialized from its GCS copy on first use
+    Args:
+        cfg: configuration object
+        bucket: cloud bucket instance
+
+    Returns:
+        the cache, None if disabled by metadata_cache
+    """
+    global _cache
+
+    if not cfg.metadata_cache:
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            local_path = os.path.join(tempfile.gettempdir(), "sv_metadata.sqlite")
+            if not os.path.exists(local_path):
+                blob = bucket.blob(cfg.metadata_cache_path)
+                if blob.exists():
+                    blob.download_to_filename(local_path)
+            _cache = MetadataCache(local_path, cfg.metadata_cache_ttl_days)
+
+    return _cache
+
+
+def sync_metadata_cache(cfg: SetupConfig, bucket: Bucket) -> None:
+    """Syncs the metadata cache of the process with its GCS copy, if it was used"""
+    if _cache is not None:
+        _cache.sync(bucket, cfg.metadata_cache_path)
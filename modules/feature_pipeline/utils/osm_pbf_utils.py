@@ -0,0 +1,209 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from build_utils import save_osm_window_graph
+from cloud_utils import download_to_local, get_bucket, list_window_indexes
+from config_model import SetupConfig
+from general_utils import get_window_indexes
+from google.cloud.storage import Bucket
+from graph_store import GRAPH_EXTENSION
+from logger import logger
+from logging_utils import format_logging
+from numpy.typing import NDArray
+from osm_utils import configuration as config
+from osm_utils.graph import convert_graph
+from osm_utils.osm import read_osm
+from osm_utils.osm.osm_types import OSMNode, OSMWay
+from osm_utils.utils.converter import build_roadgraph
+
+# Bucket of the worker processes, created once per process
+worker_bucket: Optional[Bucket] = None
+
+
+def get_pbf_extract(cfg: SetupConfig, bucket: Bucket) -> str:
+    """
+    Resolves the local path of the OSM extract given in the build config
+    Args:
+        cfg: configuration object
+        bucket: cloud bucket instance
+
+    Returns:
+        Local path of the .osm.pbf extract, downloaded first if it is stored on GCS
+    """
+
+    pbf_path = cfg.features.build.osm_pbf_path
+    if pbf_path is None:
+        raise ValueError("build.osm_pbf_path must be set when build.osm_source is pbf!")
+
+    # gs://<bucket>/<path>
+    if pbf_path.startswith("gs://"):
+        bucket_name, source_file = pbf_path[len("gs://") :].split("/", 1)
+        pbf_bucket = get_bucket(bucket_name, cfg.project_id)
+        return download_to_local(pbf_bucket, source_file, "osm_pbf", overwrite=False)
+
+    # Local file, else a path in the pipeline bucket
+    if os.path.exists(pbf_path):
+        return pbf_path
+
+    return download_to_local(bucket, pbf_path, "osm_pbf", overwrite=False)
+
+
+def index_ways(
+    nodes: Dict[int, OSMNode], ways: List[OSMWay]
+) -> Tuple[shapely.STRtree, List[OSMWay]]:
+    """
+    Builds a spatial index over the bounding boxes of the ways
+    Args:
+        nodes: OSM nodes, by ID
+        ways: accepted OSM ways
+
+    Returns:
+        (STRtree of the ways bounding boxes, ways indexed by the tree)
+    """
+
+    indexed_ways, bounds = [], []
+    for way in ways:
+        way_nodes = [nodes[node_id] for node_id in way.nodes if node_id in nodes]
+        if not way_nodes:
+            continue
+        lats = [node.lat for node in way_nodes]
+        lons = [node.lon for node in way_nodes]
+        indexed_ways.append(way)
+        bounds.append((min(lons), min(lats), max(lons), max(lats)))
+
+    bounds = np.array(bounds, dtype=np.float64).reshape(-1, 4)
+    boxes = shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3])
+
+    return shapely.STRtree(boxes), indexed_ways
+
+
+def init_worker(cfg: SetupConfig) -> None:
+    """Creates the bucket instance of a worker process"""
+    global worker_bucket
+    worker_bucket = get_bucket(cfg.bucket_name, cfg.project_id)
+
+
+def osm_pbf_to_graph_run(
+    cfg: SetupConfig,
+    window_index: int,
+    window: NDArray[np.float64],
+    nodes: Dict[int, OSMNode],
+    ways: List[OSMWay],
+) -> int:
+    """Builds and saves the OSM graph of a sub-window, from the extract ways intersecting it"""
+
+    build_cfg = cfg.features.build
+
+    graph = build_roadgraph(
+        nodes,
+        ways,
+        build_cfg.unconnected_components,
+        build_cfg.enrich,
+        build_cfg.distance_between_points,
+    )
+    g = convert_graph.convert_to_networkx(graph)
+
+    # Clip, label and save the window graph, as for the Overpass source
+    save_osm_window_graph(cfg, worker_bucket, g, window, window_index)
+
+    return window_index
+
+
+def osm_pbf_to_graph(
+    cfg: SetupConfig,
+    windows: NDArray[np.float64],
+    bucket: Bucket,
+    window_indexes: Optional[List[int]] = None,
+) -> None:
+    """
+    Converts a local or GCS OSM extract (.osm.pbf) to a graph of points for each sub-window.
+    The extract is read once, and its ways are clipped to all the sub-windows in a single query.
+    Args:
+        cfg: configuration object
+        windows: np.ndarray[nr_sub_windows, 4]
+        bucket: cloud bucket instance
+        window_indexes: indexes of the sub-windows to process (all of them by default)
+    """
+
+    build_cfg = cfg.features.build
+
+    # Skip the sub-windows already converted
+    existing = list_window_indexes(
+        bucket, cfg.area.output_path, cfg.osm_name, GRAPH_EXTENSION
+    )
+    todo_windows = []
+    for window_index in get_window_indexes(windows, window_indexes):
+        if window_index in existing:
+            log_text = format_logging(
+                stage="OSM to graph",
+                progress=f"{window_index}/{len(windows) - 1}",
+                exists=True,
+            )
+            logger.info(log_text)
+        else:
+            todo_windows.append(window_index)
+
+    if not todo_windows:
+        return
+
+    # Read the ways of the extract overlapping the sub-windows
+    pbf_path = get_pbf_extract(cfg, bucket)
+    cur_windows = windows[todo_windows]
+    area_bbox = (
+        cur_windows[:, 0].min(),
+        cur_windows[:, 1].max(),
+        cur_windows[:, 2].min(),
+        cur_windows[:, 3].max(),
+    )
+    configuration = config.Configuration(build_cfg.network_type)
+    nodes, ways = read_osm.read_file(pbf_path, configuration, bbox=area_bbox)
+    logger.info(f"Read {len(ways)} ways and {len(nodes)} nodes from {pbf_path}")
+
+    # Match all sub-windows (min_lon, max_lon, min_lat, max_lat) with the ways they intersect
+    tree, indexed_ways = index_ways(nodes, ways)
+    window_boxes = shapely.box(
+        cur_windows[:, 0], cur_windows[:, 2], cur_windows[:, 1], cur_windows[:, 3]
+    )
+    box_indexes, way_indexes = tree.query(window_boxes, predicate="intersects")
+    order = np.argsort(box_indexes, kind="stable")
+    box_indexes, way_indexes = box_indexes[order], way_indexes[order]
+    splits = np.searchsorted(box_indexes, np.arange(1, len(todo_windows)))
+    windows_ways = np.split(way_indexes, splits)
+
+    # Build the sub-windows graphs in parallel
+    with ProcessPoolExecutor(
+        max_workers=build_cfg.max_workers_osm_pbf,
+        initializer=init_worker,
+        initargs=(cfg,),
+    ) as executor:
+        futures = []
+        for window_index, cur_way_indexes in zip(todo_windows, windows_ways):
+            cur_ways = [indexed_ways[i] for i in cur_way_indexes.tolist()]
+            cur_nodes = {
+                node_id: nodes[node_id]
+                for way in cur_ways
+                for node_id in way.nodes
+                if node_id in nodes
+            }
+            futures.append(
+                executor.submit(
+                    osm_pbf_to_graph_run,
+                    cfg,
+                    window_index,
+                    windows[window_index],
+                    cur_nodes,
+                    cur_ways,
+                )
+            )
+
+        for future in as_completed(futures):
+            window_index = future.result()
+            log_text = format_logging(
+                stage="OSM to graph",
+                progress=f"{window_index}/{len(windows) - 1}",
+                exists=False,
+            )
+            logger.info(log_text)
@@ -0,0 +1,88 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from geo_utils import EARTH_RADIUS, to_enu
+from numpy.typing import NDArray
+from scipy.spatial import cKDTree
+
+# Size, in degrees, of the grid cells indexing the pano locations
+CELL_SIZE = 0.01
+
+
+class PanoRegistry:
+    """
+    Registry of the panoramas located during an area build, shared by the sub-window threads.
+    Overlapping sub-windows use it to skip the points already covered by a known panorama, and the panoramas
+    already located by another sub-window.
+    """
+
+    def __init__(self) -> None:
+        self._panos: Dict[str, Tuple[float, float, Optional[str]]] = {}
+        self._cells: Dict[Tuple[int, int], List[Tuple[float, float]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._panos)
+
+    def get(self, pano: str) -> Optional[Tuple[float, float, Optional[str]]]:
+        """Returns the (lat, lon, date) of a known pano, None if unknown"""
+        with self._lock:
+            return self._panos.get(pano)
+
+    def add(self, panos: Iterable[Tuple[str, float, float, Optional[str]]]) -> None:
+        """Registers located panos, given as (pano ID, lat, lon, date)"""
+        with self._lock:
+            for pano, lat, lon, date in panos:
+                if pano not in self._panos:
+                    cell = (int(np.floor(lat / CELL_SIZE)), int(np.floor(lon / CELL_SIZE)))
+                    self._cells.setdefault(cell, []).append((lat, lon))
+                self._panos[pano] = (lat, lon, date)
+
+    def covered(
+        self, lat: NDArray[np.float64], lon: NDArray[np.float64], radius: float
+    ) -> NDArray[np.bool_]:
+        """
+        Finds the points having a known pano within radius meters
+        Args:
+            lat: latitudes of the points
+            lon: longitudes of the points
+            radius: coverage radius, in meters
+
+        Returns:
+            np.ndarray[nr_points] mask of the covered points
+        """
+        covered = np.zeros(len(lat), dtype=bool)
+        if len(lat) == 0:
+            return covered
+
+        # Only the panos of the grid cells around the points
+        lat_margin = np.degrees(radius / EARTH_RADIUS)
+        lon_margin = lat_margin / np.cos(np.radians(np.abs(lat).max()))
+        lat_cells = range(
+            int(np.floor((lat.min() - lat_margin) / CELL_SIZE)),
+            int(np.floor((lat.max() + lat_margin) / CELL_SIZE)) + 1,
+        )
+        lon_cells = range(
+            int(np.floor((lon.min() - lon_margin) / CELL_SIZE)),
+            int(np.floor((lon.max() + lon_margin) / CELL_SIZE)) + 1,
+        )
+        with self._lock:
+            locations = [
+                location
+                for lat_cell in lat_cells
+                for lon_cell in lon_cells
+                for location in self._cells.get((lat_cell, lon_cell), [])
+            ]
+        locations = np.array(locations, dtype=np.float64).reshape(-1, 2)
+        if len(locations) == 0:
+            return covered
+
+        lat0, lon0 = float(lat.mean()), float(lon.mean())
+        pano_x, pano_y = to_enu(locations[:, 0], locations[:, 1], lat0, lon0)
+        x, y = to_enu(lat, lon, lat0, lon0)
+        distances, _ = cKDTree(np.stack([pano_x, pano_y], axis=1)).query(
+            np.stack([x, y], axis=1), distance_upper_bound=radius
+        )
+
+        return distances <= radius
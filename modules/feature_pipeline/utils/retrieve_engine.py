@@ -0,0 +1,444 @@
+import mimetypes
+import queue
+import random
+import threading
+import time
+import urllib.parse as urlparse
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import requests
+from cloud_utils import get_names_gcs, get_signature
+from config_model import SetupConfig
+from google.cloud.storage import Bucket
+from image_store import heading_bin, store_key
+from logger import logger
+from metadata_cache import MetadataCache
+
+# Street View APIs
+META_BASE = "https://maps.googleapis.com/maps/api/streetview/metadata"
+PIC_BASE = "https://maps.googleapis.com/maps/api/streetview"
+
+# Statuses of the metadata API that are final for a location
+FINAL_STATUSES = ("ZERO_RESULTS", "NOT_FOUND")
+
+
+def image_match_key(path: str) -> str:
+    """
+    Key matching an area image (<lat>_<lon>_<heading_index>_<side_index>_<heading>_<fov>_<date>.jpg) whatever its
+    heading_index: the index of an edge among the edges of its node depends on the order of the neighbours, which
+    changed with the graph format, so images retrieved before are matched on their other fields
+    """
+    folder, _, name = path.rpartition("/")
+    parts = name.split("_")
+    if len(parts) != 7:
+        return path
+
+    return f"{folder}/{'_'.join(parts[:2] + parts[3:])}"
+
+
+@dataclass
+class ImageTask:
+    """Image to retrieve, filled by the stages of the engine"""
+
+    lat: float
+    lon: float
+    heading: float
+    side_index: int
+    heading_index: int
+    pano: Optional[str] = None
+    date: Optional[str] = None
+    image_path: Optional[str] = None
+    content: Optional[bytes] = None
+
+
+@dataclass
+class PointTask:
+    """Retrieval point (graph node), whose metadata is resolved once for all its images"""
+
+    lat: float
+    lon: float
+    images: List[ImageTask]
+
+
+class QuotaError(Exception):
+    """The API refused a request because of the quota (HTTP 429, OVER_QUERY_LIMIT)"""
+
+
+class CircuitBreaker:
+    """
+    Stops all the stages for a cooldown when the API quota is hit, instead of hammering it.
+    The cooldown doubles on consecutive trips (up to 16 times), and is reset by a successful request.
+    """
+
+    def __init__(self, cooldown: float) -> None:
+        self.cooldown = cooldown
+        self._open_until = 0.0
+        self._trips = 0
+        self._lock = threading.Lock()
+
+    def trip(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                return
+            cooldown = self.cooldown * 2 ** min(self._trips, 4)
+            self._open_until = now + cooldown
+            self._trips += 1
+        logger.warning(f"Retrieve -- quota hit, pausing requests for {cooldown:.0f}s")
+
+    def success(self) -> None:
+        self._trips = 0
+
+    def wait(self) -> None:
+        """Blocks while the breaker is open"""
+        while True:
+            remaining = self._open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+
+class StageMetrics:
+    """Thread safe counters of the engine stages, reported periodically"""
+
+    def __init__(self, stages: List[str]) -> None:
+        self.counts: Dict[str, Dict[str, int]] = {
+            stage: {"done": 0, "skipped": 0, "failed": 0} for stage in stages
+        }
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def add(self, stage: str, outcome: str) -> None:
+        with self._lock:
+            self.counts[stage][outcome] += 1
+
+    def report(self, queues: Dict[str, queue.Queue]) -> str:
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        with self._lock:
+            parts = [
+                f"{stage}: {counts['done']} done ({counts['done'] / elapsed:.1f}/s), "
+                f"{counts['skipped']} skipped, {counts['failed']} failed, {queues[stage].qsize()} queued"
+                for stage, counts in self.counts.items()
+            ]
+
+        return " | ".join(parts)
+
+
+class RetrieveEngine:
+    """
+    Pipelined Street View image retrieval. Retrieval points go through three stages, each with its own pool of
+    threads and a bounded input queue: metadata (pano and date, from the cache first, once per point), then download
+    and upload to GCS of each image of the point. Images of a pano already claimed by another point with the same
+    heading (within heading_tolerance degrees) are not retrieved twice. With the image store, images are stored once
+    per pano view for all the areas, and the ones already stored are not retrieved again.
+    Every image available for the points is recorded in manifest_rows, with the blob storing it.
+    Each stage retries its failed tasks on its own, with a jittered backoff; quota errors open a circuit breaker
+    pausing the requests of all the stages.
+    """
+
+    STAGES = ("metadata", "download", "upload")
+
+    def __init__(
+        self,
+        cfg: SetupConfig,
+        bucket: Bucket,
+        existing_images: Set[str],
+        metadata_cache: Optional[MetadataCache] = None,
+    ) -> None:
+        retrieve_cfg = cfg.features.retrieve
+
+        self.cfg = cfg
+        self.bucket = bucket
+        self.existing_images = existing_images
+        self.existing_by_key = {image_match_key(path): path for path in sorted(existing_images)}
+        self.metadata_cache = metadata_cache
+
+        self.workers = {
+            "metadata": retrieve_cfg.metadata_workers,
+            "download": retrieve_cfg.max_chunk_size,
+            "upload": retrieve_cfg.upload_workers,
+        }
+        self.max_attempts = retrieve_cfg.max_attempts
+        self.heading_tolerance = retrieve_cfg.pano_heading_tolerance
+        self.image_store = cfg.image_store
+        self.metrics_interval = retrieve_cfg.metrics_interval
+
+        self.breaker = CircuitBreaker(retrieve_cfg.quota_cooldown)
+        self.metrics = StageMetrics(list(self.STAGES))
+        self.queues = {
+            stage: queue.Queue(maxsize=retrieve_cfg.queue_size) for stage in self.STAGES
+        }
+        self._local = threading.local()
+
+        # (pano, heading bin) of the images already planned for download
+        self._claimed: Set[Tuple[str, float]] = set()
+        self._claimed_lock = threading.Lock()
+
+        # Blobs of the image store, listed once per pano
+        self._stored: Dict[str, Set[str]] = {}
+        self._stored_lock = threading.Lock()
+
+        # Paths of the images uploaded by the engine, blobs available (stored or uploaded), and manifest entries
+        self.uploaded: List[str] = []
+        self.available: Set[str] = set(existing_images)
+        self.manifest_rows: List[dict] = []
+
+    @property
+    def session(self) -> requests.Session:
+        """Keep-alive HTTP session of the current thread"""
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _signed_params(self, base_url: str, params: Dict[str, str]) -> Dict[str, str]:
+        input_url = f"{base_url}?" + urlparse.urlencode(params)
+        return {**params, "signature": get_signature(input_url, self.cfg.google_secret)}
+
+    def _claim(self, task: ImageTask) -> bool:
+        """Claims the (pano, heading) of an image, returns False if another point already did"""
+        key = (task.pano, heading_bin(task.heading, self.heading_tolerance))
+        with self._claimed_lock:
+            if key in self._claimed:
+                return False
+            self._claimed.add(key)
+
+        return True
+
+    def _stored_blobs(self, pano: str) -> Set[str]:
+        """Blobs of a pano in the image store, listed on first use"""
+        with self._stored_lock:
+            blobs = self._stored.get(pano)
+        if blobs is None:
+            blobs = set(get_names_gcs(self.bucket, f"{self.cfg.image_store_path}/{pano}/"))
+            with self._stored_lock:
+                self._stored[pano] = blobs
+                self.available.update(blobs)
+
+        return blobs
+
+    def fetch_metadata(self, point: PointTask) -> Optional[List[ImageTask]]:
+        """
+        Resolves the pano and date of a point, with a single metadata request for all its images
+        Returns:
+            images of the point to download (not stored yet nor claimed by another point), None if there is no pano
+        """
+        location_key = MetadataCache.location_key(point.lat, point.lon)
+        meta_data = None
+        if self.metadata_cache is not None:
+            meta_data = self.metadata_cache.get(location_key)
+
+        # Only final statuses are cached: a cached ZERO_RESULTS / NOT_FOUND is not queried again
+        if meta_data is None:
+            params = {"key": self.cfg.google_token, "location": f"{point.lat}, {point.lon}"}
+            response = self.session.get(
+                META_BASE, params=self._signed_params(META_BASE, params), timeout=30
+            )
+            if response.status_code == 429:
+                raise QuotaError(f"HTTP 429 for metadata at {point.lat}, {point.lon}")
+            response.raise_for_status()
+
+            meta_data = response.json()
+            if meta_data["status"] == "OVER_QUERY_LIMIT":
+                raise QuotaError(f"OVER_QUERY_LIMIT for metadata at {point.lat}, {point.lon}")
+            if self.metadata_cache is not None:
+                self.metadata_cache.put(location_key, meta_data)
+
+        if meta_data["status"] in FINAL_STATUSES:
+            logger.warning(
+                f"Retrieve {self.cfg.area.name} -- no image at {point.lat}, {point.lon} ({meta_data['status']})"
+            )
+            self.metrics.add("metadata", "skipped")
+            return None
+        if meta_data["status"] != "OK":
+            raise RuntimeError(f"Metadata status {meta_data['status']}")
+
+        # Cached entries store the pano ID as pano, API responses as pano_id
+        pano = meta_data.get("pano_id", meta_data.get("pano"))
+        retrieve_cfg = self.cfg.features.retrieve
+        stored_blobs = self._stored_blobs(pano) if self.image_store else set()
+
+        images, rows = [], []
+        for task in point.images:
+            task.pano = pano
+            task.date = meta_data["date"]
+            img_name = (
+                f"{task.lat}_{task.lon}_{task.heading_index}_{task.side_index}_{task.heading}_"
+                f"{retrieve_cfg.fov}_{task.date}.jpg"
+            )
+
+            # Images of the area retrieved before the image store stay where they are (matched without their
+            # heading_index, see image_match_key)
+            task.image_path = f"{self.cfg.area.images_path}/{img_name}"
+            task.image_path = self.existing_by_key.get(image_match_key(task.image_path), task.image_path)
+            if self.image_store and task.image_path not in self.existing_images:
+                task.image_path = store_key(
+                    self.cfg.image_store_path,
+                    pano,
+                    heading_bin(task.heading, self.heading_tolerance),
+                    retrieve_cfg.fov,
+                    retrieve_cfg.pitch,
+                    retrieve_cfg.img_size,
+                )
+            rows.append(
+                {
+                    "name": img_name,
+                    "key": task.image_path,
+                    "pano": pano,
+                    "lat": task.lat,
+                    "lon": task.lon,
+                    "heading_index": task.heading_index,
+                    "side_index": task.side_index,
+                    "heading": task.heading,
+                    "fov": retrieve_cfg.fov,
+                    "date": task.date,
+                }
+            )
+
+            # Skip the images present on cloud already, or retrieved for another point of the same pano
+            if (
+                task.image_path in self.existing_images
+                or task.image_path in stored_blobs
+                or not self._claim(task)
+            ):
+                self.metrics.add("download", "skipped")
+                continue
+            images.append(task)
+
+        self.manifest_rows.extend(rows)
+
+        return images
+
+    def download(self, task: ImageTask) -> ImageTask:
+        """Downloads the image"""
+        retrieve_cfg = self.cfg.features.retrieve
+        size = retrieve_cfg.img_size
+        params = {
+            "key": self.cfg.google_token,
+            "size": f"{size[0]}x{size[1]}",
+            "fov": retrieve_cfg.fov,
+            "pitch": retrieve_cfg.pitch,
+            "heading": task.heading,
+        }
+        # Request the resolved pano itself, so that the image matches its metadata
+        if task.pano is not None:
+            params["pano"] = task.pano
+        else:
+            params["location"] = f"{task.lat}, {task.lon}"
+        response = self.session.get(
+            PIC_BASE, params=self._signed_params(PIC_BASE, params), timeout=60
+        )
+        if response.status_code == 429:
+            raise QuotaError(f"HTTP 429 for image {task.image_path}")
+        response.raise_for_status()
+
+        task.content = response.content
+        return task
+
+    def upload(self, task: ImageTask) -> ImageTask:
+        """Uploads the image to the bucket (publication to the public bucket is done afterwards, server-side)"""
+        content_type, _ = mimetypes.guess_type(task.image_path)
+        self.bucket.blob(task.image_path).upload_from_string(
+            task.content, content_type=content_type
+        )
+        task.content = None
+        self.uploaded.append(task.image_path)
+        with self._stored_lock:
+            self.available.add(task.image_path)
+
+        logger.info(f"Retrieve {self.cfg.area.name} -- retrieved {task.image_path}")
+        return task
+
+    def _run_with_retry(
+        self, stage: str, func: Callable, task: Union[PointTask, ImageTask]
+    ) -> Optional[Union[List[ImageTask], ImageTask]]:
+        """Runs a stage on a task, with retries. Quota errors are waited for, and do not count as attempts"""
+        attempt = 0
+        while True:
+            self.breaker.wait()
+            try:
+                result = func(task)
+                self.breaker.success()
+                return result
+
+            except QuotaError as e:
+                self.breaker.trip()
+                error = e
+
+            except Exception as e:
+                attempt += 1
+                error = e
+                if attempt >= self.max_attempts:
+                    logger.error(
+                        f"Retrieve {self.cfg.area.name} -- {stage} failed after {attempt} attempts "
+                        f"at {task.lat}, {task.lon}: {error}"
+                    )
+                    self.metrics.add(stage, "failed")
+                    return None
+                time.sleep(random.uniform(0, min(60, 2**attempt)))
+
+    def _worker(self, stage: str, func: Callable, next_stage: Optional[str]) -> None:
+        in_queue = self.queues[stage]
+        while True:
+            task = in_queue.get()
+            if task is None:
+                return
+
+            # Skipped or failed tasks stop here
+            result = self._run_with_retry(stage, func, task)
+            if result is None:
+                continue
+
+            self.metrics.add(stage, "done")
+            if next_stage is not None:
+                # The metadata stage fans out the images of a point
+                for next_task in result if isinstance(result, list) else [result]:
+                    self.queues[next_stage].put(next_task)
+
+    def _reporter(self, stop_event: threading.Event) -> None:
+        while not stop_event.wait(self.metrics_interval):
+            logger.info(
+                f"Retrieve {self.cfg.area.name} -- {self.metrics.report(self.queues)}"
+            )
+
+    def manifest(self) -> List[dict]:
+        """Manifest entries of the images available once the engine ran (the failed ones are left out)"""
+        return [row for row in self.manifest_rows if row["key"] in self.available]
+
+    def run(self, points: Iterable[PointTask]) -> None:
+        """Retrieves the images of the points, returns when all of them went through the stages"""
+        funcs = {
+            "metadata": (self.fetch_metadata, "download"),
+            "download": (self.download, "upload"),
+            "upload": (self.upload, None),
+        }
+        threads = {
+            stage: [
+                threading.Thread(
+                    target=self._worker, args=(stage, *funcs[stage]), daemon=True
+                )
+                for _ in range(self.workers[stage])
+            ]
+            for stage in self.STAGES
+        }
+        for stage_threads in threads.values():
+            for thread in stage_threads:
+                thread.start()
+
+        stop_event = threading.Event()
+        reporter = threading.Thread(target=self._reporter, args=(stop_event,), daemon=True)
+        reporter.start()
+
+        # Plan (blocks while the metadata stage is busy)
+        for point in points:
+            self.queues["metadata"].put(point)
+
+        # Drain the stages in order
+        for stage in self.STAGES:
+            for _ in threads[stage]:
+                self.queues[stage].put(None)
+            for thread in threads[stage]:
+                thread.join()
+
+        stop_event.set()
+        logger.info(f"Retrieve {self.cfg.area.name} -- {self.metrics.report(self.queues)}")
@@ -1,83 +1,43 @@
-import io
+import heapq
+import json
 import math
-import mimetypes
-import threading
-import time
-import urllib.parse as urlparse
-from itertools import combinations
-from typing import Dict, List, Optional, Tuple
-
-import networkx as nx
-import networkx.readwrite.json_graph as json_graph
+import os
+from datetime import datetime
+from typing import Iterator, List, Optional, Set, Tuple
+
+import geopandas as gpd
 import numpy as np
-import requests
-from cloud_utils import get_bucket, get_signature, read_json_gcs
+import pandas as pd
+import shapely
+from cloud_utils import (
+    get_bucket,
+    get_graph_blob,
+    get_names_gcs,
+    publish_blobs,
+    read_graph_gcs,
+    read_json_gcs,
+    upload_json_to_gcs,
+)
 from config_model import SetupConfig
+from geo_utils import to_enu
 from google.cloud.storage import Bucket
+from graph_store import GraphStore
+from image_store import (
+    MANIFEST_COLUMNS,
+    manifest_prefix,
+    manifest_view,
+    read_manifest,
+    write_manifest,
+)
 from logger import logger
-from logging_utils import format_logging
-from numpy.typing import NDArray
-
-# Global event to handle pausing threads
-pause_event = threading.Event()
-pause_event.set()
-
+from metadata_cache import get_metadata_cache, sync_metadata_cache
+from numpy.typing import ArrayLike, NDArray
+from retrieve_engine import ImageTask, PointTask, RetrieveEngine, image_match_key
+from scipy.sparse import csgraph, csr_matrix
 
-def is_within_ranges(first_angle: float, second_angle: float, thresh: int = 45) -> bool:
-
-    # Adjust angles to be within [0, 360) range
-    first_angle = first_angle % 360
-    first_angle_opposite = (first_angle + 180) % 360
-    second_angle = second_angle % 360
-
-    # Define the specified ranges
-    ranges = [
-        ((first_angle - thresh) % 360, (first_angle + thresh) % 360),
-        ((first_angle_opposite - thresh) % 360, (first_angle_opposite + thresh) % 360),
-    ]
 
-    # Check if the second angle is within any of the specified ranges
-    for range_start, range_end in ranges:
-        if range_start > range_end:
-            if (range_start <= second_angle <= 360) or (0 <= second_angle <= range_end):
-                return True
-        if range_start <= second_angle <= range_end:
-            return True
-
-    return False
-
-
-def check_edge_headings(
-    edges_headings: List[Tuple[float, float, float]], thresh: int = 45
-) -> NDArray[np.float64]:
-    good_headings_indexes = []
-    all_comb = list(combinations(list(range(len(edges_headings))), 2))
-    for comb in all_comb:
-        # Get headings
-        heading1 = edges_headings[comb[0]][0]
-        heading2 = edges_headings[comb[1]][0]
-
-        # Order headings
-        if heading1 > heading2:
-            bigger_heading = heading1
-            smaller_heading = heading2
-        else:
-            bigger_heading = heading2
-            smaller_heading = heading1
-        if is_within_ranges(smaller_heading, bigger_heading, thresh):
-            # Choose only one of the heading index
-            good_headings_indexes.append(comb[0])
-        else:
-            # Take both heading indexes
-            good_headings_indexes.extend([comb[0], comb[1]])
-    good_headings_indexes = list(set(good_headings_indexes))
-
-    return np.array(edges_headings)[good_headings_indexes]
-
-
-def calculate_heading(
-    lat1: float, lon1: float, lat2: float, lon2: float
-) -> Tuple[float, float, float]:
+def heading_degrees(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Heading, in degrees in [0, 360), from the first to the second point"""
     # Convert latitude and longitude from degrees to radians
     lat1_rad, lon1_rad, lat2_rad, lon2_rad = map(math.radians, [lat1, lon1, lat2, lon2])
 
@@ -92,7 +52,30 @@ def calculate_heading(
     heading_rad = math.atan2(y, x)
 
     # Convert heading from radians to degrees and ensure it's in the range [0, 360)
-    heading = (math.degrees(heading_rad) + 360) % 360
+    return (math.degrees(heading_rad) + 360) % 360
+
+
+def calculate_heading(
+    lat1: ArrayLike, lon1: ArrayLike, lat2: ArrayLike, lon2: ArrayLike
+) -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Computes the headings of edges, and the headings perpendicular to them (element-wise).
+    The headings are part of the image names, so they are computed with the scalar formula the names were always
+    built with (geo_utils.bearing can differ in the last bits, and would miss the images already retrieved)
+    Returns:
+        (heading, clockwise heading, counterclockwise heading), in degrees in [0, 360)
+    """
+    heading = np.fromiter(
+        map(
+            heading_degrees,
+            np.ravel(lat1).tolist(),
+            np.ravel(lon1).tolist(),
+            np.ravel(lat2).tolist(),
+            np.ravel(lon2).tolist(),
+        ),
+        dtype=np.float64,
+        count=np.size(lat1),
+    )
 
     clockwise_heading = (heading + 90) % 360
     counterclockwise_heading = (heading - 90) % 360
@@ -100,246 +83,447 @@ def calculate_heading(
     return heading, clockwise_heading, counterclockwise_heading
 
 
-def get_street_image(
-    cfg: SetupConfig,
-    lat: float,
-    lon: float,
-    params: Dict[str, List[int] | int | float],
-    side_index: int,
-    bucket: Bucket,
-    public_bucket: Bucket,
-    heading_index: int,
-) -> None:
-    """Obtain a Google Street View image and store it to cloud"""
-
-    while True:
-        pause_event.wait()
-        try:
-            # default urls
-            meta_base = "https://maps.googleapis.com/maps/api/streetview/metadata?"
-            pic_base = "https://maps.googleapis.com/maps/api/streetview?"
-
-            # define the params for the metadata request
-            meta_params = {"key": cfg.google_token, "location": f"{lat}, {lon}"}
-
-            # define the params for the picture request
-            size = params["size"]
-            heading = params["heading"]
-            fov = params["fov"]
-            pitch = params["pitch"]
-
-            pic_params = {
-                "key": cfg.google_token,
-                "location": f"{lat}, {lon}",
-                "size": f"{size[0]}x{size[1]}",
-                "fov": fov,
-                "pitch": pitch,
-            }
-
-            if heading is not None:
-                pic_params["heading"] = heading
-
-            input_url_meta = meta_base + urlparse.urlencode(meta_params)
-            meta_params["signature"] = get_signature(input_url_meta, cfg.google_secret)
-
-            input_url_pic = pic_base + urlparse.urlencode(pic_params)
-            pic_params["signature"] = get_signature(input_url_pic, cfg.google_secret)
-
-            # obtain the metadata of the request (free)
-            meta_response = requests.get(meta_base, params=meta_params)
-
-            # display the contents of the response
-            meta_data = meta_response.json()
-            if meta_data["status"] == "OK":
-                date = meta_data["date"]
-
-                img_name = f"{lat}_{lon}_{heading_index}_{side_index}_{heading}_{fov}_{date}.jpg"
-
-                # Check if present on cloud already
-                image_path = f"{cfg.area.images_path}/{img_name}"
-                image_blob = bucket.blob(image_path)
-                image_exists = image_blob.exists()
-
-                if not image_exists:
-                    # Proceed to call for a new image
-                    pic_response = requests.get(pic_base, params=pic_params)
-
-                    if pic_response.status_code == 200:
-                        image_stream = io.BytesIO(pic_response.content)
-
-                        content_type, _ = mimetypes.guess_type(image_path)
-                        image_blob.upload_from_file(
-                            image_stream, content_type=content_type, rewind=True
-                        )
-
-                        # Also write to public bucket
-                        if public_bucket is not None:
-                            image_blob_public = public_bucket.blob(image_path)
-                            image_blob_public.upload_from_file(
-                                image_stream, content_type=content_type, rewind=True
-                            )
-                    else:
-                        logger.error(
-                            f"Retrieve {cfg.area.name} -- Error at retrieving image {img_name}"
-                        )
-                        raise Exception(
-                            f"Retrieve {cfg.area.name} -- Error at retrieving image {img_name}"
-                        )
-                    # close the response connection to the API
-                    pic_response.close()
-
-                text = format_logging(
-                    img_name,
-                    stage="Retrieve",
-                    exists=image_exists,
-                    area_name=cfg.area.name,
-                )
-                logger.info(text)
-                break
-            else:
-                logger.error(f"Retrieve {cfg.area.name} -- Error at metadata")
-                raise Exception("Metadata retrieval failed")
-
-        except Exception as e:
-            pause_event.clear()  # Clear flag
-            logger.error(f"Error in get_street_image: {e}.")
-            time.sleep(60)
-            pause_event.set()  # Set the pause event to pause all threads
-
-
-def retrieve_run(
-    node: str,
-    g: nx.Graph,
-    img_params: Dict[str, List[int] | int | float],
-    cfg: SetupConfig,
-    bucket: Bucket,
-    public_bucket: Optional[Bucket],
-) -> None:
-    """Retrieves associated images for a node"""
-
-    # Get latitude, longitude data
-    data = g.nodes[node]
-    node_lat, node_lon = data["lat"], data["lon"]
+def similar_headings(
+    first_heading: ArrayLike, second_heading: ArrayLike, thresh: float = 45
+) -> NDArray[np.bool_]:
+    """Checks whether the headings are within thresh degrees of each other, or of the opposite direction (element-wise)"""
+    diff = np.abs(np.asarray(first_heading) - np.asarray(second_heading)) % 180
 
-    # Get neighbours
-    neighbours = list(g.neighbors(node))
+    return np.minimum(diff, 180 - diff) <= thresh
 
-    # Get node degree
-    node_degree = g.degree(node)
-    if node_degree == 1:
-        # Get neighbour coordinates
-        neigh = neighbours[0]
-        neigh_lat, neigh_lon = g.nodes[neigh]["lat"], g.nodes[neigh]["lon"]
 
-        # Compute heading
-        edge_heading, h1, h2 = calculate_heading(
-            node_lat, node_lon, neigh_lat, neigh_lon
+def connected_components(graph: GraphStore) -> Tuple[csr_matrix, NDArray[np.int32]]:
+    """
+    Labels the connected components of a graph
+    Returns:
+        (CSR adjacency matrix, np.ndarray[nr_nodes] of component labels)
+    """
+    nr_nodes = graph.number_of_nodes()
+    adjacency = csr_matrix(
+        (np.ones(len(graph.indices), dtype=np.int8), graph.indices, graph.indptr),
+        shape=(nr_nodes, nr_nodes),
+    )
+    _, labels = csgraph.connected_components(adjacency, directed=False)
+
+    return adjacency, labels
+
+
+def bfs_node_order(adjacency: csr_matrix, labels: NDArray[np.int32]) -> NDArray[np.int64]:
+    """
+    Orders the nodes component by component, in BFS order from the lowest node index of each component
+    Returns:
+        np.ndarray[nr_nodes] of node indexes
+    """
+    nr_components = int(labels.max(initial=-1)) + 1
+
+    # Relabel the nodes so that each component is a contiguous diagonal block of the adjacency
+    by_component = np.argsort(labels, kind="stable")
+    adjacency = adjacency[by_component][:, by_component]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nr_components))])
+
+    order = []
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if end - start == 1:
+            order.append(by_component[start:end])
+            continue
+        block_order = csgraph.breadth_first_order(
+            adjacency[start:end, start:end], 0, directed=False, return_predecessors=False
         )
-        for side_index, h in enumerate([h1, h2]):
-            img_params["heading"] = h
-
-            # Retrieve image
-            get_street_image(
-                cfg,
-                data["lat"],
-                data["lon"],
-                img_params,
-                side_index,
-                bucket,
-                public_bucket,
-                heading_index=0,
-            )
+        order.append(by_component[start + block_order])
+
+    return np.concatenate(order) if order else np.zeros(0, dtype=np.int64)
+
+
+def plan_images(graph: GraphStore, thresh: float = 45) -> pd.DataFrame:
+    """
+    Plans the images of all the nodes at once, from the CSR arrays of the graph: both sides of the road, for each
+    distinct road direction at the node. Of two edges of a node with similar headings, only the first one is kept.
+    Args:
+        graph: SV graph
+        thresh: maximum difference, in degrees, of similar headings
+
+    Returns:
+        table of the images (node, component, lat, lon, heading_index, side_index, heading), with the nodes in
+        BFS order
+    """
+    degree = graph.degree()
+    sources = np.repeat(np.arange(graph.number_of_nodes()), degree)
+    targets = graph.indices.astype(np.int64)
+    edge_heading, h1, h2 = calculate_heading(
+        graph.lat[sources], graph.lon[sources], graph.lat[targets], graph.lon[targets]
+    )
 
-    elif node_degree >= 2:
-        neigh_edges_headings = []
-        for neigh in neighbours:
-            # Get neighbour coordinates
-            neigh_lat, neigh_lon = g.nodes[neigh]["lat"], g.nodes[neigh]["lon"]
+    # Position of each edge among the edges of its node
+    position = np.arange(len(targets)) - graph.indptr[sources]
+    edge_degree = degree[sources]
+
+    # Compare each pair of edges of a node, the first edge of a pair is always kept, the second one only if the
+    # headings differ. Pairs are enumerated by offset between their edges, so one pass per offset
+    keep = (edge_degree == 1) | (position < edge_degree - 1)
+    for offset in range(1, int(degree.max(initial=0))):
+        first = np.flatnonzero(position + offset < edge_degree)
+        second = first + offset
+        keep[second[~similar_headings(edge_heading[first], edge_heading[second], thresh)]] = True
+
+    # Index of each kept edge among the kept edges of its node
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    kept = np.flatnonzero(keep)
+    heading_index = kept_before[kept] - kept_before[graph.indptr[sources[kept]]]
+
+    # Two images (sides) per kept edge
+    node = np.repeat(sources[kept], 2)
+    adjacency, labels = connected_components(graph)
+    rank = np.empty(graph.number_of_nodes(), dtype=np.int64)
+    rank[bfs_node_order(adjacency, labels)] = np.arange(graph.number_of_nodes())
+    table = pd.DataFrame(
+        {
+            "node": node,
+            "component": labels[node],
+            "lat": graph.lat[node],
+            "lon": graph.lon[node],
+            "heading_index": np.repeat(heading_index, 2),
+            "side_index": np.tile([0, 1], len(kept)),
+            "heading": np.stack([h1[kept], h2[kept]], axis=1).ravel(),
+        }
+    )
+    order = np.lexsort((table["side_index"], table["heading_index"], rank[node]))
 
-            # Compute heading
-            edge_heading, h1, h2 = calculate_heading(
-                node_lat, node_lon, neigh_lat, neigh_lon
-            )
-            neigh_edges_headings.append((edge_heading, h1, h2))
-
-        # Keep useful headings
-        headings_needed = check_edge_headings(neigh_edges_headings)
-
-        for heading_index, (_, h1, h2) in enumerate(headings_needed):
-            for side_index, h in enumerate([h1, h2]):
-                img_params["heading"] = h
-
-                # Retrieve image
-                get_street_image(
-                    cfg,
-                    data["lat"],
-                    data["lon"],
-                    img_params,
-                    side_index,
-                    bucket,
-                    public_bucket,
-                    heading_index=heading_index,
-                )
-    else:
-        # If it happens that there is still a node with degree 0, skip it, as we cannot compute the heading
+    return table.iloc[order].reset_index(drop=True)
+
+
+def iter_points(table: pd.DataFrame) -> Iterator[PointTask]:
+    """Groups the planned images by node, in the order of the table"""
+    if table.empty:
         return
 
+    node = table["node"].to_numpy()
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(node)) + 1, [len(node)]])
+    columns = [
+        table[column].tolist()
+        for column in ("lat", "lon", "heading", "side_index", "heading_index")
+    ]
+    rows = list(zip(*columns))
+
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        images = [ImageTask(*row) for row in rows[start:end]]
+        yield PointTask(images[0].lat, images[0].lon, images)
+
+
+def get_shard(cfg: SetupConfig) -> Tuple[int, int]:
+    """
+    Shard of the images retrieved by this task, from the config or from the environment of the batch task
+    (BATCH_TASK_INDEX/BATCH_TASK_COUNT on Cloud Batch, CLOUD_RUN_TASK_INDEX/CLOUD_RUN_TASK_COUNT on Cloud Run jobs)
+    Returns:
+        (shard index, number of shards)
+    """
+    retrieve_cfg = cfg.features.retrieve
+
+    nr_shards = retrieve_cfg.shards
+    if nr_shards is None:
+        nr_shards = int(
+            os.environ.get("BATCH_TASK_COUNT", os.environ.get("CLOUD_RUN_TASK_COUNT", 1))
+        )
+    shard_index = retrieve_cfg.shard_index
+    if shard_index is None:
+        shard_index = int(
+            os.environ.get("BATCH_TASK_INDEX", os.environ.get("CLOUD_RUN_TASK_INDEX", 0))
+        )
+    assert 0 <= shard_index < nr_shards, logger.error(
+        f"Retrieve {cfg.area.name} -- shard index {shard_index} out of {nr_shards} shards"
+    )
 
-def retrieve_images(cfg: SetupConfig, bucket: Bucket) -> None:
-    """Retrieves Street View images"""
+    return shard_index, nr_shards
+
+
+def assign_shards(
+    table: pd.DataFrame, nr_shards: int, tile_size: List[float]
+) -> NDArray[np.int64]:
+    """
+    Partitions the planned images into shards of about the same number of images, deterministically (every task
+    computes the same partition). Images are grouped by connected component, and the components with more images
+    than a shard holds are split further by spatial tile; groups are then assigned to the least loaded shard,
+    largest first
+    Args:
+        table: planned images, from plan_images
+        nr_shards: number of shards
+        tile_size: size (meters) of the tiles splitting the oversized components, as [width, height]
+
+    Returns:
+        np.ndarray[nr_images] of shard indexes
+    """
+    if nr_shards == 1 or table.empty:
+        return np.zeros(len(table), dtype=np.int64)
+
+    # Tile of each image, from its node coordinates
+    lat, lon = table["lat"].to_numpy(), table["lon"].to_numpy()
+    x, y = to_enu(lat, lon, float(lat.min()), float(lon.min()))
+    tile_x = np.floor(x / tile_size[0]).astype(np.int64)
+    tile_y = np.floor(y / tile_size[1]).astype(np.int64)
+
+    # Oversized components are split by tile, the other ones are kept whole
+    component = table["component"].to_numpy()
+    component_images = np.bincount(component)
+    oversized = component_images[component] > len(table) / nr_shards
+    groups = pd.DataFrame(
+        {
+            "component": component,
+            "tile_x": np.where(oversized, tile_x, 0),
+            "tile_y": np.where(oversized, tile_y, 0),
+        }
+    )
+    group_index = groups.groupby(["component", "tile_x", "tile_y"]).ngroup().to_numpy()
+    group_images = np.bincount(group_index)
+
+    # Largest groups first (ties broken by group index), each to the least loaded shard (ties to the lowest index)
+    loads = [(0, shard) for shard in range(nr_shards)]
+    group_shard = np.zeros(len(group_images), dtype=np.int64)
+    for group in np.lexsort((np.arange(len(group_images)), -group_images)).tolist():
+        load, shard = heapq.heappop(loads)
+        group_shard[group] = shard
+        heapq.heappush(loads, (load + int(group_images[group]), shard))
+
+    return group_shard[group_index]
+
+
+def image_names(cfg: SetupConfig, table: pd.DataFrame) -> List[str]:
+    """Paths of the planned images, without their date (only known from the metadata)"""
+    fov = cfg.features.retrieve.fov
+    columns = [
+        table[column].tolist()
+        for column in ("lat", "lon", "heading_index", "side_index", "heading")
+    ]
+
+    return [
+        f"{cfg.area.images_path}/{lat}_{lon}_{heading_index}_{side_index}_{heading}_{fov}_"
+        for lat, lon, heading_index, side_index, heading in zip(*columns)
+    ]
+
+
+def estimate_costs(cfg: SetupConfig, summary: pd.DataFrame) -> pd.DataFrame:
+    """Adds the API cost, storage and projected runtime of the images to retrieve to a summary table"""
+    retrieve_cfg = cfg.features.retrieve
+
+    summary["to_retrieve"] = summary["images"] - summary["existing"]
+    summary["cost_usd"] = (
+        summary["to_retrieve"] * retrieve_cfg.cost_per_1000_images / 1000
+    ).round(2)
+    summary["storage_gb"] = (summary["to_retrieve"] * retrieve_cfg.image_size_kb / 1024**2).round(3)
+
+    # The stages are pipelined: the one with the most requests per thread sets the runtime
+    requests_per_thread = np.maximum.reduce(
+        [
+            summary["nodes_to_retrieve"] / retrieve_cfg.metadata_workers,
+            summary["to_retrieve"] / retrieve_cfg.max_chunk_size,
+            summary["to_retrieve"] / retrieve_cfg.upload_workers,
+        ]
+    )
+    summary["runtime_hours"] = (requests_per_thread * retrieve_cfg.request_seconds / 3600).round(2)
+
+    return summary
+
+
+def summarize_images(cfg: SetupConfig, table: pd.DataFrame, by: str) -> pd.DataFrame:
+    """Counts the planned, existing and missing images (and their costs) per value of the by column"""
+    table = table.assign(missing_node=table["node"].where(~table["exists"]))
+    summary = table.groupby(by).agg(
+        nodes=("node", "nunique"),
+        nodes_to_retrieve=("missing_node", "nunique"),
+        images=("node", "size"),
+        existing=("exists", "sum"),
+    )
+
+    return estimate_costs(cfg, summary).sort_values("to_retrieve", ascending=False)
+
+
+def to_records(summary: pd.DataFrame) -> List[dict]:
+    """Rows of a summary table, with JSON serializable values"""
+    return json.loads(summary.reset_index().to_json(orient="records"))
+
+
+def dry_run(
+    cfg: SetupConfig,
+    bucket: Bucket,
+    table: pd.DataFrame,
+    existing_images: Set[str],
+    sub_polygons_df: Optional[gpd.GeoDataFrame] = None,
+) -> dict:
+    """
+    Estimates the retrieval of the planned images without any Street View request, and saves a report (total, per
+    connected component and per sub-polygon) to cloud. Images of nodes sharing a pano are counted for each node, so
+    counts are upper bounds
+    Args:
+        cfg: configuration object
+        bucket: cloud bucket instance
+        table: planned images, from plan_images
+        existing_images: paths of the images already retrieved (<images_path>/<name>, also for the ones of the
+            image store listed in the area manifest)
+        sub_polygons_df: GeoDataFrame of the sub-polygons of the area, if any
+
+    Returns:
+        the report
+    """
+
+    # Images already retrieved, whatever their date and heading_index (see image_match_key)
+    existing_prefixes = {
+        image_match_key(path.rsplit("_", 1)[0] + "_") for path in existing_images
+    }
+    table = table.assign(
+        area=cfg.area.name,
+        exists=[image_match_key(name) in existing_prefixes for name in image_names(cfg, table)],
+    )
+
+    report = {
+        "total": to_records(summarize_images(cfg, table, "area"))[0],
+        "components": to_records(summarize_images(cfg, table, "component")),
+        "shards": to_records(summarize_images(cfg, table, "shard")),
+    }
+
+    if sub_polygons_df is not None and len(sub_polygons_df) > 0:
+        # Sub-polygon of each node (-1 if outside all of them), geometries are lon/lat
+        sub_polygon = np.full(len(table), -1)
+        lon, lat = table["lon"].to_numpy(), table["lat"].to_numpy()
+        for index, geometry in zip(sub_polygons_df.index, sub_polygons_df.geometry):
+            shapely.prepare(geometry)
+            sub_polygon[(sub_polygon == -1) & shapely.contains_xy(geometry, lon, lat)] = index
+
+        summary = summarize_images(cfg, table.assign(sub_polygon=sub_polygon), "sub_polygon")
+        summary["name"] = summary.index.map(sub_polygons_df["name"]).fillna("outside")
+        report["sub_polygons"] = to_records(summary)
+
+    report_path = f"{cfg.area.data_path}/retrieve_dry_run.json"
+    upload_json_to_gcs(bucket, report_path, report)
+
+    total = report["total"]
+    logger.info(
+        f"Retrieve {cfg.area.name} -- dry run: {total['to_retrieve']}/{total['images']} images to retrieve "
+        f"at {total['nodes_to_retrieve']} nodes, ~{total['cost_usd']} USD, ~{total['storage_gb']} GB, "
+        f"~{total['runtime_hours']} hours. Report saved to {report_path}"
+    )
+
+    return report
+
+
+def build_manifest_view(cfg: SetupConfig, bucket: Bucket, source_area: str) -> None:
+    """
+    Builds the image manifest of the area from the one of a source area enclosing it, by keeping the images inside
+    the area polygon: the images are shared through the image store, nothing is copied
+    Args:
+        cfg: configuration object
+        bucket: cloud bucket instance
+        source_area: name of the enclosing area, e.g. africa/nigeria/lagos
+    """
+    source_manifest = read_manifest(bucket, f"{cfg.database_path}/{source_area}/data")
+    assert len(source_manifest) > 0, logger.error(
+        f"Retrieve {cfg.area.name} -- no image manifest for {source_area}. Please run retrieve on it before!"
+    )
+
+    view = manifest_view(source_manifest, cfg.area.polygon)
+    write_manifest(bucket, f"{manifest_prefix(cfg.area.data_path)}view.parquet", view)
+
+    logger.info(
+        f"Retrieve {cfg.area.name} -- {len(view)}/{len(source_manifest)} images of {source_area} in the area"
+    )
+
+
+def retrieve_images(
+    cfg: SetupConfig, bucket: Bucket, sub_polygons_df: Optional[gpd.GeoDataFrame] = None
+) -> None:
+    """Retrieves Street View images, or only estimates their retrieval if dry_run"""
 
     # Get retrieve action config
     retrieve_cfg = cfg.features.retrieve
-    max_chunk_size = retrieve_cfg.max_chunk_size
 
-    public_bucket = None
-    if retrieve_cfg.public:
-        public_bucket = get_bucket(cfg.public_bucket_name, cfg.project_id)
+    # View of the images of another area (e.g. the zone of a ward), without any retrieval
+    if retrieve_cfg.manifest_source_area is not None:
+        build_manifest_view(cfg, bucket, retrieve_cfg.manifest_source_area)
+        return
 
     # Get graph of SV data
-    sv_graph_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.json"
-    sv_merged_exists = bucket.blob(sv_graph_path).exists()
-    assert sv_merged_exists, logger.error(
+    sv_graph_path = f"{cfg.area.data_path}/{cfg.sv_name}_merged.graph"
+    sv_graph_blob = get_graph_blob(bucket, sv_graph_path)
+    assert sv_graph_blob is not None, logger.error(
         f"Retrieve {cfg.area.name} -- SV map not computed. "
         f"Please run build and merge processes before!"
     )
 
-    # Set image params
-    img_params = {
-        "size": retrieve_cfg.img_size,
-        "fov": retrieve_cfg.fov,
-        "pitch": retrieve_cfg.pitch,
-    }
+    # Shard of this task, done already if its completion manifest was written for the current graph
+    shard_index, nr_shards = get_shard(cfg)
+    shard_name = f"shard_{shard_index}_of_{nr_shards}"
+    completion_path = f"{cfg.area.data_path}/retrieve_shards/{shard_name}.json"
+    if not retrieve_cfg.dry_run and bucket.blob(completion_path).exists():
+        completion = read_json_gcs(bucket, completion_path)
+        if completion["graph_generation"] == sv_graph_blob.generation:
+            logger.info(
+                f"Retrieve {cfg.area.name} -- shard {shard_index}/{nr_shards} already completed"
+            )
+            return
+
+    # Read graph with all points, and plan all its images before any request
+    graph = read_graph_gcs(bucket, sv_graph_path)
+    table = plan_images(graph)
+    table["shard"] = assign_shards(table, nr_shards, retrieve_cfg.shard_tile_size)
+    logger.info(
+        f"Retrieve {cfg.area.name} -- planned {len(table)} images at {table['node'].nunique()} nodes"
+    )
 
-    # Read graph with all points
-    json_sv = read_json_gcs(bucket, sv_graph_path)
-    g = json_graph.adjacency_graph(json_sv)
+    # Images already retrieved, listed once
+    existing_images = set(get_names_gcs(bucket, f"{cfg.area.images_path}/"))
 
-    # Get disconnected components
-    components = list(nx.connected_components(g))
+    if retrieve_cfg.dry_run:
+        # Images in the image store are only listed in the manifest of the area
+        manifest_images = {
+            f"{cfg.area.images_path}/{name}"
+            for name in read_manifest(bucket, cfg.area.data_path)["name"].tolist()
+        }
+        dry_run(cfg, bucket, table, existing_images | manifest_images, sub_polygons_df)
+        return
 
-    for comp_index, component in enumerate(components):
-        logger.info(f"Processing component {comp_index + 1}/{len(components)}....")
-        bfs_ordered_nodes = list(
-            nx.bfs_tree(g.subgraph(component), source=list(component)[0]).nodes()
+    # Only the images of this shard
+    table = table[table["shard"].to_numpy() == shard_index]
+    logger.info(
+        f"Retrieve {cfg.area.name} -- shard {shard_index}/{nr_shards}: {len(table)} images "
+        f"at {table['node'].nunique()} nodes"
+    )
+
+    # Panoramas metadata cache, shared by all the nodes
+    metadata_cache = get_metadata_cache(cfg, bucket)
+
+    # Retrieve the images through the pipelined engine
+    engine = RetrieveEngine(cfg, bucket, existing_images, metadata_cache)
+    engine.run(iter_points(table))
+
+    # Share the queried metadata with the next runs
+    sync_metadata_cache(cfg, bucket)
+
+    # Image manifest of the shard: where each image of the area is stored
+    image_manifest = pd.DataFrame(engine.manifest(), columns=MANIFEST_COLUMNS)
+    write_manifest(
+        bucket, f"{manifest_prefix(cfg.area.data_path)}{shard_name}.parquet", image_manifest
+    )
+
+    # Publish the images of the shard (including the ones of previous runs not published yet), server-side
+    if retrieve_cfg.public:
+        public_bucket = get_bucket(cfg.public_bucket_name, cfg.project_id)
+        publish_blobs(
+            bucket,
+            image_manifest["key"].tolist(),
+            public_bucket,
+            prefix=None if cfg.image_store else f"{cfg.area.images_path}/",
+            max_workers=retrieve_cfg.upload_workers,
         )
 
-        # Process chunks of nodes
-        for i in range(0, len(bfs_ordered_nodes), max_chunk_size):
-            cur_nodes = bfs_ordered_nodes[i : i + max_chunk_size]
-            retrieve_threads = []
-
-            # Start threads equal to the number of nodes in a chunk
-            for node in cur_nodes:
-                new_image_params = img_params.copy()
-                thread = threading.Thread(
-                    target=retrieve_run,
-                    args=(node, g, new_image_params, cfg, bucket, public_bucket),
-                    daemon=True,
-                )
-                retrieve_threads.append(thread)
-                thread.start()
-
-            # Wait for all threads to complete
-            for thread in retrieve_threads:
-                thread.join()
+    # Completion manifest of the shard
+    upload_json_to_gcs(
+        bucket,
+        completion_path,
+        {
+            "area": cfg.area.name,
+            "shard_index": shard_index,
+            "shards": nr_shards,
+            "graph_generation": sv_graph_blob.generation,
+            "images": len(table),
+            "nodes": int(table["node"].nunique()),
+            "stages": engine.metrics.counts,
+            "completed_at": datetime.now().isoformat(),
+        },
+    )
@@ -6,7 +6,7 @@ import time
 import urllib.parse
 from concurrent.futures import ThreadPoolExecutor
 from threading import Event
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 import requests
@@ -19,6 +19,7 @@ from cloud_utils import (
 from config_model import SetupConfig
 from dataset_utils import CloudDetectionDataset, DetectionDataset
 from google.cloud.storage import Bucket
+from image_store import image_blobs, read_manifest
 from logger import logger
 from roboflow import Roboflow
 from roboflow.adapters.rfapi import AnnotationSaveError as AlreadyExistingError
@@ -34,8 +35,9 @@ def upload_image_roboflow_run(
     blob_name: str,
     nr_blobs: int,
     split: str = "train",
+    img_name: Optional[str] = None,
 ) -> None:
-    """Uploads image to Roboflow"""
+    """Uploads image to Roboflow (named img_name, if the blob storing it is named otherwise)"""
 
     # Get config parameters
     upload_cfg = cfg.features.upload_for_annotation
@@ -48,7 +50,8 @@ def upload_image_roboflow_run(
     base_url = "https://api.roboflow.com"
 
     # Get image name
-    img_name = presigned_url.split("/")[-1]
+    if img_name is None:
+        img_name = presigned_url.split("/")[-1]
 
     # Build upload URL
     upload_url = "".join(
@@ -158,6 +161,11 @@ def upload_for_annotation(cfg: SetupConfig, bucket: Bucket) -> None:
 
     filtered_annotation_path = ""
     temp_dataset_path = ""
+
+    # Blobs storing the images of the area, from its manifest
+    area_blobs = image_blobs(
+        read_manifest(bucket, cfg.area.data_path), cfg.area.images_path
+    )
     if annotations_source is not None:
         # Take images from an annotation file in the area
         annotations_path = (
@@ -199,8 +207,10 @@ def upload_for_annotation(cfg: SetupConfig, bucket: Bucket) -> None:
             raise ValueError(error_text)
 
     else:
-        # Take all images from the images folder corresponding to the area
-        available_blobs = sorted(get_names_gcs(bucket, prefix=cfg.area.images_path))
+        # Take all images of the area: the ones of its manifest, and the ones stored in its images folder
+        available_blobs = sorted(
+            set(area_blobs) | set(get_names_gcs(bucket, prefix=cfg.area.images_path))
+        )
 
     # Filter list of blobs based on filtered images
     if filtered_images is not None and len(filtered_images) > 0:
@@ -210,6 +220,10 @@ def upload_for_annotation(cfg: SetupConfig, bucket: Bucket) -> None:
             if os.path.basename(blob) in filtered_images
         ]
 
+    # Blobs storing the images (in the image store, or in the images folder of the area)
+    image_paths = available_blobs
+    available_blobs = [area_blobs.get(path, path) for path in image_paths]
+
     # If there are no annotations, upload only the images
     if annotations_source is None:
         # Get local annotations path
@@ -218,13 +232,23 @@ def upload_for_annotation(cfg: SetupConfig, bucket: Bucket) -> None:
         max_chunk_size = upload_cfg.max_chunk_size
         for i in range(0, len(available_blobs), max_chunk_size):
             cur_blobs_name = available_blobs[i : i + max_chunk_size]
+            cur_images_path = image_paths[i : i + max_chunk_size]
             cur_indexes = list(range(i, i + max_chunk_size))
             retrieve_threads = []
 
-            for cur_blob_name, index in zip(cur_blobs_name, cur_indexes):
+            for cur_blob_name, cur_image_path, index in zip(
+                cur_blobs_name, cur_images_path, cur_indexes
+            ):
                 thread = threading.Thread(
                     target=upload_image_roboflow_run,
-                    args=(cfg, index, cur_blob_name, len(available_blobs), split),
+                    args=(
+                        cfg,
+                        index,
+                        cur_blob_name,
+                        len(available_blobs),
+                        split,
+                        os.path.basename(cur_image_path),
+                    ),
                     daemon=True,
                 )
                 retrieve_threads.append(thread)
@@ -237,7 +261,10 @@ def upload_for_annotation(cfg: SetupConfig, bucket: Bucket) -> None:
         # Download images
         image_destination_folder = os.path.join(temp_dataset_path, split)
         download_images(
-            bucket, available_blobs, destination_folder=image_destination_folder
+            bucket,
+            available_blobs,
+            destination_folder=image_destination_folder,
+            destination_names=[os.path.basename(path) for path in image_paths],
         )
 
         # Get images to be uploaded
@@ -0,0 +1,292 @@
+from typing import List, Tuple
+
+import numpy as np
+import requests
+import shapely
+from build_utils import OVERPASS_HIGHWAYS, overpass_throttler, set_overpass_headers
+from cloud_utils import read_graph_gcs, read_json_gcs, upload_json_to_gcs
+from config_model import SetupConfig
+from general_utils import order_windows_coordinates, split_window
+from geo_utils import distance
+from google.cloud.storage import Bucket
+from logger import logger
+from numpy.typing import NDArray
+from osm_utils import configuration as config
+from osm_utils.osm import read_osm
+from osm_pbf_utils import get_pbf_extract
+
+# Name of the file keeping the sub-windows of an area, so that their indexes stay stable between runs
+WINDOWS_FILENAME = "windows.json"
+
+# Cells counted per Overpass request, and mean spacing (meters) of the OSM nodes along the roads, to turn the counts of
+# road nodes into graph points
+OVERPASS_COUNT_BATCH = 500
+OSM_NODE_SPACING = 20
+
+
+def segments_to_points(
+    lat1: NDArray[np.float64],
+    lon1: NDArray[np.float64],
+    lat2: NDArray[np.float64],
+    lon2: NDArray[np.float64],
+    distance_between_points: float,
+) -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Turns road segments into weighted points, each segment counting for the graph points built along it
+    Returns:
+        (latitudes, longitudes, weights) of the segments midpoints
+    """
+    weights = distance(lat1, lon1, lat2, lon2) / max(distance_between_points, 1)
+
+    return (lat1 + lat2) / 2, (lon1 + lon2) / 2, weights
+
+
+def density_from_graph(
+    cfg: SetupConfig, bucket: Bucket
+) -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """Road density points from the merged OSM graph of a previous run of the area"""
+    g = read_graph_gcs(bucket, f"{cfg.area.data_path}/{cfg.osm_name}_merged.graph")
+    u, v, _ = g.edges()
+
+    return segments_to_points(
+        g.lat[u],
+        g.lon[u],
+        g.lat[v],
+        g.lon[v],
+        cfg.features.build.distance_between_points,
+    )
+
+
+def density_from_pbf(
+    cfg: SetupConfig, bucket: Bucket, window: List[float]
+) -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """Road density points from the ways of the OSM extract (build.osm_pbf_path) inside the window"""
+    build_cfg = cfg.features.build
+    lat1, lon1, lat2, lon2 = window
+
+    configuration = config.Configuration(build_cfg.network_type)
+    nodes, ways = read_osm.read_file(
+        get_pbf_extract(cfg, bucket), configuration, bbox=(lon1, lon2, lat1, lat2)
+    )
+
+    segments = []
+    for way in ways:
+        way_nodes = [nodes[node_id] for node_id in way.nodes if node_id in nodes]
+        coords = [(node.lat, node.lon) for node in way_nodes]
+        segments.extend(
+            (*start, *end) for start, end in zip(coords[:-1], coords[1:])
+        )
+    segments = np.array(segments, dtype=np.float64).reshape(-1, 4)
+
+    return segments_to_points(
+        segments[:, 0],
+        segments[:, 1],
+        segments[:, 2],
+        segments[:, 3],
+        build_cfg.distance_between_points,
+    )
+
+
+def density_from_overpass(
+    cfg: SetupConfig, window: List[float]
+) -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Road density points from Overpass count queries: the road nodes of each window_min_area cell of the window are
+    counted, without downloading any geometry, and the cells are counted by batches of OVERPASS_COUNT_BATCH per
+    request
+    Returns:
+        (latitudes, longitudes, weights) of the cells centers
+    """
+    build_cfg = cfg.features.build
+    cells = split_window(window, list(cfg.window_min_area), 0)
+
+    nr_nodes = []
+    for start in range(0, len(cells), OVERPASS_COUNT_BATCH):
+        statements = "\n".join(
+            f'way["highway"~"{OVERPASS_HIGHWAYS}"]({lat1}, {lon1}, {lat2}, {lon2});'
+            f"node(w)({lat1}, {lon1}, {lat2}, {lon2});out count;"
+            for lon1, lon2, lat1, lat2 in cells[start : start + OVERPASS_COUNT_BATCH]
+        )
+        query = f"[out:json][timeout:180];\n{statements}"
+
+        overpass_throttler.wait_if_needed()
+        response = requests.post(
+            build_cfg.overpass_url,
+            headers=set_overpass_headers(),
+            data={"data": query},
+            timeout=300,
+        )
+        response.raise_for_status()
+
+        # One count element per cell, in the order of the statements
+        nr_nodes.extend(int(element["tags"]["nodes"]) for element in response.json()["elements"])
+
+    if len(nr_nodes) != len(cells):
+        raise requests.RequestException(
+            f"Overpass counted {len(nr_nodes)}/{len(cells)} cells"
+        )
+
+    # Each road node stands for OSM_NODE_SPACING meters of road
+    weights = (
+        np.array(nr_nodes, dtype=np.float64)
+        * OSM_NODE_SPACING
+        / max(build_cfg.distance_between_points, 1)
+    )
+
+    return (cells[:, 2] + cells[:, 3]) / 2, (cells[:, 0] + cells[:, 1]) / 2, weights
+
+
+def get_density_points(
+    cfg: SetupConfig, bucket: Bucket, window: List[float]
+) -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Estimates the road density of the window from the source set by window_density_source
+    Args:
+        cfg: configuration object
+        bucket: cloud bucket instance
+        window: bottom left and upper right lat/lon coordinates
+
+    Returns:
+        (latitudes, longitudes, weights) of points, the weights summing to the expected graph points
+    """
+    source = cfg.window_density_source
+
+    if source == "graph":
+        return density_from_graph(cfg, bucket)
+    if source == "pbf":
+        return density_from_pbf(cfg, bucket, window)
+    if source == "overpass":
+        return density_from_overpass(cfg, window)
+
+    raise ValueError(
+        f"window_density_source must be in [overpass, pbf, graph], got {source}!"
+    )
+
+
+def quadtree_split(
+    windows: NDArray[np.float64],
+    lat: NDArray[np.float64],
+    lon: NDArray[np.float64],
+    weights: NDArray[np.float64],
+    target_points: float,
+    min_area: List[float],
+    window_overlap: int,
+) -> NDArray[np.float64]:
+    """
+    Recursively splits the windows in halves (along each axis still larger than min_area) until each of them
+    holds at most target_points of weight, or cannot be split further
+    Args:
+        windows: np.ndarray[num_windows, 4] -> the order on last axis is: (min_lon, max_lon, min_lat, max_lat)
+        lat: latitudes of the density points
+        lon: longitudes of the density points
+        weights: weights of the density points
+        target_points: maximum weight of a window
+        min_area: [h, w] in meters, minimum size of a window
+        window_overlap: meters of sub_window overlap
+
+    Returns:
+        np.ndarray[num_sub_windows, 4] -> the order on last axis is: (min_lon, max_lon, min_lat, max_lat)
+    """
+
+    # Points of each window, binned once (windows overlap, so a point can be part of several)
+    boxes = shapely.box(windows[:, 0], windows[:, 2], windows[:, 1], windows[:, 3])
+    points, boxes_index = shapely.STRtree(boxes).query(
+        shapely.points(lon, lat), predicate="intersects"
+    )
+    order = np.lexsort((points, boxes_index))
+    window_points = np.split(
+        points[order], np.cumsum(np.bincount(boxes_index, minlength=len(windows)))[:-1]
+    )
+
+    result = []
+    for window, indexes in zip(windows, window_points):
+        # Depth first, so that the sub-windows of a window stay next to each other
+        stack = [(window, indexes)]
+        while stack:
+            (lon1, lon2, lat1, lat2), indexes = stack.pop()
+            inside = (
+                (lon[indexes] >= lon1)
+                & (lon[indexes] <= lon2)
+                & (lat[indexes] >= lat1)
+                & (lat[indexes] <= lat2)
+            )
+            indexes = indexes[inside]
+
+            height = distance(lat1, lon1, lat2, lon1)
+            width = distance(lat1, lon1, lat1, lon2)
+            split_lat = (height + window_overlap) / 2 >= min_area[0]
+            split_lon = (width + window_overlap) / 2 >= min_area[1]
+
+            if weights[indexes].sum() <= target_points or not (split_lat or split_lon):
+                result.append([lon1, lon2, lat1, lat2])
+                continue
+
+            # Halves overlapping by window_overlap meters
+            lat_bounds = [(lat1, lat2)]
+            if split_lat:
+                mid, half = (lat1 + lat2) / 2, (lat2 - lat1) * window_overlap / height / 2
+                lat_bounds = [(lat1, mid + half), (mid - half, lat2)]
+            lon_bounds = [(lon1, lon2)]
+            if split_lon:
+                mid, half = (lon1 + lon2) / 2, (lon2 - lon1) * window_overlap / width / 2
+                lon_bounds = [(lon1, mid + half), (mid - half, lon2)]
+
+            # Reversed, so that the sub-windows are popped in the split_window order
+            for sub_lat1, sub_lat2 in reversed(lat_bounds):
+                for sub_lon1, sub_lon2 in reversed(lon_bounds):
+                    stack.append(((sub_lon1, sub_lon2, sub_lat1, sub_lat2), indexes))
+
+    return order_windows_coordinates(np.array(result, dtype=np.float64))
+
+
+def adaptive_split_window(
+    cfg: SetupConfig, bucket: Bucket, orig_window: List[float]
+) -> NDArray[np.float64]:
+    """
+    Splits orig_window into sub-windows holding about the same number of graph points: the window_split_area grid
+    is split further where the roads are dense, so that each sub-window takes about the same time to process.
+    The sub-windows are saved in the output folder of the area and reused, so their indexes stay the same when a
+    build is resumed.
+    Args:
+        cfg: configuration object
+        bucket: cloud bucket instance
+        orig_window: array of original window coordinates - bottom left and upper right lat/lon coordinates
+
+    Returns:
+        np.ndarray[num_sub_windows, 4] -> the order on last axis is: (min_lon, max_lon, min_lat, max_lat)
+    """
+
+    windows_path = f"{cfg.area.output_path}/{WINDOWS_FILENAME}"
+    if bucket.blob(windows_path).exists():
+        windows = np.array(read_json_gcs(bucket, windows_path)["windows"])
+        logger.info(f"Window planner -- Reusing the {len(windows)} saved sub-windows")
+        return windows
+
+    # Coarse grid, then split where needed
+    grid = split_window(orig_window, list(cfg.window_split_area), cfg.window_overlap)
+    try:
+        lat, lon, weights = get_density_points(cfg, bucket, orig_window)
+    except requests.RequestException as e:
+        # Without the road density, fall back to the uniform split
+        logger.warning(
+            f"Window planner -- Road density not available ({e}), using the {len(grid)} uniform sub-windows"
+        )
+        windows = grid
+    else:
+        windows = quadtree_split(
+            grid,
+            lat,
+            lon,
+            weights,
+            cfg.window_target_points,
+            cfg.window_min_area,
+            cfg.window_overlap,
+        )
+        logger.info(
+            f"Window planner -- Split {len(grid)} sub-windows into {len(windows)}, "
+            f"for about {weights.sum():.0f} points ({cfg.window_target_points} per sub-window)"
+        )
+
+    upload_json_to_gcs(bucket, windows_path, {"windows": windows.tolist()})
+
+    return windows
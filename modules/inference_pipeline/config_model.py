@@ -69,6 +69,8 @@ class SetupConfig:
     buildings_database_path: str
     models_database_path: str
     training_database_path: str
+    metadata_cache_path: str
+    image_store_path: str
 
     # Settings
     sv_name: str
@@ -78,6 +80,13 @@ class SetupConfig:
     force_compute_graph: bool
     window_split_area: List[float]
     window_overlap: int
+    window_split: str
+    window_density_source: str
+    window_target_points: int
+    window_min_area: List[float]
+    metadata_cache: bool
+    metadata_cache_ttl_days: int
+    image_store: bool
     cloud_logger: bool
     viz: bool
 
@@ -1,8 +1,10 @@
+import io
 import json
 
 import cv2
 import geopandas as gpd
 import numpy as np
+import pandas as pd
 import shapefile
 from google.cloud import storage
 from google.cloud.storage import Bucket
@@ -141,3 +143,32 @@ def read_shapefiles(polygons_base_path: str, bucket: Bucket) -> gpd.GeoDataFrame
     gdf = gpd.GeoDataFrame(attributes, geometry=geometries).set_crs("epsg:4326")
 
     return gdf
+
+
+def read_image_manifest(bucket: Bucket, data_path: str) -> pd.DataFrame:
+    """
+    Reads the image manifest of an area (written by the retrieve action of the feature pipeline), from all its
+    Parquet parts: one row per image name, with the blob storing it (key) and its lat/lon
+    Args:
+        bucket: GCS bucket
+        data_path: data path of the area
+
+    Returns:
+        DataFrame of the images, empty if the area has no manifest
+    """
+    parts = [
+        pd.read_parquet(io.BytesIO(blob.download_as_bytes()))
+        for blob in sorted(
+            bucket.list_blobs(prefix=f"{data_path}/images_manifest/"),
+            key=lambda blob: blob.name,
+        )
+        if blob.name.endswith(".parquet")
+    ]
+    if not parts:
+        return pd.DataFrame(columns=["name", "key", "lat", "lon"])
+
+    return (
+        pd.concat(parts, ignore_index=True)
+        .drop_duplicates(subset="name", keep="last")
+        .reset_index(drop=True)
+    )
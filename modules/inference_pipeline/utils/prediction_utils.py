@@ -8,9 +8,10 @@ from typing import Dict, List
 
 import cv2
 import numpy as np
+import shapely
 import supervision as sv
 import tqdm
-from cloud_utils import upload_json_to_gcs
+from cloud_utils import read_image_manifest, upload_json_to_gcs
 from config_model import SetupConfig
 from dataset_utils import CloudDetectionDataset
 from google.cloud.storage import Bucket
@@ -340,6 +341,22 @@ def predict(cfg: SetupConfig, bucket: Bucket):
     sampled_annotations = {}
     sampled_img_paths = []
 
+    # Images of the area listed in its manifest (stored in the image store), inside the polygon
+    polygon = Polygon(cfg.area.polygon)
+    image_manifest = read_image_manifest(bucket, cfg.area.data_path)
+    in_polygon = shapely.contains_xy(
+        polygon,
+        image_manifest["lat"].to_numpy(np.float64),
+        image_manifest["lon"].to_numpy(np.float64),
+    )
+    image_blobs = {
+        f"{images_path}/{name}": key
+        for name, key in zip(
+            image_manifest["name"][in_polygon].tolist(),
+            image_manifest["key"][in_polygon].tolist(),
+        )
+    }
+
     # Get all images paths in bucket
     image_extensions = {".jpg", ".jpeg", ".png"}
     blobs = bucket.list_blobs(prefix=images_path)
@@ -349,8 +366,6 @@ def predict(cfg: SetupConfig, bucket: Bucket):
         if any(blob.name.lower().endswith(ext) for ext in image_extensions)
     ]
 
-    # Define Polygon
-    polygon = Polygon(cfg.area.polygon)
     logger.info(f"Polygon is {polygon}")
 
     # Condition to filter older images formats (e.g. that missed the heading in the naming -> legacy), and pictures inside defined polygon
@@ -366,8 +381,9 @@ def predict(cfg: SetupConfig, bucket: Bucket):
             point = Point(lat, lon)
 
             # Check if the point is inside the polygon
-            if polygon.contains(point):
+            if polygon.contains(point) and img_blob not in image_blobs:
                 clean_image_files.append(img_blob)
+    clean_image_files.extend(image_blobs)
 
     logger.info(f"Predicting for {len(clean_image_files)} images...")
 
@@ -379,9 +395,13 @@ def predict(cfg: SetupConfig, bucket: Bucket):
         ):
             logger.info(f"{annotations_filename} - Processing batch index {i}...")
 
-            # Get images
+            # Get images (from the blobs storing them)
             batch_files = clean_image_files[i : i + batch_size]
-            downloaded_data = asyncio.run(fetch_images(bucket, batch_files))
+            downloaded_data = asyncio.run(
+                fetch_images(
+                    bucket, [image_blobs.get(file, file) for file in batch_files]
+                )
+            )
 
             # Decode them
             batch_images = [
@@ -405,7 +425,7 @@ def predict(cfg: SetupConfig, bucket: Bucket):
                 process_batch(
                     i,
                     batch_images,
-                    [data[1] for data in downloaded_data],
+                    list(batch_files),
                     result,
                     bounding_box_annotator,
                     label_annotator,
@@ -2,6 +2,7 @@ import io
 import json
 import math
 import time
+from typing import Dict
 
 import cv2
 import geopandas as gpd
@@ -294,3 +295,45 @@ def read_json_gcs(bucket: Bucket, source_file: str) -> dict:
     json_data = json.loads(json_content)
 
     return json_data
+
+
+def read_image_manifest(bucket: Bucket, data_path: str) -> pd.DataFrame:
+    """
+    Reads the image manifest of an area (written by the retrieve action of the feature pipeline), from all its
+    Parquet parts: one row per image name, with the blob storing it (key)
+    Args:
+        bucket: GCS bucket
+        data_path: data path of the area
+
+    Returns:
+        DataFrame of the images, empty if the area has no manifest
+    """
+    parts = [
+        pd.read_parquet(io.BytesIO(blob.download_as_bytes()))
+        for blob in sorted(
+            bucket.list_blobs(prefix=f"{data_path}/images_manifest/"),
+            key=lambda blob: blob.name,
+        )
+        if blob.name.endswith(".parquet")
+    ]
+    if not parts:
+        return pd.DataFrame(columns=["name", "key"])
+
+    return (
+        pd.concat(parts, ignore_index=True)
+        .drop_duplicates(subset="name", keep="last")
+        .reset_index(drop=True)
+    )
+
+
+def get_image_blobs(bucket: Bucket, data_path: str, images_path: str) -> Dict[str, str]:
+    """
+    Maps the image paths of an area (<images_path>/<name>) to the blobs storing them, from its image manifest.
+    Images missing from the mapping are stored under their own path.
+    """
+    manifest = read_image_manifest(bucket, data_path)
+
+    return {
+        f"{images_path}/{name}": key
+        for name, key in zip(manifest["name"].tolist(), manifest["key"].tolist())
+    }
@@ -11,6 +11,7 @@ import pandas as pd
 import supervision as sv
 import tqdm
 from cloud_utils import (
+    get_image_blobs,
     read_image_from_gcs_opencv,
     upload_array_as_jpg,
     upload_json_to_gcs,
@@ -204,6 +205,13 @@ def find_duplicates(cfg, bucket, apis):
             bucket=bucket,
         )
 
+    # Blobs of the images kept in the image store
+    image_blobs = (
+        {}
+        if local_ann_file_path
+        else get_image_blobs(bucket, cfg.area.data_path, images_path)
+    )
+
     logger.info("Dataset loaded")
 
     # Find neighbouring images
@@ -259,8 +267,12 @@ def find_duplicates(cfg, bucket, apis):
                 )
 
             # Read images from cloud
-            img1 = read_image_from_gcs_opencv(bucket, img_name1_cloud)
-            img2 = read_image_from_gcs_opencv(bucket, img_name2_cloud)
+            img1 = read_image_from_gcs_opencv(
+                bucket, image_blobs.get(img_name1_cloud, img_name1_cloud)
+            )
+            img2 = read_image_from_gcs_opencv(
+                bucket, image_blobs.get(img_name2_cloud, img_name2_cloud)
+            )
 
         for class_name in export_classes_name:
             # Filter detections by class
@@ -11,7 +11,12 @@ import numpy as np
 import pandas as pd
 import supervision as sv
 import tqdm
-from cloud_utils import get_bucket, read_image_from_gcs_opencv, upload_dataframe_to_gcs
+from cloud_utils import (
+    get_bucket,
+    get_image_blobs,
+    read_image_from_gcs_opencv,
+    upload_dataframe_to_gcs,
+)
 from config_model import SetupConfig
 from dataset_utils import CloudDetectionDataset
 from general_utils import filepath_from_roboflow
@@ -189,18 +194,20 @@ def process_image(
     bounding_box_annotator,
     label_annotator,
     cfg,
-    public_image,
+    public_bucket,
     export_cfg,
     ann_name_core,
     roboflow_chr=None,
     roboflow_positions=None,
+    image_blobs=None,
 ):
     # Get image array
     if from_roboflow:
         img_path = filepath_from_roboflow(img_path, roboflow_chr, roboflow_positions)
 
-    # Read image from cloud
-    image = read_image_from_gcs_opencv(bucket, img_path)
+    # Read image from cloud (from the image store if it is kept there)
+    image_blob = image_blobs.get(img_path, img_path) if image_blobs else img_path
+    image = read_image_from_gcs_opencv(bucket, image_blob)
 
     # Filter detections by class
     good_indices = np.isin(
@@ -235,13 +242,11 @@ def process_image(
     img_path = set_annotated_image_path(img_path, from_roboflow)
 
     # Get blob depending on the bucket status (private or public)
-    if public_image:
+    if public_bucket is not None:
         destination_blob_name = (
             f"{os.path.dirname(img_path)}/{ann_name_core}/{os.path.basename(img_path)}"
         )
-        blob = get_bucket(cfg.public_bucket_name, cfg.project_id).blob(
-            destination_blob_name
-        )
+        blob = public_bucket.blob(destination_blob_name)
         # Check for existence of this blob, and raise error to not overwrite it, if so
         if blob.exists():
             text_error = (
@@ -280,7 +285,7 @@ def process_image(
             time.sleep(5)
             n_attempts += 1
 
-    if public_image:
+    if public_bucket is not None:
         url = f"https://storage.googleapis.com/{cfg.public_bucket_name}/{destination_blob_name}"
     else:
         # Generate a signed URL valid for 7 days (10079 minutes)
@@ -434,6 +439,14 @@ def export_to_client(cfg: SetupConfig, bucket: Bucket) -> None:
 
     logger.info(f"Started annotating images for export...")
 
+    # Public bucket, shared by all the images
+    public_bucket = None
+    if public_image:
+        public_bucket = get_bucket(cfg.public_bucket_name, cfg.project_id)
+
+    # Blobs of the images kept in the image store
+    image_blobs = get_image_blobs(bucket, cfg.area.data_path, images_path)
+
     # Use ThreadPoolExecutor to process images in parallel
     with ThreadPoolExecutor(max_workers=8) as executor:
         futures = []
@@ -450,11 +463,12 @@ def export_to_client(cfg: SetupConfig, bucket: Bucket) -> None:
                     bounding_box_annotator,
                     label_annotator,
                     cfg,
-                    public_image,
+                    public_bucket,
                     export_cfg,
                     ann_name_core,
                     roboflow_chr,
                     roboflow_positions,
+                    image_blobs,
                 )
             )
 
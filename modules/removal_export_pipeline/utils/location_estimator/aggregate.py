@@ -1,4 +1,5 @@
 import numpy as np
+from geo_utils import from_enu, to_enu
 from location_estimator.latlng import LatLng
 
 
@@ -10,8 +11,6 @@ def aggregate(objects, min_distance_between_shops: int = 8):
     threshold_1 = threshold_2 / 2
 
     num = len(objects)
-    px = np.zeros(num)
-    py = np.zeros(num)
     rho = np.zeros(num)
     alat = np.zeros(num)
     alng = np.zeros(num)
@@ -22,10 +21,11 @@ def aggregate(objects, min_distance_between_shops: int = 8):
     if num < 1:
         return []
 
-    for i in range(1, num):
-        xy = objects[0].get_xy(objects[i])
-        px[i] = xy.x
-        py[i] = xy.y
+    # Project all objects around the first one, at once
+    lat0, lng0 = objects[0].lat, objects[0].lng
+    lats = np.array([o.lat for o in objects])
+    lngs = np.array([o.lng for o in objects])
+    px, py = to_enu(lats, lngs, lat0, lng0)
 
     for i in range(num):
         s = 1
@@ -43,9 +43,7 @@ def aggregate(objects, min_distance_between_shops: int = 8):
                 image[i].append(objects[j].image)
                 ann_id[i].append(objects[j].id)
         rho[i] = s + np.random.rand() * 0.01
-        ll = objects[0].get_latlng(ave_x / s, ave_y / s)
-        alat[i] = ll.lat
-        alng[i] = ll.lng
+        alat[i], alng[i] = from_enu(ave_x / s, ave_y / s, lat0, lng0)
 
     dis = np.zeros(num)
 
@@ -1,4 +1,4 @@
-import math
+from geo_utils import distance, from_enu, to_enu
 
 
 class Cartesian:
@@ -16,17 +16,12 @@ class LatLng:
         self.id = None
 
     def get_latlng(self, x, y):
-        return LatLng(
-            self.lat + y / 111300.0,
-            self.lng + x / 111300.0 / math.cos(self.lat / 180.0 * math.pi),
-        )
+        lat, lng = from_enu(x, y, self.lat, self.lng)
+        return LatLng(float(lat), float(lng))
 
     def get_xy(self, latlng):
-        return Cartesian(
-            (latlng.lng - self.lng) * 111300.0 * math.cos(self.lat / 180.0 * math.pi),
-            (latlng.lat - self.lat) * 111300.0,
-        )
+        x, y = to_enu(latlng.lat, latlng.lng, self.lat, self.lng)
+        return Cartesian(float(x), float(y))
 
     def get_distance(self, latlng):
-        p = self.get_xy(latlng)
-        return math.sqrt(p.x * p.x + p.y * p.y)
+        return float(distance(self.lat, self.lng, latlng.lat, latlng.lng))
@@ -17,6 +17,8 @@ YELLOW='\033[1;33m'
 BLUE='\033[0;34m'
 NC='\033[0m'
 
+source "$(dirname "$0")/graph_merge_common.sh"
+
 # Variables globales pour les statistiques
 TOTAL_IMAGES=0
 TOTAL_ANNOTATIONS=0
@@ -71,6 +73,9 @@ if ! command -v jq &> /dev/null; then
     fi
 fi
 
+# Vérifier les outils de fusion des graphes
+check_graph_tools
+
 # Vérifier Python et pandas
 if python3 -c "import pandas" &>/dev/null; then
     PANDAS_AVAILABLE=true
@@ -201,30 +206,23 @@ fi
 echo -e "\n${BLUE}5. Fusion des graphes OSM...${NC}"
 
 osm_count=0
-echo '{"nodes": [], "adjacency": []}' > temp/osm_merged.json
+mkdir -p temp/osm
 
 for i in {1..135}; do
     echo -ne "\rTraitement ward $i/135..."
     
-    osm_file="gs://${BUCKET}/${SOURCE_BASE}/johannesburg_custom_ward_${i}/data/osm_merged.json"
+    osm_file="gs://${BUCKET}/${SOURCE_BASE}/johannesburg_custom_ward_${i}/data/OSM_map_merged"
     
-    if gcloud storage ls "$osm_file" &>/dev/null; then
-        gcloud storage cp "$osm_file" "temp/osm/osm_${i}.json" -q
-        
-        # Fusionner
-        jq -s '.[0] as $merged | .[1] as $new | {
-            nodes: ($merged.nodes + ($new.nodes // [])),
-            adjacency: ($merged.adjacency + ($new.adjacency // []))
-        }' temp/osm_merged.json "temp/osm/osm_${i}.json" > temp/osm_tmp.json
-        
-        mv temp/osm_tmp.json temp/osm_merged.json
-        rm "temp/osm/osm_${i}.json"
+    if download_graph "$osm_file" "temp/osm/osm_${i}"; then
         ((osm_count++))
     fi
 done
 
 if [ $osm_count -gt 0 ]; then
-    TOTAL_OSM_NODES=$(jq '.nodes | length' temp/osm_merged.json)
+    # Fusionner
+    merge_graphs temp/osm temp/osm_merged
+    TOTAL_OSM_NODES=$(graph_stat temp/osm_merged_stats.json final_nodes)
+    gcloud storage cp temp/osm_merged.graph "gs://${BUCKET}/${DEST_PATH}/graphs/osm_merged_all.graph"
     gcloud storage cp temp/osm_merged.json "gs://${BUCKET}/${DEST_PATH}/graphs/osm_merged_all.json"
     echo -e "\n${GREEN}✓ Graphes OSM fusionnés : $osm_count fichiers, $TOTAL_OSM_NODES nœuds${NC}"
 else
@@ -237,29 +235,22 @@ fi
 echo -e "\n${BLUE}6. Fusion des graphes Street View...${NC}"
 
 sv_count=0
-echo '{"nodes": [], "adjacency": []}' > temp/sv_merged.json
+mkdir -p temp/sv
 
 for i in {1..135}; do
     echo -ne "\rTraitement ward $i/135..."
     
-    sv_file="gs://${BUCKET}/${SOURCE_BASE}/johannesburg_custom_ward_${i}/data/sv_merged.json"
+    sv_file="gs://${BUCKET}/${SOURCE_BASE}/johannesburg_custom_ward_${i}/data/SV_map_merged"
     
-    if gcloud storage ls "$sv_file" &>/dev/null; then
-        gcloud storage cp "$sv_file" "temp/sv/sv_${i}.json" -q
-        
-        jq -s '.[0] as $merged | .[1] as $new | {
-            nodes: ($merged.nodes + ($new.nodes // [])),
-            adjacency: ($merged.adjacency + ($new.adjacency // []))
-        }' temp/sv_merged.json "temp/sv/sv_${i}.json" > temp/sv_tmp.json
-        
-        mv temp/sv_tmp.json temp/sv_merged.json
-        rm "temp/sv/sv_${i}.json"
+    if download_graph "$sv_file" "temp/sv/sv_${i}"; then
         ((sv_count++))
     fi
 done
 
 if [ $sv_count -gt 0 ]; then
-    TOTAL_SV_NODES=$(jq '.nodes | length' temp/sv_merged.json)
+    merge_graphs temp/sv temp/sv_merged
+    TOTAL_SV_NODES=$(graph_stat temp/sv_merged_stats.json final_nodes)
+    gcloud storage cp temp/sv_merged.graph "gs://${BUCKET}/${DEST_PATH}/graphs/sv_merged_all.graph"
     gcloud storage cp temp/sv_merged.json "gs://${BUCKET}/${DEST_PATH}/graphs/sv_merged_all.json"
     echo -e "\n${GREEN}✓ Graphes SV fusionnés : $sv_count fichiers, $TOTAL_SV_NODES points${NC}"
 else
@@ -436,8 +427,8 @@ cat > temp/consolidation_report.html << EOF
         <h2>Fichiers créés</h2>
         <ul>
             <li class="success">✓ Annotations fusionnées : annotations_all_wards.json</li>
-            <li class="$([ $osm_count -gt 0 ] && echo 'success' || echo 'error')">$([ $osm_count -gt 0 ] && echo '✓' || echo '✗') Graphe OSM : osm_merged_all.json</li>
-            <li class="$([ $sv_count -gt 0 ] && echo 'success' || echo 'error')">$([ $sv_count -gt 0 ] && echo '✓' || echo '✗') Graphe SV : sv_merged_all.json</li>
+            <li class="$([ $osm_count -gt 0 ] && echo 'success' || echo 'error')">$([ $osm_count -gt 0 ] && echo '✓' || echo '✗') Graphe OSM : osm_merged_all.graph</li>
+            <li class="$([ $sv_count -gt 0 ] && echo 'success' || echo 'error')">$([ $sv_count -gt 0 ] && echo '✓' || echo '✗') Graphe SV : sv_merged_all.graph</li>
             <li class="$([ $csv_count -gt 0 ] && echo 'success' || echo 'error')">$([ $csv_count -gt 0 ] && echo '✓' || echo '✗') Deliverables : all_wards.csv</li>
         </ul>
         
@@ -476,8 +467,8 @@ echo "Structure :"
 echo "  ├── annotations/"
 echo "  │   └── annotations_all_wards.json"
 echo "  ├── graphs/"
-echo "  │   ├── osm_merged_all.json"
-echo "  │   └── sv_merged_all.json"
+echo "  │   ├── osm_merged_all.graph (+ .json)"
+echo "  │   └── sv_merged_all.graph (+ .json)"
 echo "  ├── deliverables/"
 echo "  │   └── all_wards.csv"
 echo "  ├── stats/"
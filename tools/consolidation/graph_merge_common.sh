@@ -0,0 +1,42 @@
+#!/bin/bash
+# Fonctions communes de fusion des graphes (format .graph du feature pipeline)
+# A sourcer depuis les scripts de consolidation : source "$(dirname "$0")/graph_merge_common.sh"
+
+FEATURE_PIPELINE="$(cd "$(dirname "${BASH_SOURCE[0]}")/../../modules/feature_pipeline" && pwd)"
+export PYTHONPATH="${FEATURE_PIPELINE}:${FEATURE_PIPELINE}/utils:${FEATURE_PIPELINE}/osm_utils${PYTHONPATH:+:${PYTHONPATH}}"
+
+# Vérifier que les dépendances du feature pipeline sont installées
+check_graph_tools() {
+    if ! python3 -c "import merge_utils" &>/dev/null; then
+        echo "ERREUR : Les dépendances du feature pipeline ne sont pas installées"
+        echo "Installez-les avec : cd ${FEATURE_PIPELINE} && poetry install"
+        exit 1
+    fi
+}
+
+# Télécharger le graphe d'un ward : .graph, ou graphe JSON des zones construites avant le format .graph
+# $1 : chemin GCS du graphe sans extension, $2 : fichier local sans extension
+download_graph() {
+    if gcloud storage ls "$1.graph" &>/dev/null; then
+        gcloud storage cp "$1.graph" "$2.graph" -q
+    elif gcloud storage ls "$1.json" &>/dev/null; then
+        gcloud storage cp "$1.json" "$2.json" -q
+    else
+        return 1
+    fi
+}
+
+# Fusionner les graphes d'un dossier
+# $1 : dossier des graphes, $2 : fichier de sortie sans extension (.graph, export .json et statistiques _stats.json)
+merge_graphs() {
+    python3 "${FEATURE_PIPELINE}/tools/merge_graphs.py" "$2.graph" "$1" --json "$2.json" --stats "$2_stats.json"
+}
+
+# Lire une statistique de fusion ($1 : fichier de statistiques, $2 : clé)
+graph_stat() {
+    if [ -f "$1" ]; then
+        python3 -c "import json, sys; print(json.load(open(sys.argv[1]))[sys.argv[2]])" "$1" "$2"
+    else
+        echo 0
+    fi
+}
@@ -16,13 +16,15 @@ YELLOW='\033[1;33m'
 BLUE='\033[0;34m'
 NC='\033[0m'
 
+source "$(dirname "$0")/graph_merge_common.sh"
+
 echo -e "${YELLOW}========================================${NC}"
 echo -e "${YELLOW}   FUSION COMPLETE JOHANNESBURG${NC}"
 echo -e "${YELLOW}========================================${NC}"
 echo ""
 echo "Fichiers à fusionner :"
-echo "  ✓ OSM_map_merged.json"
-echo "  ✓ SV_map_merged.json"
+echo "  ✓ OSM_map_merged.graph"
+echo "  ✓ SV_map_merged.graph"
 echo "  ✓ Annotations"
 echo "  ✓ card_main.html (stats)"
 echo "  ✓ Deliverables"
@@ -46,39 +48,21 @@ if ! command -v jq &> /dev/null; then
     fi
 fi
 
+check_graph_tools
+
 # ========================================
-# 1. FUSIONNER OSM_map_merged.json
+# 1. FUSIONNER OSM_map_merged.graph
 # ========================================
-echo -e "\n${BLUE}1. Fusion des fichiers OSM_map_merged.json...${NC}"
+echo -e "\n${BLUE}1. Fusion des graphes OSM_map_merged.graph...${NC}"
 
 osm_count=0
-# Initialiser avec la structure correcte
-echo '{"directed": false, "multigraph": false, "graph": [], "nodes": [], "links": []}' > temp/osm_merged.json
 
 for i in {1..135}; do
     echo -ne "\rTraitement ward $i/135..."
     
-    osm_file="gs://${BUCKET}/${SOURCE_BASE}/johannesburg_custom_ward_${i}/data/OSM_map_merged.json"
+    osm_file="gs://${BUCKET}/${SOURCE_BASE}/johannesburg_custom_ward_${i}/data/OSM_map_merged"
     
-    if gcloud storage ls "$osm_file" &>/dev/null; then
-        # Télécharger
-        gcloud storage cp "$osm_file" "temp/osm/osm_${i}.json" -q
-        
-        # Fusionner les nœuds et liens
-        jq -s '
-            .[0] as $merged | 
-            .[1] as $new | 
-            {
-                directed: false,
-                multigraph: false,
-                graph: [],
-                nodes: ($merged.nodes + $new.nodes),
-                links: (($merged.links // []) + ($new.links // []))
-            }
-        ' temp/osm_merged.json "temp/osm/osm_${i}.json" > temp/osm_tmp.json
-        
-        mv temp/osm_tmp.json temp/osm_merged.json
-        rm "temp/osm/osm_${i}.json"
+    if download_graph "$osm_file" "temp/osm/osm_${i}"; then
         ((osm_count++))
     fi
 done
@@ -86,49 +70,33 @@ done
 echo -e "\n$osm_count fichiers OSM trouvés"
 
 if [ $osm_count -gt 0 ]; then
-    # Dédoublonner les nœuds par ID
-    echo "Dédoublonnage des nœuds OSM..."
-    jq '.nodes |= unique_by(.id)' temp/osm_merged.json > temp/osm_dedup.json
+    # Fusionner et dédoublonner les nœuds
+    echo "Fusion et dédoublonnage des nœuds OSM..."
+    merge_graphs temp/osm temp/osm_merged
     
-    nodes_count=$(jq '.nodes | length' temp/osm_dedup.json)
-    links_count=$(jq '.links | length // 0' temp/osm_dedup.json)
+    nodes_count=$(graph_stat temp/osm_merged_stats.json final_nodes)
+    links_count=$(graph_stat temp/osm_merged_stats.json final_edges)
     
     echo -e "${GREEN}✓ OSM : $nodes_count nœuds uniques, $links_count liens${NC}"
     
     # Upload
-    gcloud storage cp temp/osm_dedup.json "gs://${BUCKET}/${DEST_PATH}/OSM_map_merged_all.json"
+    gcloud storage cp temp/osm_merged.graph "gs://${BUCKET}/${DEST_PATH}/OSM_map_merged_all.graph"
+    gcloud storage cp temp/osm_merged.json "gs://${BUCKET}/${DEST_PATH}/OSM_map_merged_all.json"
 fi
 
 # ========================================
-# 2. FUSIONNER SV_map_merged.json
+# 2. FUSIONNER SV_map_merged.graph
 # ========================================
-echo -e "\n${BLUE}2. Fusion des fichiers SV_map_merged.json...${NC}"
+echo -e "\n${BLUE}2. Fusion des graphes SV_map_merged.graph...${NC}"
 
 sv_count=0
-echo '{"directed": false, "multigraph": false, "graph": [], "nodes": [], "links": []}' > temp/sv_merged.json
 
 for i in {1..135}; do
     echo -ne "\rTraitement ward $i/135..."
     
-    sv_file="gs://${BUCKET}/${SOURCE_BASE}/johannesburg_custom_ward_${i}/data/SV_map_merged.json"
+    sv_file="gs://${BUCKET}/${SOURCE_BASE}/johannesburg_custom_ward_${i}/data/SV_map_merged"
     
-    if gcloud storage ls "$sv_file" &>/dev/null; then
-        gcloud storage cp "$sv_file" "temp/sv/sv_${i}.json" -q
-        
-        jq -s '
-            .[0] as $merged | 
-            .[1] as $new | 
-            {
-                directed: false,
-                multigraph: false,
-                graph: [],
-                nodes: ($merged.nodes + $new.nodes),
-                links: (($merged.links // []) + ($new.links // []))
-            }
-        ' temp/sv_merged.json "temp/sv/sv_${i}.json" > temp/sv_tmp.json
-        
-        mv temp/sv_tmp.json temp/sv_merged.json
-        rm "temp/sv/sv_${i}.json"
+    if download_graph "$sv_file" "temp/sv/sv_${i}"; then
         ((sv_count++))
     fi
 done
@@ -136,17 +104,18 @@ done
 echo -e "\n$sv_count fichiers SV trouvés"
 
 if [ $sv_count -gt 0 ]; then
-    # Dédoublonner
-    echo "Dédoublonnage des points SV..."
-    jq '.nodes |= unique_by(.id)' temp/sv_merged.json > temp/sv_dedup.json
+    # Fusionner et dédoublonner
+    echo "Fusion et dédoublonnage des points SV..."
+    merge_graphs temp/sv temp/sv_merged
     
-    nodes_count=$(jq '.nodes | length' temp/sv_dedup.json)
-    links_count=$(jq '.links | length // 0' temp/sv_dedup.json)
+    nodes_count=$(graph_stat temp/sv_merged_stats.json final_nodes)
+    links_count=$(graph_stat temp/sv_merged_stats.json final_edges)
     
     echo -e "${GREEN}✓ SV : $nodes_count points uniques, $links_count liens${NC}"
     
     # Upload
-    gcloud storage cp temp/sv_dedup.json "gs://${BUCKET}/${DEST_PATH}/SV_map_merged_all.json"
+    gcloud storage cp temp/sv_merged.graph "gs://${BUCKET}/${DEST_PATH}/SV_map_merged_all.graph"
+    gcloud storage cp temp/sv_merged.json "gs://${BUCKET}/${DEST_PATH}/SV_map_merged_all.json"
 fi
 
 # ========================================
@@ -422,8 +391,8 @@ cat > temp/consolidation_report.json << EOF
     "consolidation_date": "$(date -u +%Y-%m-%d\ %H:%M:%S) UTC",
     "total_wards": $TOTAL_WARDS,
     "files_processed": {
-        "osm_json": $osm_count,
-        "sv_json": $sv_count,
+        "osm_graphs": $osm_count,
+        "sv_graphs": $sv_count,
         "annotation_files": $annotation_count,
         "card_html": $card_count,
         "osm_html": $osm_html_count,
@@ -432,13 +401,15 @@ cat > temp/consolidation_report.json << EOF
         "csv_files": $csv_count
     },
     "statistics": {
-        "osm_nodes": $([ -f temp/osm_dedup.json ] && jq '.nodes | length' temp/osm_dedup.json || echo 0),
-        "sv_nodes": $([ -f temp/sv_dedup.json ] && jq '.nodes | length' temp/sv_dedup.json || echo 0),
+        "osm_nodes": $(graph_stat temp/osm_merged_stats.json final_nodes),
+        "sv_nodes": $(graph_stat temp/sv_merged_stats.json final_nodes),
         "total_images": $([ -f temp/annotations_merged.json ] && jq '.images | length' temp/annotations_merged.json || echo 0),
         "total_annotations": $([ -f temp/annotations_merged.json ] && jq '.annotations | length' temp/annotations_merged.json || echo 0)
     },
     "output_files": [
+        "OSM_map_merged_all.graph",
         "OSM_map_merged_all.json",
+        "SV_map_merged_all.graph",
         "SV_map_merged_all.json",
         "annotations_merged_all.json",
         "deliverables_merged.xlsx",
@@ -468,8 +439,8 @@ echo -e "${YELLOW}       FUSION TERMINÉE !${NC}"
 echo -e "${YELLOW}========================================${NC}"
 echo ""
 echo -e "${GREEN}Fichiers traités :${NC}"
-echo "  • OSM JSON : $osm_count/135"
-echo "  • SV JSON : $sv_count/135"
+echo "  • Graphes OSM : $osm_count/135"
+echo "  • Graphes SV : $sv_count/135"
 echo "  • Annotations : $annotation_count/135"
 echo "  • Cartes HTML : $card_count/135"
 echo "  • OSM HTML : $osm_html_count/135"
@@ -480,8 +451,8 @@ echo ""
 echo -e "${GREEN}Fichiers créés dans :${NC}"
 echo -e "${BLUE}gs://${BUCKET}/${DEST_PATH}/${NC}"
 echo ""
-echo "  ├── OSM_map_merged_all.json"
-echo "  ├── SV_map_merged_all.json"
+echo "  ├── OSM_map_merged_all.graph (+ .json)"
+echo "  ├── SV_map_merged_all.graph (+ .json)"
 echo "  ├── annotations_merged_all.json"
 echo "  ├── deliverables_merged.xlsx"
 echo "  ├── deliverables_merged.csv"